@@ -168,6 +168,9 @@ EOF
             echo "  PID 文件: server/gunicorn.pid"
             echo "  访问日志: logs/gunicorn_access.log"
             echo "  错误日志: logs/gunicorn_error.log"
+            echo "  定时任务: Gunicorn 下不启动后台定时线程，请用 cron 每天执行库存快照和变更日志清理"
+            echo "    cd $(pwd) && $PYTHON_CMD -m flask --app main take-inventory-snapshot"
+            echo "    cd $(pwd) && $PYTHON_CMD -m flask --app main prune-change-log"
             cd ..
             ;;
             
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: inventory_api.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import logging
+from flask import Blueprint, request, jsonify, abort
+from services.inventory_service import InventoryService
+from dbs.db_manager import DBManager
+from dbs.models import OperationRecord
+
+
+logger = logging.getLogger(__name__)
+inventory_bp = Blueprint('inventory', __name__)
+inventory_service = InventoryService()
+db = DBManager()
+
+
+@inventory_bp.route('/inventory/as-of')
+def get_inventory_as_of():
+    """查询指定日期日终库存"""
+    date_str = request.args.get('date', '').strip()
+    if not date_str:
+        logger.warning('按时间点查询库存失败: 缺少日期')
+        abort(400, description='缺少日期参数')
+    
+    result = inventory_service.get_inventory_as_of(date_str)
+    if not result.get('success'):
+        abort(400, description=result.get('message', '查询失败'))
+    return jsonify(result)
+
+
+@inventory_bp.route('/inventory/snapshots')
+def get_snapshots():
+    """获取库存快照列表"""
+    limit = request.args.get('limit', 30, type=int)
+    return jsonify(inventory_service.get_snapshots(limit))
+
+
+@inventory_bp.route('/inventory/snapshots', methods=['POST'])
+def take_snapshot():
+    """手动记录库存快照"""
+    data = request.json or {}
+    username = data.get('username', '')
+    
+    result = inventory_service.take_snapshot()
+    
+    if result.get('success'):
+        with db.session_scope() as session:
+            session.add(OperationRecord(
+                operation_type='库存快照',
+                name='系统操作',
+                quantity=0,
+                detail=f'手动记录库存快照: {result["snapshot_id"]}',
+                username=username
+            ))
+    return jsonify(result)
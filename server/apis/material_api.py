@@ -18,6 +18,8 @@ from werkzeug.utils import secure_filename
 from services.material_service import MaterialService
 from dbs.db_manager import DBManager
 from dbs.models import OperationRecord
+from utils.http_utils import get_expected_version, get_pagination, get_list_filters, get_fields, is_columnar, get_request_data, get_stream_format, conditional_get
+from utils.serialization import stream_response
 from config import Config
 
 
@@ -81,16 +83,35 @@ def add_material():
 
 
 @material_bp.route('/materials')
+@conditional_get(db, 'material', 'product_material')
 def get_materials():
+    filters = get_list_filters()
+    filters['reference_filter'] = request.args.get('reference_filter', '')
+    fields = get_fields(material_service.FIELDS)
+    columnar = is_columnar()
+    pagination = get_pagination()
+    stream_format = get_stream_format()
+    
+    # 不分页时可用 ?stream=ndjson|json 边读游标边写出，不物化完整列表
+    if stream_format and not pagination:
+        return stream_response(material_service.iter_materials(filters, fields), 'materials', stream_format)
+    
     try:
-        result = material_service.get_all_materials()
+        if pagination:
+            page, page_size = pagination
+            result = material_service.get_materials_paginated((page - 1) * page_size, page_size, filters, fields, columnar)
+        else:
+            result = material_service.get_all_materials(filters, fields, columnar)
         if not result['success']:
             return jsonify({'success': False, 'message': result.get('message', '获取材料列表失败'), 'materials': []})
         
-        return jsonify({
-            'success': True,
-            'materials': result.get('materials', [])
-        })
+        # 列式格式：{columns: [...], rows: [[...]]}，字段名只出现一次
+        body = {'columns': result['columns'], 'rows': result['rows']} if columnar else {'materials': result.get('materials', [])}
+        response = {'success': True, **body}
+        if pagination:
+            response.update(total=result['total'], page=page, page_size=page_size,
+                            total_pages=(result['total'] + page_size - 1) // page_size)
+        return jsonify(response)
     except Exception as e:
         logger.error(f'获取材料列表失败: {str(e)}', exc_info=True)
         return jsonify({'success': False, 'message': '获取材料列表失败', 'materials': []})
@@ -106,6 +127,29 @@ def check_related_products(material_id):
     return jsonify(result)
 
 
+@material_bp.route('/materials/prices', methods=['POST'])
+def update_material_prices():
+    data = request.json or {}
+    changes = data.get('changes') or []
+    username = data.get('username', '')
+    
+    if not isinstance(changes, list) or not changes:
+        return jsonify({'success': False, 'message': '价格变更列表不能为空'})
+    
+    result = material_service.update_prices(changes)
+    
+    if result.get('success'):
+        with db.session_scope() as session:
+            session.add(OperationRecord(
+                operation_type='批量调价',
+                name='材料',
+                quantity=result['updated_count'],
+                detail=f'批量调整材料价格: {result["updated_count"]}个材料, 影响{len(result["repriced_products"])}个产品',
+                username=username
+            ))
+    return jsonify(result)
+
+
 @material_bp.route('/materials/<int:material_id>', methods=['PUT'])
 def update_material(material_id):
     data = request.json or {}
@@ -118,7 +162,10 @@ def update_material(material_id):
     if not name or len(name) > Config.MAX_NAME_LENGTH:
         return jsonify({'success': False, 'message': f'材料名称不能为空且不能超过{Config.MAX_NAME_LENGTH}个字符'})
     
-    result = material_service.update_material(material_id, name, in_price, out_price, image_path)
+    expected_version = get_expected_version(data)
+    result = material_service.update_material(material_id, name, in_price, out_price, image_path, expected_version=expected_version)
+    if result.get('conflict'):
+        return jsonify(result), 409
     
     if result.get('success'):
         with db.session_scope() as session:
@@ -173,7 +220,7 @@ def batch_delete_materials():
 
 @material_bp.route('/materials/in', methods=['POST'])
 def material_in():
-    data = request.json
+    data = get_request_data()
     material_id = data.get('material_id') or data.get('product_id')
     quantity = data.get('quantity')
     supplier = data.get('supplier', '').strip()
@@ -200,7 +247,7 @@ def material_in():
 
 @material_bp.route('/materials/out', methods=['POST'])
 def material_out():
-    data = request.json
+    data = get_request_data()
     material_id = data.get('material_id') or data.get('product_id')
     quantity = data.get('quantity')
     customer = data.get('customer', '').strip()
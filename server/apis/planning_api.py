@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: planning_api.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import logging
+from flask import Blueprint, request, jsonify, abort
+from services.planning_service import PlanningService
+
+
+logger = logging.getLogger(__name__)
+planning_bp = Blueprint('planning', __name__)
+planning_service = PlanningService()
+
+
+@planning_bp.route('/planning/requirements', methods=['POST'])
+def get_requirements():
+    """计算生产计划的材料需求和缺口"""
+    data = request.json or {}
+    items = data.get('items') or []
+    if not isinstance(items, list) or not items:
+        abort(400, description='生产计划不能为空')
+    
+    result = planning_service.get_requirements(items)
+    if not result.get('success'):
+        abort(400, description=result.get('message', '计算失败'))
+    return jsonify(result)
+
+
+@planning_bp.route('/planning/optimize-mix', methods=['POST'])
+def optimize_mix():
+    """在当前库存约束下计算收益最大的生产组合"""
+    data = request.json or {}
+    product_ids = data.get('product_ids')
+    weights = data.get('weights')
+    max_quantities = data.get('max_quantities')
+    if product_ids is not None and not isinstance(product_ids, list):
+        abort(400, description='产品ID列表格式错误')
+    if any(v is not None and not isinstance(v, dict) for v in (weights, max_quantities)):
+        abort(400, description='权重或数量上限格式错误')
+    
+    result = planning_service.optimize_mix(product_ids, weights, max_quantities, data.get('time_budget_ms'))
+    if not result.get('success'):
+        abort(400, description=result.get('message', '优化失败'))
+    return jsonify(result)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: pricing_api.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import logging
+from flask import Blueprint, request, jsonify, abort
+from services.pricing_service import PricingService
+
+
+logger = logging.getLogger(__name__)
+pricing_bp = Blueprint('pricing', __name__)
+pricing_service = PricingService()
+
+
+@pricing_bp.route('/pricing/what-if', methods=['POST'])
+def price_what_if():
+    """预览批量材料调价对产品价格的影响"""
+    data = request.json or {}
+    changes = data.get('changes') or []
+    if not isinstance(changes, list) or not changes:
+        abort(400, description='价格变更列表不能为空')
+    
+    result = pricing_service.what_if(
+        changes,
+        page=data.get('page', 1),
+        page_size=data.get('page_size'),
+        sort_by=data.get('sort_by', 'margin_delta'),
+        order=data.get('order', 'asc')
+    )
+    if not result.get('success'):
+        abort(400, description=result.get('message', '预览失败'))
+    return jsonify(result)
@@ -15,6 +15,8 @@ from flask import Blueprint, request, jsonify, abort
 from services.product_service import ProductService
 from dbs.db_manager import DBManager
 from dbs.models import OperationRecord
+from utils.http_utils import get_expected_version, get_pagination, get_list_filters, get_fields, is_columnar, get_request_data, get_stream_format, conditional_get
+from utils.serialization import stream_response
 from config import Config
 
 
@@ -33,8 +35,9 @@ def add_product():
     other_price = data.get('other_price', 0)
     username = data.get('username', '')
     image_path = data.get('image_path')
+    components = data.get('components')
     
-    result = product_service.add_product(name, data['materials'], in_price, out_price, other_price, image_path)
+    result = product_service.add_product(name, data['materials'], in_price, out_price, other_price, image_path, components)
     
     if result.get('success'):
         with db.session_scope() as session:
@@ -50,21 +53,63 @@ def add_product():
     
 
 @product_bp.route('/products')
+@conditional_get(db, 'product', 'product_material', 'product_component', 'material')
 def get_products():
+    filters = get_list_filters()
+    filters.update({
+        'min_possible': request.args.get('min_possible', type=int),
+        'max_possible': request.args.get('max_possible', type=int),
+        'possible_filter': request.args.get('possible_filter', '')
+    })
+    fields = get_fields(product_service.FIELDS)
+    columnar = is_columnar()
+    pagination = get_pagination()
+    stream_format = get_stream_format()
+    
+    # 不分页时可用 ?stream=ndjson|json 边读游标边写出，不物化完整列表
+    if stream_format and not pagination:
+        return stream_response(product_service.iter_products(filters, fields), 'products', stream_format)
+    
     try:
-        result = product_service.get_all_products()
+        if pagination:
+            page, page_size = pagination
+            result = product_service.get_products_paginated((page - 1) * page_size, page_size, filters, fields, columnar)
+        else:
+            result = product_service.get_all_products(filters, fields, columnar)
         if not result['success']:
             return jsonify({'success': False, 'message': result.get('message', '获取产品列表失败'), 'products': []})
         
-        return jsonify({
-            'success': True,
-            'products': result.get('products', [])
-        })
+        # 列式格式：{columns: [...], rows: [[...]]}，字段名只出现一次
+        body = {'columns': result['columns'], 'rows': result['rows']} if columnar else {'products': result.get('products', [])}
+        response = {'success': True, **body}
+        if pagination:
+            response.update(total=result['total'], page=page, page_size=page_size,
+                            total_pages=(result['total'] + page_size - 1) // page_size)
+        return jsonify(response)
     except Exception as e:
         logger.error(f'获取产品列表失败: {str(e)}', exc_info=True)
         return jsonify({'success': False, 'message': '获取产品列表失败', 'products': []})
 
 
+@product_bp.route('/products/possible-quantity/rebuild', methods=['POST'])
+def rebuild_possible_quantities():
+    data = request.json or {}
+    username = data.get('username', '')
+    
+    result = product_service.rebuild_possible_quantities()
+    
+    if result.get('success'):
+        with db.session_scope() as session:
+            session.add(OperationRecord(
+                operation_type='重建可制作数量',
+                name='系统操作',
+                quantity=result['fixed'],
+                detail=f'重建可制作数量: 检查{result["checked"]}个产品, 修正{result["fixed"]}个',
+                username=username
+            ))
+    return jsonify(result)
+
+
 @product_bp.route('/products/<int:product_id>', methods=['PUT'])
 def update_product(product_id):
     data = request.json or {}
@@ -75,8 +120,12 @@ def update_product(product_id):
     other_price = data.get('other_price')
     username = data.get('username', '')
     image_path = data.get('image_path')
+    components = data.get('components')
     
-    result = product_service.update_product(product_id, name, materials, in_price, out_price, other_price, image_path)
+    expected_version = get_expected_version(data)
+    result = product_service.update_product(product_id, name, materials, in_price, out_price, other_price, image_path, expected_version=expected_version, components=components)
+    if result.get('conflict'):
+        return jsonify(result), 409
     
     if result.get('success'):
         with db.session_scope() as session:
@@ -129,9 +178,34 @@ def batch_delete_products():
     return jsonify(result)
 
 
+@product_bp.route('/products/batch-update', methods=['POST'])
+def batch_update_products():
+    data = request.json or {}
+    items = data.get('products') or []
+    username = data.get('username', '')
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'message': '产品列表不能为空'})
+    
+    result = product_service.batch_update_products(items)
+    if result.get('conflict'):
+        return jsonify(result), 409
+    
+    if result.get('success'):
+        with db.session_scope() as session:
+            session.add(OperationRecord(
+                operation_type='批量更新产品',
+                name='产品',
+                quantity=result['updated_count'],
+                detail=f'批量更新产品: {result["updated_count"]}个',
+                username=username
+            ))
+    return jsonify(result)
+
+
 @product_bp.route('/products/in', methods=['POST'])
 def product_in():
-    data = request.json
+    data = get_request_data()
     formula_id = data.get('formula_id')
     quantity = data.get('quantity')
     customer = data.get('customer', '')
@@ -167,7 +241,7 @@ def product_in():
 
 @product_bp.route('/products/out', methods=['POST'])
 def product_out():
-    data = request.json
+    data = get_request_data()
     formula_id = data.get('formula_id')
     quantity = data.get('quantity')
     customer = data.get('customer', '')
@@ -202,7 +276,7 @@ def product_out():
 
 @product_bp.route('/products/restore', methods=['POST'])
 def product_restore():
-    data = request.json
+    data = get_request_data()
     formula_id = data.get('formula_id')
     quantity = data.get('quantity')
     reason = data.get('reason', '')
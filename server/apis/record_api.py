@@ -14,6 +14,8 @@ import os
 import logging
 from flask import Blueprint, request, jsonify, abort, send_file
 from services.record_service import RecordService
+from utils.http_utils import get_fields, is_columnar, get_stream_format, conditional_get
+from utils.serialization import stream_response
 from config import Config
 
 
@@ -22,10 +24,9 @@ record_bp = Blueprint('record', __name__)
 record_service = RecordService()
 
 
-@record_bp.route('/records')
-def get_records():
-    # 获取筛选参数
-    filters = {
+def get_record_filters() -> dict:
+    """获取操作记录筛选参数"""
+    return {
         'search': request.args.get('search', ''),
         'start_date': request.args.get('start_date', ''),
         'end_date': request.args.get('end_date', ''),
@@ -33,29 +34,67 @@ def get_records():
         'username': request.args.getlist('username'),
         'sort_order': request.args.get('sort_order', 'desc')
     }
+
+
+def _records_body(result: dict, columnar: bool) -> dict:
+    """记录列表响应体：默认 {data: [...]}，列式格式为 {columns, rows}"""
+    if columnar:
+        return {'columns': result['columns'], 'rows': result['rows']}
+    return {'data': result['records']}
+
+
+@record_bp.route('/records')
+@conditional_get(record_service.db, 'operation_record')
+def get_records():
+    filters = get_record_filters()
     
     logger.debug(f'获取操作记录: 筛选条件={filters}')
     
-    result = record_service.get_records_filtered(filters)
+    fields = get_fields(record_service.FIELDS)
+    columnar = is_columnar()
+    stream_format = get_stream_format()
+    
+    # 传入 cursor 或 limit 时使用游标分页，否则返回全部记录
+    cursor = request.args.get('cursor', '')
+    limit = request.args.get('limit', type=int)
+    if cursor or limit:
+        with_total = request.args.get('with_total', 'false').lower() == 'true'
+        result = record_service.get_records_page(filters, cursor, limit, with_total, fields, columnar)
+        if not result.get('success'):
+            abort(400, description=result.get('message', '查询失败'))
+        response = {'success': True, **_records_body(result, columnar), 'limit': result['limit'],
+                    'has_more': result['has_more'], 'next_cursor': result['next_cursor']}
+        if with_total:
+            response['total'] = result['total']
+        return jsonify(response)
+    
+    # ?stream=ndjson|json 时边读游标边写出，不物化完整结果
+    if stream_format:
+        return stream_response(record_service.iter_records(filters, fields), 'data', stream_format, with_total=True)
+    
+    result = record_service.get_records_filtered(filters, fields, columnar)
     if result.get('success'):
         logger.info(f'返回操作记录: 总数={result["total"]}')
-        return jsonify({'success': True, 'data': result['records'], 'total': result['total']})
+        return jsonify({'success': True, **_records_body(result, columnar), 'total': result['total']})
     else:
         logger.error(f'获取操作记录失败: {result.get("message", "未知错误")}')
         return jsonify(result)
 
 
+@record_bp.route('/records/facets')
+@conditional_get(record_service.db, 'operation_record')
+def get_record_facets():
+    """获取筛选面板的分组计数（操作类型、操作用户、日期）"""
+    result = record_service.get_facets(get_record_filters())
+    if not result.get('success'):
+        abort(400, description=result.get('message', '查询失败'))
+    return jsonify(result)
+
+
 @record_bp.route('/records/export')
 def export_records():
     """导出操作记录"""
-    filters = {
-        'search': request.args.get('search', ''),
-        'start_date': request.args.get('start_date', ''),
-        'end_date': request.args.get('end_date', ''),
-        'operation_type': request.args.getlist('operation_type'),
-        'username': request.args.getlist('username'),
-        'sort_order': request.args.get('sort_order', 'desc')
-    }
+    filters = get_record_filters()
     delete_after_export = request.args.get('deleteAfterExport', 'false').lower() == 'true'
     operator = request.args.get('operator', '')
     
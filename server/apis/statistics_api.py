@@ -11,16 +11,27 @@
 """
 
 import logging
+from datetime import datetime
 from flask import Blueprint, request, jsonify
 from services.statistics_service import StatisticsService
+from utils.http_utils import conditional_get
 
 
 logger = logging.getLogger(__name__)
 statistics_bp = Blueprint('statistics', __name__)
 statistics_service = StatisticsService()
 
+# 统计数据依赖的表；统计窗口随时间推移，ETag 同时按小时变化
+STATISTICS_TABLES = ('material_history', 'product_history', 'material', 'product')
+
+
+def statistics_window() -> str:
+    """统计时间窗口标识（精确到小时）"""
+    return datetime.now().strftime('%Y%m%d%H')
+
 
 @statistics_bp.route('/statistics/material-trend')
+@conditional_get(statistics_service.db, *STATISTICS_TABLES, window=statistics_window)
 def get_material_trend():
     """获取材料库存趋势"""
     material_id = request.args.get('material_id', type=int)
@@ -31,6 +42,7 @@ def get_material_trend():
 
 
 @statistics_bp.route('/statistics/product-trend')
+@conditional_get(statistics_service.db, *STATISTICS_TABLES, window=statistics_window)
 def get_product_trend():
     """获取产品库存趋势"""
     product_id = request.args.get('product_id', type=int)
@@ -41,6 +53,7 @@ def get_product_trend():
 
 
 @statistics_bp.route('/statistics/top-materials')
+@conditional_get(statistics_service.db, *STATISTICS_TABLES, window=statistics_window)
 def get_top_materials():
     """获取热门材料排行"""
     limit = request.args.get('limit', 10, type=int)
@@ -51,6 +64,7 @@ def get_top_materials():
 
 
 @statistics_bp.route('/statistics/top-products')
+@conditional_get(statistics_service.db, *STATISTICS_TABLES, window=statistics_window)
 def get_top_products():
     """获取热门产品排行"""
     limit = request.args.get('limit', 10, type=int)
@@ -61,6 +75,7 @@ def get_top_products():
 
 
 @statistics_bp.route('/statistics/summary')
+@conditional_get(statistics_service.db, *STATISTICS_TABLES, window=statistics_window)
 def get_summary():
     """获取统计摘要"""
     days = request.args.get('days', 30, type=int)
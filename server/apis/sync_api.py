@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: sync_api.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import logging
+from flask import Blueprint, request, jsonify, abort
+from services.sync_service import SyncService
+
+
+logger = logging.getLogger(__name__)
+sync_bp = Blueprint('sync', __name__)
+sync_service = SyncService()
+
+
+@sync_bp.route('/sync/changes')
+def get_changes():
+    """增量同步：返回 since 游标之后新增、修改和删除的材料、产品、用户，以及新的游标"""
+    since = request.args.get('since', '0').strip() or '0'
+    if not since.isdigit():
+        abort(400, description='无效的同步游标')
+    return jsonify(sync_service.get_changes(int(since)))
@@ -18,6 +18,7 @@ from werkzeug.utils import secure_filename
 from services.user_service import UserService
 from dbs.db_manager import DBManager
 from dbs.models import OperationRecord
+from utils.http_utils import get_fields
 from config import Config
 
 
@@ -189,7 +190,7 @@ def add_user():
 @user_bp.route('/users')
 def get_users():
     logger.debug('获取用户列表')
-    result = user_service.get_all_users()
+    result = user_service.get_all_users(get_fields(user_service.FIELDS))
     if result.get('success'):
         logger.debug(f'返回用户数量: {len(result["users"])}')
         return jsonify(result)
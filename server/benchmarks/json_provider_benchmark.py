@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : python benchmarks/json_provider_benchmark.py [--rows 5000] [--repeat 5]
+@Filename: json_provider_benchmark.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from flask.json.provider import DefaultJSONProvider
+from config import Config
+
+# 应用导入时会初始化数据库和日志目录，先全部指向临时目录，避免改动业务数据
+BENCH_DIR = tempfile.mkdtemp(prefix='essu-bench-')
+Config.DATABASE_PATH = os.path.join(BENCH_DIR, 'bench.db')
+Config.LOG_FOLDER = os.path.join(BENCH_DIR, 'logs')
+Config.LOG_FILE = os.path.join(Config.LOG_FOLDER, 'essu.log')
+Config.UPLOAD_FOLDER = os.path.join(BENCH_DIR, 'uploads')
+Config.EXPORT_FOLDER = os.path.join(BENCH_DIR, 'exports')
+Config.ENABLE_SNAPSHOT_SCHEDULER = False
+os.makedirs(Config.LOG_FOLDER, exist_ok=True)
+
+from dbs.models import Material, Product, ProductMaterial, OperationRecord
+import utils.serialization as serialization
+from main import app
+
+
+def seed(rows: int):
+    """写入测试数据：材料、产品（每个产品5种材料）、操作记录各 rows 条"""
+    rnd = random.Random(42)
+    base = datetime(2026, 1, 1, 8, 0, 0)
+    engine = create_engine(f'sqlite:///{Config.DATABASE_PATH}')
+    with engine.begin() as conn:
+        conn.execute(insert(Material), [{
+            'name': f'材料{i:06d}',
+            'in_price': round(rnd.uniform(1, 500), 2),
+            'out_price': round(rnd.uniform(1, 800), 2),
+            'stock_count': rnd.randint(0, 5000),
+            'version': 1,
+            'created_at': base + timedelta(seconds=i * 7),
+            'updated_at': base + timedelta(seconds=i * 11)
+        } for i in range(1, rows + 1)])
+        conn.execute(insert(Product), [{
+            'name': f'产品{i:06d}',
+            'in_price': round(rnd.uniform(10, 2000), 2),
+            'out_price': round(rnd.uniform(10, 3000), 2),
+            'other_price': 0,
+            'stock_count': rnd.randint(0, 500),
+            'version': 1,
+            'created_at': base + timedelta(seconds=i * 7),
+            'updated_at': base + timedelta(seconds=i * 11)
+        } for i in range(1, rows + 1)])
+        conn.execute(insert(ProductMaterial), [{
+            'product_id': i, 'material_id': m, 'quantity': rnd.randint(1, 10)
+        } for i in range(1, rows + 1) for m in rnd.sample(range(1, rows + 1), 5)])
+        conn.execute(insert(OperationRecord), [{
+            'operation_type': rnd.choice(['材料入库', '材料出库', '产品入库', '产品出库']),
+            'name': f'材料{rnd.randint(1, rows):06d}',
+            'quantity': rnd.randint(1, 100),
+            'detail': f'入库{rnd.randint(1, 100)}个, 供应商: 供应商{rnd.randint(1, 50)}',
+            'username': rnd.choice(['admin', 'user']),
+            'created_at': base + timedelta(seconds=i * 3)
+        } for i in range(rows)])
+    engine.dispose()
+
+
+def best_of(func, repeat: int):
+    """返回 (最佳耗时ms, 最后一次结果)"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def measure(client, path: str, payload: dict, repeat: int):
+    """返回 (接口耗时ms, 其中编码耗时ms, 响应字节数)"""
+    elapsed, response = best_of(lambda: client.get(path), repeat)
+    with app.test_request_context(path):
+        encode, _ = best_of(lambda: app.json.response(payload), repeat)
+    return elapsed, encode, len(response.data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='接口级 JSON 编码对比：Flask 默认 / 标准库回退 / orjson')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    
+    try:
+        seed(args.rows)
+        logging.disable(logging.WARNING)
+        client = app.test_client()
+        fast_provider = app.json
+        orjson = serialization.orjson
+        
+        def use_flask_default():
+            app.json = DefaultJSONProvider(app)
+        
+        def use_fallback():
+            app.json, serialization.orjson = fast_provider, None
+        
+        def use_orjson():
+            app.json, serialization.orjson = fast_provider, orjson
+        
+        providers = [('flask', use_flask_default), ('fallback', use_fallback)]
+        if orjson is not None:
+            providers.append(('orjson', use_orjson))
+        
+        print(f'rows={args.rows} repeat={args.repeat}（取最佳值；request 含查询耗时，encode 为其中的 JSON 编码耗时）')
+        print(f'{"endpoint":<12}{"provider":<10}{"request(ms)":>12}{"encode(ms)":>12}{"bytes":>12}{"encode speedup":>16}')
+        for path in ('/materials', '/products', '/records'):
+            payload = client.get(path).get_json()
+            baseline = None
+            for name, activate in providers:
+                activate()
+                elapsed, encode, size = measure(client, path, payload, args.repeat)
+                baseline = baseline or encode
+                print(f'{path:<12}{name:<10}{elapsed:>12.1f}{encode:>12.1f}{size:>12}{baseline / encode:>16.2f}')
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
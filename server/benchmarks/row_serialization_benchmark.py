@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : python benchmarks/row_serialization_benchmark.py [--rows 100000] [--repeat 3]
+@Filename: row_serialization_benchmark.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from config import Config
+
+# 服务模块导入时会初始化数据库，先指向临时库，避免改动业务数据库
+BENCH_DIR = tempfile.mkdtemp(prefix='essu-bench-')
+Config.DATABASE_PATH = os.path.join(BENCH_DIR, 'bench.db')
+
+from dbs.models import Base, Material, OperationRecord
+from services.material_service import MaterialService
+from services.record_service import RecordService
+from utils.query_utils import project_fields, fetch_rows, compile_serializer
+from utils.timezone_utils import format_china_time
+
+
+def seed(session, rows: int):
+    """写入测试数据：材料和操作记录各 rows 条"""
+    rnd = random.Random(42)
+    base = datetime(2026, 1, 1, 8, 0, 0)
+    session.execute(insert(Material), [{
+        'name': f'材料{i:06d}',
+        'in_price': round(rnd.uniform(1, 500), 2),
+        'out_price': round(rnd.uniform(1, 800), 2),
+        'stock_count': rnd.randint(0, 5000),
+        'image_path': f'images/material_{i}.png',
+        'version': 1,
+        'created_at': base + timedelta(seconds=i * 7),
+        'updated_at': base + timedelta(seconds=i * 11)
+    } for i in range(rows)])
+    session.execute(insert(OperationRecord), [{
+        'operation_type': rnd.choice(['材料入库', '材料出库', '产品入库', '产品出库']),
+        'name': f'材料{rnd.randint(0, rows):06d}',
+        'quantity': rnd.randint(1, 100),
+        'detail': f'入库{rnd.randint(1, 100)}个, 供应商: 供应商{rnd.randint(1, 50)}',
+        'username': rnd.choice(['admin', 'user']),
+        'created_at': base + timedelta(seconds=i * 3)
+    } for i in range(rows)])
+    session.commit()
+
+
+def orm_materials(session):
+    """原实现：加载ORM对象后逐个拼装字典"""
+    return [{
+        'id': m.id,
+        'name': m.name,
+        'in_price': m.in_price,
+        'out_price': m.out_price,
+        'stock_count': m.stock_count,
+        'image_path': m.image_path,
+        'used_by_products': [],
+        'is_used': False,
+        'version': m.version,
+        'created_at': format_china_time(m.created_at),
+        'updated_at': format_china_time(m.updated_at)
+    } for m in session.query(Material).order_by(Material.id).all()]
+
+
+def core_materials(session):
+    """Core select 行元组 + 预编译序列化函数"""
+    query = project_fields(session.query(Material).order_by(Material.id), None, MaterialService.FIELDS, Material.id)
+    serialize = compile_serializer(MaterialService.FIELDS)
+    return [serialize(m, []) for m in fetch_rows(session, query)]
+
+
+def orm_records(session):
+    """原实现：加载ORM对象后逐个拼装字典"""
+    return [{
+        'id': r.id,
+        'operation_type': r.operation_type,
+        'name': r.name,
+        'quantity': r.quantity,
+        'detail': r.detail,
+        'username': r.username,
+        'created_at': format_china_time(r.created_at)
+    } for r in session.query(OperationRecord).order_by(OperationRecord.created_at.desc()).all()]
+
+
+def core_records(session):
+    """Core select 行元组 + 预编译序列化函数"""
+    query = project_fields(
+        session.query(OperationRecord).order_by(OperationRecord.created_at.desc()),
+        None, RecordService.FIELDS, OperationRecord.id
+    )
+    serialize = compile_serializer(RecordService.FIELDS)
+    return [serialize(r) for r in fetch_rows(session, query)]
+
+
+def measure(Session, read, repeat: int):
+    """返回 (最佳耗时秒, 结果)，每次使用新会话，避免身份映射复用"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        session = Session()
+        start = time.perf_counter()
+        result = read(session)
+        best = min(best, time.perf_counter() - start)
+        session.close()
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ORM 对象与 Core 行元组列表序列化对比')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    try:
+        engine = create_engine(f'sqlite:///{Config.DATABASE_PATH}')
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        session = Session()
+        seed(session, args.rows)
+        session.close()
+        
+        print(f'rows={args.rows} repeat={args.repeat}（取最佳值）')
+        print(f'{"list":<12}{"path":<8}{"total(ms)":>12}{"per row(us)":>14}{"speedup":>10}')
+        for name, orm_read, core_read in (('materials', orm_materials, core_materials),
+                                          ('records', orm_records, core_records)):
+            orm_time, orm_rows = measure(Session, orm_read, args.repeat)
+            core_time, core_rows = measure(Session, core_read, args.repeat)
+            assert orm_rows == core_rows, f'{name} 输出不一致'
+            for path, elapsed in (('orm', orm_time), ('core', core_time)):
+                print(f'{name:<12}{path:<8}{elapsed * 1000:>12.1f}{elapsed / args.rows * 1e6:>14.2f}'
+                      f'{orm_time / elapsed:>10.2f}')
+        engine.dispose()
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
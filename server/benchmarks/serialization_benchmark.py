@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : python benchmarks/serialization_benchmark.py [--rows 5000] [--repeat 20]
+@Filename: serialization_benchmark.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from utils.serialization import NegotiatingJSONProvider, orjson
+
+
+def build_payloads(rows: int) -> dict:
+    """按 /materials、/products、/records 的响应结构构造测试数据"""
+    rnd = random.Random(42)
+    base = datetime(2026, 1, 1, 8, 0, 0)
+    
+    def ts(i):
+        return (base + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    materials = [{
+        'id': i,
+        'name': f'材料{i:05d}',
+        'in_price': round(rnd.uniform(1, 500), 2),
+        'out_price': round(rnd.uniform(1, 800), 2),
+        'stock_count': rnd.randint(0, 5000),
+        'image_path': f'/uploads/material_{i}.png' if i % 3 else None,
+        'used_by_products': [f'产品{j:05d}' for j in rnd.sample(range(rows), 3)],
+        'is_used': True,
+        'version': rnd.randint(1, 20),
+        'created_at': ts(i),
+        'updated_at': ts(i + 60)
+    } for i in range(1, rows + 1)]
+    
+    products = [{
+        'id': i,
+        'name': f'产品{i:05d}',
+        'in_price': round(rnd.uniform(10, 2000), 2),
+        'out_price': round(rnd.uniform(10, 3000), 2),
+        'other_price': round(rnd.uniform(0, 50), 2),
+        'stock_count': rnd.randint(0, 500),
+        'possible_quantity': rnd.randint(0, 300),
+        'image_path': None,
+        'version': rnd.randint(1, 20),
+        'materials': [{
+            'material_id': m,
+            'name': f'材料{m:05d}',
+            'quantity': rnd.randint(1, 10)
+        } for m in rnd.sample(range(1, rows + 1), 8)],
+        'components': [],
+        'created_at': ts(i),
+        'updated_at': ts(i + 60)
+    } for i in range(1, rows + 1)]
+    
+    records = [{
+        'id': i,
+        'operation_type': rnd.choice(['材料入库', '材料出库', '产品入库', '产品出库']),
+        'name': f'材料{rnd.randint(1, rows):05d}',
+        'quantity': rnd.randint(1, 100),
+        'detail': f'入库{rnd.randint(1, 100)}个, 供应商: 供应商{rnd.randint(1, 50)}, 单价: {rnd.uniform(1, 500):.2f}',
+        'username': rnd.choice(['admin', 'user', 'operator']),
+        'created_at': ts(i)
+    } for i in range(1, rows + 1)]
+    
+    return {
+        '/materials': {'success': True, 'materials': materials, 'total': rows},
+        '/products': {'success': True, 'products': products, 'total': rows},
+        '/records': {'success': True, 'records': records, 'next_cursor': 'MjAyNi0wMS0wMXwx', 'has_more': True}
+    }
+
+
+def measure(encode, obj, repeat: int):
+    """返回 (最佳耗时ms, 字节数)"""
+    best = float('inf')
+    data = b''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = encode(obj)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON 与 msgpack 响应编码对比')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    
+    app = Flask(__name__)
+    provider = NegotiatingJSONProvider(app)
+    encoders = {
+        'json': lambda obj: provider.dumps(obj).encode('utf-8'),
+        'msgpack': provider.packb
+    }
+    
+    print(f'rows={args.rows} repeat={args.repeat}（取最佳值） JSON 编码器={"orjson" if orjson else "json"}')
+    print(f'{"payload":<12}{"format":<10}{"encode(ms)":>12}{"bytes":>12}{"ratio":>8}')
+    for name, payload in build_payloads(args.rows).items():
+        json_bytes = len(encoders['json'](payload))
+        for fmt, encode in encoders.items():
+            ms, size = measure(encode, payload, args.repeat)
+            print(f'{name:<12}{fmt:<10}{ms:>12.2f}{size:>12}{size / json_bytes:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
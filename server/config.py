@@ -39,6 +39,16 @@ class Config:
     DEFAULT_PAGE_SIZE = 20
     MAX_PAGE_SIZE = 100
     MAX_RECORDS_PAGE_SIZE = 200
+    # 流式输出每批从数据库游标读取的行数（yield_per）
+    STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 500))
+    # 增量同步变更行数超过该值时改为返回全量数据
+    SYNC_MAX_CHANGES = int(os.getenv('SYNC_MAX_CHANGES', 5000))
+    # 材料、产品、用户的 change_log 保留天数，早于清理位置的同步游标需全量同步
+    CHANGE_LOG_RETENTION_DAYS = int(os.getenv('CHANGE_LOG_RETENTION_DAYS', 30))
+    
+    # 生产计划配置
+    OPTIMIZE_TIME_BUDGET_MS = int(os.getenv('OPTIMIZE_TIME_BUDGET_MS', 500))  # 生产组合优化默认时间预算（毫秒）
+    MAX_OPTIMIZE_TIME_BUDGET_MS = 5000  # 生产组合优化最大时间预算（毫秒）
     
     # 业务规则配置
     MAX_NAME_LENGTH = 100
@@ -49,6 +59,7 @@ class Config:
     MAX_DETAIL_LENGTH = 500
     MIN_QUANTITY = 1
     MAX_QUANTITY = 999999
+    LOW_STOCK_THRESHOLD = 5  # 低库存阈值（库存≤该值视为低库存）
     
     # Flask配置
     DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
@@ -64,10 +75,21 @@ class Config:
     MAX_CONCURRENT_SESSIONS = 3  # 每个用户最大并发登录数
     SESSION_TIMEOUT = 24 * 60 * 60  # 会话超时时间（秒）
     
+    # 库存快照配置
+    ENABLE_SNAPSHOT_SCHEDULER = os.getenv('ENABLE_SNAPSHOT_SCHEDULER', 'True').lower() == 'true'  # 是否启用每日定时快照
+    SNAPSHOT_HOUR = int(os.getenv('SNAPSHOT_HOUR', 0))  # 每日快照时间（时）
+    
     # 性能监控配置
     SLOW_REQUEST_THRESHOLD = float(os.getenv('SLOW_REQUEST_THRESHOLD', 5.0))  # 慢请求阈值（秒）
     ENABLE_RESPONSE_TIME_HEADER = os.getenv('ENABLE_RESPONSE_TIME_HEADER', 'True').lower() == 'true'  # 是否添加响应时间头
     
+    # 响应压缩配置
+    ENABLE_COMPRESSION = os.getenv('ENABLE_COMPRESSION', 'True').lower() == 'true'  # 是否压缩响应（gzip，安装 brotli 时优先 br）
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))  # 响应体不小于该字节数时才压缩
+    GZIP_LEVEL = 6  # gzip 压缩级别
+    BROTLI_QUALITY = 5  # brotli 压缩质量（动态响应不宜过高）
+    COMPRESSION_CACHE_MAX_BYTES = 32 * 1024 * 1024  # 压缩结果缓存上限（字节）
+    
     @classmethod
     def init_directories(cls):
         """初始化必要的目录"""
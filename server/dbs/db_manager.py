@@ -11,14 +11,25 @@
 """
 
 import os
+import json
 import logging
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.pool import StaticPool
-from dbs.models import Base, Material, User, Product, OperationRecord
+from dbs.models import Base, Material, User, Product, OperationRecord, ChangeLog, TableVersion
 from contextlib import contextmanager
 
 
+# 由触发器维护版本号的表（用于 ETag 和条件请求）
+VERSIONED_TABLES = (
+    'material', 'product', 'product_material', 'product_component', 'user',
+    'operation_record', 'material_history', 'product_history'
+)
+
+# table_version 中记录 change_log 已清理到的序号的键（不对应实际表，不由触发器维护）
+CHANGE_LOG_FLOOR = 'change_log'
+
+
 class DBManager:
     """数据库管理器 - 负责数据库连接和ORM操作"""
     
@@ -49,6 +60,7 @@ class DBManager:
     def init_database(self):
         """初始化数据库表"""
         Base.metadata.create_all(self.engine)
+        self.migrate_database()
         
         with self.session_scope() as session:
             user_count = session.query(User).count()
@@ -69,6 +81,223 @@ class DBManager:
                 session.add(normal_user)
                 self.logger.info('初始化默认用户完成')
     
+    def migrate_database(self):
+        """按 PRAGMA user_version 执行增量迁移，已执行过的迁移不会重复执行"""
+        migrations = [
+            self._migration_add_version_columns,
+            self._migration_backfill_product_material,
+            self._migration_product_material_change_triggers,
+            self._migration_add_possible_quantity,
+            self._migration_product_component_change_triggers,
+            self._migration_operation_record_keyset_index,
+            self._migration_list_filter_indexes,
+            self._migration_operation_record_fts,
+            self._migration_operation_record_facet_indexes,
+            self._migration_table_version_triggers,
+            self._migration_sync_change_triggers,
+            self._migration_snapshot_scheduled_day,
+            self._migration_drop_duplicate_change_log_index,
+        ]
+        with self.engine.begin() as conn:
+            current_version = conn.exec_driver_sql('PRAGMA user_version').scalar()
+            for version, migration in enumerate(migrations, start=1):
+                if version <= current_version:
+                    continue
+                migration(conn)
+                conn.exec_driver_sql(f'PRAGMA user_version = {version}')
+                self.logger.info(f'数据库迁移完成: v{version} {migration.__name__}')
+    
+    def _add_column_if_missing(self, conn, table: str, column: str, ddl: str):
+        """为旧表补充新增列（新建的表已由create_all包含该列）"""
+        columns = {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info("{table}")')}
+        if column not in columns:
+            conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}')
+    
+    def _migration_add_version_columns(self, conn):
+        """迁移1: 材料和产品增加乐观锁版本号"""
+        self._add_column_if_missing(conn, 'material', 'version', 'INTEGER NOT NULL DEFAULT 1')
+        self._add_column_if_missing(conn, 'product', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    
+    def _migration_backfill_product_material(self, conn):
+        """迁移2: 将产品JSON配方回填到 product_material 表"""
+        rows = []
+        for product_id, materials_json in conn.exec_driver_sql('SELECT id, materials FROM product'):
+            try:
+                materials = json.loads(materials_json or '{}')
+            except (json.JSONDecodeError, TypeError):
+                self.logger.warning(f'迁移时解析产品配方失败: {product_id}')
+                continue
+            for material_id, quantity in materials.items():
+                rows.append((product_id, int(material_id), quantity))
+        if rows:
+            conn.exec_driver_sql(
+                'INSERT OR IGNORE INTO product_material (product_id, material_id, quantity) VALUES (?, ?, ?)', rows
+            )
+        self.logger.info(f'回填产品配方: {len(rows)}条')
+    
+    def _create_change_triggers(self, conn, table: str, row_id_column: str = 'id'):
+        """创建写入 change_log 的触发器，每次增删改自动记录变更行"""
+        for operation, row in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD')):
+            conn.exec_driver_sql(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{operation}_log AFTER {operation.upper()} ON "{table}"
+                BEGIN
+                    INSERT INTO change_log (table_name, row_id, operation, changed_at)
+                    VALUES ('{table}', {row}.{row_id_column}, '{operation}', datetime('now', '+8 hours'));
+                END
+            """)
+    
+    def _migration_product_material_change_triggers(self, conn):
+        """迁移3: 产品配方变更写入 change_log，供配方矩阵缓存增量刷新"""
+        self._create_change_triggers(conn, 'product_material', 'product_id')
+    
+    def _migration_add_possible_quantity(self, conn):
+        """迁移4: 产品增加可制作数量列并全量计算"""
+        self._add_column_if_missing(conn, 'product', 'possible_quantity', 'INTEGER NOT NULL DEFAULT 0')
+        conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_product_possible_quantity ON product (possible_quantity)')
+        # 需求量<=0的配方行不构成约束（MIN忽略NULL）；配方引用的材料不存在时为0；无配方为0
+        conn.exec_driver_sql("""
+            UPDATE product SET possible_quantity = COALESCE((
+                SELECT MIN(CASE WHEN m.id IS NULL THEN 0
+                                WHEN pm.quantity > 0 THEN COALESCE(m.stock_count, 0) / pm.quantity END)
+                FROM product_material pm LEFT JOIN material m ON m.id = pm.material_id
+                WHERE pm.product_id = product.id
+            ), 0)
+        """)
+    
+    def _migration_product_component_change_triggers(self, conn):
+        """迁移5: 产品组件（多级配方）变更写入 change_log"""
+        self._create_change_triggers(conn, 'product_component', 'product_id')
+    
+    def _migration_operation_record_keyset_index(self, conn):
+        """迁移6: 操作记录 (created_at, id) 复合索引，供游标分页走索引范围扫描"""
+        conn.exec_driver_sql(
+            'CREATE INDEX IF NOT EXISTS idx_operation_record_created ON operation_record (created_at, id)'
+        )
+    
+    def _migration_list_filter_indexes(self, conn):
+        """迁移7: 材料和产品列表的筛选/排序列索引（库存、售价、更新时间）"""
+        for table in ('material', 'product'):
+            for column in ('stock_count', 'out_price', 'updated_at'):
+                conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON "{table}" ({column})')
+    
+    def _migration_operation_record_fts(self, conn):
+        """迁移8: 操作记录 FTS5 全文索引（trigram 分词），触发器同步增删改，SQLite不支持时跳过"""
+        try:
+            conn.exec_driver_sql("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS operation_record_fts USING fts5(
+                    detail, name, username, content='operation_record', content_rowid='id', tokenize='trigram'
+                )
+            """)
+        except Exception as e:
+            self.logger.warning(f'当前SQLite不支持FTS5 trigram，操作记录搜索将使用LIKE: {str(e)}')
+            return
+        
+        conn.exec_driver_sql("""
+            CREATE TRIGGER IF NOT EXISTS trg_operation_record_fts_insert AFTER INSERT ON operation_record BEGIN
+                INSERT INTO operation_record_fts (rowid, detail, name, username)
+                VALUES (NEW.id, NEW.detail, NEW.name, NEW.username);
+            END
+        """)
+        conn.exec_driver_sql("""
+            CREATE TRIGGER IF NOT EXISTS trg_operation_record_fts_delete AFTER DELETE ON operation_record BEGIN
+                INSERT INTO operation_record_fts (operation_record_fts, rowid, detail, name, username)
+                VALUES ('delete', OLD.id, OLD.detail, OLD.name, OLD.username);
+            END
+        """)
+        conn.exec_driver_sql("""
+            CREATE TRIGGER IF NOT EXISTS trg_operation_record_fts_update AFTER UPDATE ON operation_record BEGIN
+                INSERT INTO operation_record_fts (operation_record_fts, rowid, detail, name, username)
+                VALUES ('delete', OLD.id, OLD.detail, OLD.name, OLD.username);
+                INSERT INTO operation_record_fts (rowid, detail, name, username)
+                VALUES (NEW.id, NEW.detail, NEW.name, NEW.username);
+            END
+        """)
+        # 为已有记录建立索引
+        conn.exec_driver_sql("INSERT INTO operation_record_fts (operation_record_fts) VALUES ('rebuild')")
+    
+    def _migration_operation_record_facet_indexes(self, conn):
+        """迁移9: 操作记录分组计数的覆盖索引 (维度列, created_at)"""
+        conn.exec_driver_sql(
+            'CREATE INDEX IF NOT EXISTS idx_operation_record_type_created ON operation_record (operation_type, created_at)'
+        )
+        conn.exec_driver_sql(
+            'CREATE INDEX IF NOT EXISTS idx_operation_record_user_created ON operation_record (username, created_at)'
+        )
+    
+    def _migration_table_version_triggers(self, conn):
+        """迁移10: 列表和统计数据相关的表在增删改时递增 table_version 中的版本号"""
+        for table in VERSIONED_TABLES:
+            for operation in ('insert', 'update', 'delete'):
+                conn.exec_driver_sql(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_{operation}_version AFTER {operation.upper()} ON "{table}"
+                    BEGIN
+                        INSERT INTO table_version (table_name, version) VALUES ('{table}', 1)
+                        ON CONFLICT (table_name) DO UPDATE SET version = version + 1;
+                    END
+                """)
+    
+    def _migration_sync_change_triggers(self, conn):
+        """迁移11: 材料、产品、用户的增删改写入 change_log，供客户端增量同步"""
+        for table in ('material', 'product', 'user'):
+            self._create_change_triggers(conn, table)
+    
+    def _migration_snapshot_scheduled_day(self, conn):
+        """迁移12: 库存快照增加定时快照日期列及唯一索引，多个进程同时触发定时快照时每天只写入一次"""
+        self._add_column_if_missing(conn, 'inventory_snapshot', 'scheduled_day', 'VARCHAR(10)')
+        conn.exec_driver_sql(
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_snapshot_scheduled_day ON inventory_snapshot (scheduled_day)'
+        )
+    
+    def _migration_drop_duplicate_change_log_index(self, conn):
+        """迁移13: 删除早期迁移11创建的 (table_name, seq) 索引，与模型声明的 idx_change_log_table 重复"""
+        conn.exec_driver_sql('DROP INDEX IF EXISTS idx_change_log_table_seq')
+    
+    def get_table_versions(self, session, table_names) -> tuple:
+        """按给定顺序获取多张表的版本号（主键查询，开销与表大小无关），未发生过变更的表为0"""
+        rows = dict(session.query(TableVersion.table_name, TableVersion.version).filter(
+            TableVersion.table_name.in_(table_names)
+        ).all())
+        return tuple(rows.get(table, 0) for table in table_names)
+    
+    def get_table_version(self, session, table_name: str) -> int:
+        """获取表的变更版本（change_log 中该表的最大序号）"""
+        return session.query(func.max(ChangeLog.seq)).filter(ChangeLog.table_name == table_name).scalar() or 0
+    
+    def get_change_cursor(self, session) -> int:
+        """获取 change_log 当前的最大序号（所有表），作为增量同步的游标"""
+        return session.query(func.max(ChangeLog.seq)).scalar() or 0
+    
+    def get_change_log_floor(self, session) -> int:
+        """获取 change_log 已清理到的序号，游标早于该序号时中间的变更可能已被删除"""
+        return self.get_table_versions(session, (CHANGE_LOG_FLOOR,))[0]
+    
+    def prune_change_log(self, session, table_names, before) -> int:
+        """删除指定表在 before 之前的 change_log 行，并记录已清理到的序号，返回删除行数"""
+        floor = session.query(func.max(ChangeLog.seq)).filter(
+            ChangeLog.table_name.in_(table_names), ChangeLog.changed_at < before
+        ).scalar()
+        if not floor:
+            return 0
+        count = session.query(ChangeLog).filter(
+            ChangeLog.table_name.in_(table_names), ChangeLog.seq <= floor
+        ).delete(synchronize_session=False)
+        session.merge(TableVersion(table_name=CHANGE_LOG_FLOOR, version=max(floor, self.get_change_log_floor(session))))
+        return count
+    
+    def get_changed_row_ids(self, session, table_name: str, since_seq: int) -> set:
+        """获取指定序号之后发生变更的行ID"""
+        rows = session.query(ChangeLog.row_id).filter(
+            ChangeLog.table_name == table_name, ChangeLog.seq > since_seq
+        ).distinct()
+        return {row_id for row_id, in rows}
+    
+    def bump_version(self, session, model, row_id: int, expected_version: int = None) -> bool:
+        """乐观锁：UPDATE ... SET version = version + 1 WHERE id = :id AND version = :v，返回是否更新成功"""
+        query = session.query(model).filter(model.id == row_id)
+        if expected_version is not None:
+            query = query.filter(model.version == expected_version)
+        return query.update({model.version: model.version + 1}, synchronize_session=False) > 0
+    
     def get_session(self):
         """获取数据库会话"""
         return self.Session()
@@ -10,7 +10,7 @@
 @Software: vscode
 """
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Index
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Index, table, column
 from sqlalchemy.ext.declarative import declarative_base
 from utils.timezone_utils import china_now
 
@@ -53,8 +53,9 @@ class Material(Base):
         in_price: 进价
         out_price: 售价
         stock_count: 库存数量
-        used_by_products: 使用该材料的产品数量
+        used_by_products: 已废弃，产品引用关系由 product_material 表维护
         image_path: 图片路径
+        version: 版本号（乐观锁，每次编辑递增）
         created_at: 创建时间
         updated_at: 更新时间
     """
@@ -63,12 +64,13 @@ class Material(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(100), nullable=False, unique=True, index=True)
     in_price = Column(Float, nullable=False, default=0)
-    out_price = Column(Float, nullable=False, default=0)
+    out_price = Column(Float, nullable=False, default=0, index=True)
     stock_count = Column(Integer, default=0, index=True)
     used_by_products = Column(Text, default='[]')
     image_path = Column(String(255))
+    version = Column(Integer, nullable=False, default=1)
     created_at = Column(DateTime, default=china_now, index=True)
-    updated_at = Column(DateTime, default=china_now, onupdate=china_now)
+    updated_at = Column(DateTime, default=china_now, onupdate=china_now, index=True)
 
 
 class Product(Base):
@@ -78,12 +80,14 @@ class Product(Base):
     Attributes:
         id: 产品ID
         name: 产品名称，唯一
-        materials: 材料信息 (JSON)
+        materials: 已废弃，产品配方由 product_material 表维护
         in_price: 成本价
         out_price: 售价
         other_price: 其他费用
         stock_count: 库存数量
+        possible_quantity: 可制作数量（随材料库存和配方变更增量维护）
         image_path: 图片路径
+        version: 版本号（乐观锁，每次编辑递增）
         created_at: 创建时间
         updated_at: 更新时间
     """
@@ -91,14 +95,48 @@ class Product(Base):
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(100), nullable=False, unique=True, index=True)
-    materials = Column(Text, nullable=False)
+    materials = Column(Text, nullable=False, default='{}')
     in_price = Column(Float, nullable=False, default=0)
-    out_price = Column(Float, nullable=False, default=0)
+    out_price = Column(Float, nullable=False, default=0, index=True)
     other_price = Column(Float, nullable=False, default=0)
     stock_count = Column(Integer, default=0, index=True)
+    possible_quantity = Column(Integer, nullable=False, default=0, index=True)
     image_path = Column(String(255))
+    version = Column(Integer, nullable=False, default=1)
     created_at = Column(DateTime, default=china_now, index=True)
-    updated_at = Column(DateTime, default=china_now, onupdate=china_now)
+    updated_at = Column(DateTime, default=china_now, onupdate=china_now, index=True)
+
+
+class ProductMaterial(Base):
+    """
+    产品配方明细 - 产品与材料的多对多关系
+    
+    Attributes:
+        product_id: 产品ID
+        material_id: 材料ID
+        quantity: 每个产品所需材料数量
+    """
+    __tablename__ = 'product_material'
+    
+    product_id = Column(Integer, primary_key=True)
+    material_id = Column(Integer, primary_key=True)
+    quantity = Column(Integer, nullable=False, default=1)
+
+
+class ProductComponent(Base):
+    """
+    产品组件明细 - 产品使用其他产品（半成品）作为组件，构成多级配方
+    
+    Attributes:
+        product_id: 产品ID
+        component_id: 组件产品ID
+        quantity: 每个产品所需组件数量
+    """
+    __tablename__ = 'product_component'
+    
+    product_id = Column(Integer, primary_key=True)
+    component_id = Column(Integer, primary_key=True)
+    quantity = Column(Integer, nullable=False, default=1)
 
 
 class OperationRecord(Base):
@@ -133,7 +171,7 @@ class MaterialHistory(Base):
         id: 记录ID
         material_id: 材料ID
         material_name: 材料名称
-        operation_type: 操作类型 (inbound/outbound)
+        operation_type: 操作类型 (inbound/outbound/produce/restore/import)
         quantity: 变动数量 (正数入库，负数出库)
         in_price: 进价
         out_price: 售价
@@ -165,7 +203,7 @@ class ProductHistory(Base):
         id: 记录ID
         product_id: 产品ID
         product_name: 产品名称
-        operation_type: 操作类型 (inbound/outbound/restore)
+        operation_type: 操作类型 (inbound/outbound/restore/import)
         quantity: 变动数量 (正数入库，负数出库)
         in_price: 成本价
         out_price: 售价
@@ -191,6 +229,119 @@ class ProductHistory(Base):
     created_at = Column(DateTime, default=china_now, index=True)
 
 
+class InventorySnapshot(Base):
+    """
+    库存快照 - 定期（如每晚）记录全量库存，用于按时间点查询库存
+    
+    Attributes:
+        id: 快照ID
+        snapshot_at: 快照时间
+        material_count: 材料种类数
+        product_count: 产品种类数
+        scheduled_day: 定时快照所属日期（YYYY-MM-DD），唯一索引保证每天最多一个定时快照；手动快照为空
+        created_at: 创建时间
+    """
+    __tablename__ = 'inventory_snapshot'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    snapshot_at = Column(DateTime, nullable=False, unique=True, index=True)
+    scheduled_day = Column(String(10))
+    material_count = Column(Integer, default=0)
+    product_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=china_now)
+
+
+class MaterialSnapshot(Base):
+    """
+    材料库存快照明细
+    
+    Attributes:
+        snapshot_id: 快照ID
+        material_id: 材料ID
+        material_name: 材料名称
+        stock_count: 快照时库存
+        in_price: 快照时进价
+        out_price: 快照时售价
+    """
+    __tablename__ = 'material_snapshot'
+    
+    snapshot_id = Column(Integer, primary_key=True)
+    material_id = Column(Integer, primary_key=True)
+    material_name = Column(String(100), nullable=False)
+    stock_count = Column(Integer, nullable=False, default=0)
+    in_price = Column(Float, default=0)
+    out_price = Column(Float, default=0)
+
+
+class ProductSnapshot(Base):
+    """
+    产品库存快照明细
+    
+    Attributes:
+        snapshot_id: 快照ID
+        product_id: 产品ID
+        product_name: 产品名称
+        stock_count: 快照时库存
+        in_price: 快照时成本价
+        out_price: 快照时售价
+    """
+    __tablename__ = 'product_snapshot'
+    
+    snapshot_id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    product_name = Column(String(100), nullable=False)
+    stock_count = Column(Integer, nullable=False, default=0)
+    in_price = Column(Float, default=0)
+    out_price = Column(Float, default=0)
+
+
+class ChangeLog(Base):
+    """
+    数据变更日志 - 由数据库触发器在写入时维护，用于缓存失效和增量同步
+    
+    Attributes:
+        seq: 变更序号，单调递增
+        table_name: 变更的表名
+        row_id: 变更行ID（product_material、product_component 表记录产品ID）
+        operation: 变更类型 (insert/update/delete)
+        changed_at: 变更时间
+    """
+    __tablename__ = 'change_log'
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String(50), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    operation = Column(String(10), nullable=False)
+    changed_at = Column(DateTime, default=china_now)
+
+
+class TableVersion(Base):
+    """
+    表版本号 - 由数据库触发器在每次增删改时递增，用于生成 ETag 和条件请求
+    
+    Attributes:
+        table_name: 表名
+        version: 版本号，表内任意行变更后递增
+    """
+    __tablename__ = 'table_version'
+    
+    table_name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+# 操作记录全文索引 - FTS5 外部内容虚拟表（trigram 分词，支持中文子串），由迁移创建并由触发器维护，
+# 不属于 Base.metadata，create_all 不会创建；rank 为 bm25 相关度（越小越相关）
+operation_record_fts = table('operation_record_fts', column('rowid'), column('rank'))
+
+
 # 复合索引用于查询优化
+Index('idx_change_log_table', ChangeLog.table_name, ChangeLog.seq)
+Index('idx_inventory_snapshot_scheduled_day', InventorySnapshot.scheduled_day, unique=True)
+Index('idx_product_material_material', ProductMaterial.material_id, ProductMaterial.product_id)
+Index('idx_product_component_component', ProductComponent.component_id, ProductComponent.product_id)
+Index('idx_operation_record_created', OperationRecord.created_at, OperationRecord.id)
+Index('idx_operation_record_type_created', OperationRecord.operation_type, OperationRecord.created_at)
+Index('idx_operation_record_user_created', OperationRecord.username, OperationRecord.created_at)
 Index('idx_material_history', MaterialHistory.material_id, MaterialHistory.created_at)
 Index('idx_product_history', ProductHistory.product_id, ProductHistory.created_at)
\ No newline at end of file
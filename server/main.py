@@ -13,11 +13,14 @@
 import os
 import time
 import logging
+import threading
 from logging.handlers import TimedRotatingFileHandler
 from flask import Flask, jsonify, request, g 
 from flask_cors import CORS
 from dotenv import load_dotenv
 from config import Config
+from utils.serialization import NegotiatingJSONProvider, NEGOTIABLE_MIMETYPES
+from utils.compression import compress_response
 
 
 # 加载环境变量
@@ -26,16 +29,22 @@ if os.path.exists(env_file):
     load_dotenv(env_file)
     print(f'已加载环境变量文件: {env_file}')
 from apis.material_api import material_bp
-from apis.product_api import product_bp
+from apis.product_api import product_bp, product_service
 from apis.record_api import record_bp
 from apis.user_api import user_bp
 from apis.common_api import common_bp
 from apis.system_api import system_bp
 from apis.statistics_api import statistics_bp
+from apis.inventory_api import inventory_bp, inventory_service
+from apis.pricing_api import pricing_bp
+from apis.planning_api import planning_bp
+from apis.sync_api import sync_bp, sync_service
 
 
 # ============ 初始化Flask应用 ============
 app = Flask(__name__)
+# 响应层：jsonify 按 Accept 头输出 JSON（默认，安装 orjson 时使用 orjson 编码）或 application/msgpack
+app.json = NegotiatingJSONProvider(app)
 CORS(app)
 Config.init_directories()
 app.config['UPLOAD_FOLDER'] = Config.UPLOAD_FOLDER
@@ -80,12 +89,51 @@ setup_logging()
 
 
 # ============ 注册蓝图 ============
-for bp in (material_bp, user_bp, product_bp, record_bp, common_bp, system_bp, statistics_bp):
+for bp in (material_bp, user_bp, product_bp, record_bp, common_bp, system_bp, statistics_bp, inventory_bp, pricing_bp, planning_bp, sync_bp):
     app.register_blueprint(bp)
 
 app.logger.info('ESSU服务启动')
 
 
+# ============ 定时库存快照 ============
+def start_snapshot_scheduler():
+    """后台线程：每天定时记录一次全量库存快照，并清理超过保留期的变更日志"""
+    def run():
+        while True:
+            time.sleep(inventory_service.seconds_until_next_snapshot(Config.SNAPSHOT_HOUR))
+            result = inventory_service.take_snapshot(skip_if_exists=True)
+            if not result.get('success'):
+                app.logger.error(f'定时库存快照失败: {result.get("message", "")}')
+            result = sync_service.prune_change_log()
+            if not result.get('success'):
+                app.logger.error(f'定时清理变更日志失败: {result.get("message", "")}')
+    
+    threading.Thread(target=run, name='snapshot-scheduler', daemon=True).start()
+    app.logger.info(f'定时库存快照已启用: 每天{Config.SNAPSHOT_HOUR}点')
+
+
+# ============ 命令行工具 ============
+@app.cli.command('rebuild-possible-quantity')
+def rebuild_possible_quantity_command():
+    """全量重建产品可制作数量: flask --app main rebuild-possible-quantity"""
+    result = product_service.rebuild_possible_quantities()
+    print(result)
+
+
+@app.cli.command('take-inventory-snapshot')
+def take_inventory_snapshot_command():
+    """记录当天的定时库存快照（已存在则跳过），供 Gunicorn 等多进程部署配合 cron 使用: flask --app main take-inventory-snapshot"""
+    result = inventory_service.take_snapshot(skip_if_exists=True)
+    print(result)
+
+
+@app.cli.command('prune-change-log')
+def prune_change_log_command():
+    """清理超过保留期的材料、产品、用户变更日志: flask --app main prune-change-log"""
+    result = sync_service.prune_change_log()
+    print(result)
+
+
 # ============ 请求/响应日志和性能监控 ============
 @app.before_request
 def before_request():
@@ -100,6 +148,9 @@ def before_request():
 @app.after_request
 def after_request(response):
     """请求结束后的处理"""
+    # 超过阈值的响应按 Accept-Encoding 压缩（计入请求耗时）
+    response = compress_response(response)
+    
     if request.endpoint and request.endpoint != 'static':
         # 计算请求耗时
         if hasattr(g, 'start_time'):
@@ -122,6 +173,10 @@ def after_request(response):
         else:
             app.logger.info(f'{request.method} {request.path} - {response.status_code}')
     
+    # 响应格式随 Accept 头变化，告知缓存按 Accept 区分
+    if response.mimetype in NEGOTIABLE_MIMETYPES:
+        response.vary.add('Accept')
+    
     return response
 
 
@@ -150,6 +205,9 @@ def handle_exception(e):
 # ============ 启动服务 ============
 if __name__ == '__main__':
     try:
+        # 定时快照只在直接运行的服务进程中启动（导入 main 的 flask 命令和 WSGI worker 不启动），调试模式下跳过重载器的监控父进程
+        if Config.ENABLE_SNAPSHOT_SCHEDULER and (not Config.DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+            start_snapshot_scheduler()
         app.logger.info(f'启动Flask服务器 - 端口{Config.PORT}')
         app.run(debug=Config.DEBUG, host=Config.HOST, port=Config.PORT)
     except Exception as e:
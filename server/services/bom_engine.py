@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: bom_engine.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import logging
+import threading
+import numpy as np
+from sqlalchemy import text
+from dbs.db_manager import DBManager
+from dbs.models import Material, Product, ProductMaterial, ProductComponent
+
+
+class BOMEngine:
+    """
+    配方矩阵引擎 - 缓存多级配方展开后的 产品×原材料 稀疏矩阵（CSR格式），向量化计算可制作数量、成本等
+    
+    产品可以由材料和其他产品（半成品）组成，每个产品的展开结果（原材料用量）记忆化缓存。
+    配方变更通过 change_log 增量感知：只重新加载发生变更的产品，并精确失效该产品及所有上级产品的展开结果。
+    缓存只反映已提交的配方，事务内修改配方时通过 overrides 预览新配方；材料库存、价格按调用方会话读取。
+    """
+    
+    def __init__(self):
+        self.db = DBManager()
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.RLock()
+        self._materials = {}      # 产品ID -> {材料ID: 数量}
+        self._components = {}     # 产品ID -> {组件产品ID: 数量}
+        self._parents = {}        # 组件产品ID -> {使用它的上级产品ID}
+        self._exploded = {}       # 产品ID -> (材料ID数组, 数量数组)，展开后的原材料用量
+        self._synced = None       # (product_material, product_component) 已同步到的 change_log 序号
+        self._matrix = None       # (产品ID, indptr, 材料ID, 数量)
+    
+    def _load_direct(self, session, product_ids=None) -> tuple:
+        """加载产品的直接配方，返回 ({产品ID: {材料ID: 数量}}, {产品ID: {组件产品ID: 数量}})"""
+        material_query = session.query(ProductMaterial.product_id, ProductMaterial.material_id, ProductMaterial.quantity)
+        component_query = session.query(ProductComponent.product_id, ProductComponent.component_id, ProductComponent.quantity)
+        if product_ids is not None:
+            material_query = material_query.filter(ProductMaterial.product_id.in_(product_ids))
+            component_query = component_query.filter(ProductComponent.product_id.in_(product_ids))
+        
+        materials, components = {}, {}
+        for product_id, material_id, quantity in material_query:
+            materials.setdefault(product_id, {})[material_id] = quantity
+        for product_id, component_id, quantity in component_query:
+            components.setdefault(product_id, {})[component_id] = quantity
+        return materials, components
+    
+    def _set_direct(self, product_id, materials: dict, components: dict):
+        """更新缓存中产品的直接配方，同时维护组件到上级产品的反向索引"""
+        for component_id in self._components.get(product_id, {}):
+            self._parents.get(component_id, set()).discard(product_id)
+        
+        if materials:
+            self._materials[product_id] = materials
+        else:
+            self._materials.pop(product_id, None)
+        if components:
+            self._components[product_id] = components
+            for component_id in components:
+                self._parents.setdefault(component_id, set()).add(product_id)
+        else:
+            self._components.pop(product_id, None)
+    
+    def _sync(self):
+        """根据 change_log 同步已提交的配方：首次全量加载，之后只刷新变更的产品并失效其上级产品"""
+        with self.db.session_scope() as session:
+            versions = (self.db.get_table_version(session, 'product_material'),
+                        self.db.get_table_version(session, 'product_component'))
+            if self._synced is None:
+                materials, components = self._load_direct(session)
+                self._materials, self._components, self._parents, self._exploded = {}, {}, {}, {}
+                for product_id in set(materials) | set(components):
+                    self._set_direct(product_id, materials.get(product_id), components.get(product_id))
+                self._matrix = None
+                self.logger.info(f'配方矩阵全量加载: {len(self._materials)}个产品含材料, {len(self._components)}个产品含组件')
+            elif versions != self._synced:
+                changed = (self.db.get_changed_row_ids(session, 'product_material', self._synced[0])
+                           | self.db.get_changed_row_ids(session, 'product_component', self._synced[1]))
+                if changed:
+                    materials, components = self._load_direct(session, list(changed))
+                    for product_id in changed:
+                        self._set_direct(product_id, materials.get(product_id), components.get(product_id))
+                    invalidated = changed | self._ancestors(changed)
+                    for product_id in invalidated:
+                        self._exploded.pop(product_id, None)
+                    self._matrix = None
+                    self.logger.debug(f'配方矩阵增量刷新: {len(changed)}个产品变更, 失效{len(invalidated)}个展开结果')
+            self._synced = versions
+    
+    def _ancestors(self, product_ids) -> set:
+        """获取直接或间接使用这些产品作为组件的所有上级产品"""
+        result = set()
+        pending = list(product_ids)
+        while pending:
+            for parent_id in self._parents.get(pending.pop(), ()):
+                if parent_id not in result:
+                    result.add(parent_id)
+                    pending.append(parent_id)
+        return result
+    
+    def _explode(self, product_id, overrides: dict = None, local: dict = None, stale=(), path=()):
+        """
+        展开产品配方为原材料用量（记忆化）
+        
+        Args:
+            overrides: {产品ID: (材料字典, 组件字典)}，用于预览尚未提交的配方
+            local: 预览时的临时展开结果，stale 中的产品结果只写入这里，不污染缓存
+            stale: 受 overrides 影响的产品ID集合
+        """
+        memo = local if product_id in stale else self._exploded
+        if product_id in memo:
+            return memo[product_id]
+        if product_id in path:
+            raise ValueError(f'产品配方存在循环引用: {product_id}')
+        
+        if overrides and product_id in overrides:
+            materials, components = overrides[product_id]
+        else:
+            materials, components = self._materials.get(product_id, {}), self._components.get(product_id, {})
+        
+        totals = {int(mid): float(qty) for mid, qty in materials.items()}
+        for component_id, quantity in components.items():
+            sub_ids, sub_qtys = self._explode(int(component_id), overrides, local, stale, path + (product_id,))
+            for material_id, sub_qty in zip(sub_ids.tolist(), (sub_qtys * quantity).tolist()):
+                totals[material_id] = totals.get(material_id, 0) + sub_qty
+        
+        material_ids = sorted(totals)
+        row = (np.array(material_ids, dtype=np.int64), np.array([totals[mid] for mid in material_ids], dtype=np.float64))
+        memo[product_id] = row
+        return row
+    
+    def _build_matrix(self, rows: dict):
+        """将 {产品ID: (材料ID数组, 数量数组)} 编译为CSR数组"""
+        product_ids = np.array(sorted(rows), dtype=np.int64)
+        lengths = np.array([len(rows[pid][0]) for pid in product_ids.tolist()], dtype=np.int64)
+        indptr = np.zeros(len(product_ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        if len(product_ids):
+            material_ids = np.concatenate([rows[pid][0] for pid in product_ids.tolist()])
+            quantities = np.concatenate([rows[pid][1] for pid in product_ids.tolist()])
+        else:
+            material_ids = np.zeros(0, dtype=np.int64)
+            quantities = np.zeros(0, dtype=np.float64)
+        return product_ids, indptr, material_ids, quantities
+    
+    def get_matrix(self):
+        """获取同步后的CSR配方矩阵 (产品ID, indptr, 材料ID, 数量)，每行为展开后的原材料用量"""
+        with self._lock:
+            self._sync()
+            if self._matrix is None:
+                product_ids = set(self._materials) | set(self._components)
+                self._matrix = self._build_matrix({pid: self._explode(pid) for pid in product_ids})
+            return self._matrix
+    
+    def explode(self, product_id) -> dict:
+        """获取产品展开后的原材料用量 {材料ID: 数量}"""
+        with self._lock:
+            self._sync()
+            material_ids, quantities = self._explode(product_id)
+            return dict(zip(material_ids.tolist(), quantities.tolist()))
+    
+    def get_ancestors(self, product_ids) -> set:
+        """获取直接或间接使用这些产品作为组件的所有上级产品"""
+        with self._lock:
+            self._sync()
+            return self._ancestors(product_ids)
+    
+    def get_users(self, session, material_ids) -> list:
+        """获取直接（product_material 反向索引）或通过组件间接使用这些材料的产品ID（升序）"""
+        if not material_ids:
+            return []
+        direct = {pid for pid, in session.query(ProductMaterial.product_id).filter(
+            ProductMaterial.material_id.in_(list(material_ids))
+        ).distinct()}
+        return sorted(direct | self.get_ancestors(direct))
+    
+    def find_cycle(self, overrides: dict):
+        """检查按 overrides 修改配方后是否存在循环引用，返回循环中的产品ID，无循环返回None"""
+        with self._lock:
+            self._sync()
+            
+            def children(pid):
+                if pid in overrides:
+                    return [int(cid) for cid in overrides[pid][1]]
+                return list(self._components.get(pid, {}))
+            
+            # 只需从被修改的产品出发做深度优先搜索
+            visiting, done = set(), set()
+            for start in overrides:
+                stack = [(start, iter(children(start)))]
+                visiting.add(start)
+                while stack:
+                    pid, it = stack[-1]
+                    child = next(it, None)
+                    if child is None:
+                        stack.pop()
+                        visiting.discard(pid)
+                        done.add(pid)
+                    elif child in visiting:
+                        return child
+                    elif child not in done:
+                        visiting.add(child)
+                        stack.append((child, iter(children(child))))
+            return None
+    
+    def preview(self, overrides: dict):
+        """
+        预览事务内修改后的配方：返回被修改产品及其所有上级产品的展开矩阵，不写入缓存
+        
+        Args:
+            overrides: {产品ID: ({材料ID: 数量}, {组件产品ID: 数量})}
+        """
+        with self._lock:
+            self._sync()
+            stale = set(overrides) | self._ancestors(overrides)
+            local = {}
+            return self._build_matrix({pid: self._explode(pid, overrides, local, stale) for pid in stale})
+    
+    def load_material_vector(self, session, column, material_ids=None):
+        """读取材料ID（升序）及指定列组成的向量，material_ids为None时读取全部材料"""
+        query = session.query(Material.id, column)
+        if material_ids is not None:
+            query = query.filter(Material.id.in_([int(mid) for mid in material_ids]))
+        rows = query.order_by(Material.id).all()
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        values = np.fromiter((r[1] or 0 for r in rows), dtype=np.float64, count=len(rows))
+        return ids, values
+    
+    def gather(self, material_ids, vector_ids, vector_values):
+        """按配方中的材料ID取向量值，返回(值, 材料是否存在)"""
+        if len(vector_ids) == 0:
+            return np.zeros(len(material_ids)), np.zeros(len(material_ids), dtype=bool)
+        pos = np.searchsorted(vector_ids, material_ids)
+        pos = np.minimum(pos, len(vector_ids) - 1)
+        found = vector_ids[pos] == material_ids
+        return np.where(found, vector_values[pos], 0), found
+    
+    def select_rows(self, matrix, product_ids):
+        """从CSR矩阵中选出指定产品的子矩阵，没有配方的产品视为空行"""
+        all_ids, indptr, material_ids, quantities = matrix
+        requested = np.asarray(product_ids, dtype=np.int64)
+        starts = np.zeros(len(requested), dtype=np.int64)
+        lengths = np.zeros(len(requested), dtype=np.int64)
+        if len(all_ids):
+            pos = np.minimum(np.searchsorted(all_ids, requested), len(all_ids) - 1)
+            present = all_ids[pos] == requested
+            starts[present] = indptr[pos[present]]
+            lengths[present] = indptr[pos[present] + 1] - indptr[pos[present]]
+        
+        sub_indptr = np.zeros(len(requested) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=sub_indptr[1:])
+        # 每个元素在原数组中的下标 = 所在行起点 + 行内偏移
+        offsets = np.arange(sub_indptr[-1]) - np.repeat(sub_indptr[:-1], lengths)
+        gather_idx = np.repeat(starts, lengths) + offsets
+        return requested, sub_indptr, material_ids[gather_idx], quantities[gather_idx]
+    
+    def row_sums(self, matrix, vector_ids, vector_values):
+        """稀疏矩阵与向量的点积：每个产品 Σ 需求量×向量值，不存在的材料计0"""
+        row_ids, indptr, material_ids, quantities = matrix
+        values, _ = self.gather(material_ids, vector_ids, vector_values)
+        weighted = values * quantities
+        
+        result = np.zeros(len(row_ids))
+        non_empty = np.diff(indptr) > 0
+        if non_empty.any():
+            result[non_empty] = np.add.reduceat(weighted, indptr[:-1][non_empty])
+        return result
+    
+    def possible_quantities(self, session, product_ids=None, matrix=None) -> dict:
+        """
+        计算可制作数量 possible = min(库存 // 需求量)，一次向量化除法 + 分段最小值归约
+        
+        Args:
+            product_ids: 指定产品ID列表，None表示全部有配方的产品
+            matrix: 直接指定配方矩阵（如 preview 的结果），优先于 product_ids
+        Returns:
+            {产品ID: 可制作数量}，无配方的产品为0
+        """
+        subset = matrix is not None or product_ids is not None
+        if matrix is None:
+            matrix = self.get_matrix()
+            if product_ids is not None:
+                matrix = self.select_rows(matrix, product_ids)
+        row_ids, indptr, material_ids, quantities = matrix
+        
+        stock_ids, stocks = self.load_material_vector(
+            session, Material.stock_count, np.unique(material_ids).tolist() if subset else None
+        )
+        stock, found = self.gather(material_ids, stock_ids, stocks)
+        
+        # 需求量<=0的配方行不构成约束；配方引用的材料不存在时可制作数量为0
+        per_line = np.full(len(material_ids), np.inf)
+        positive = quantities > 0
+        per_line[positive] = np.floor_divide(stock[positive], quantities[positive])
+        per_line[~found] = 0
+        
+        result = np.zeros(len(row_ids))
+        lengths = np.diff(indptr)
+        non_empty = lengths > 0
+        if non_empty.any():
+            result[non_empty] = np.minimum.reduceat(per_line, indptr[:-1][non_empty])
+        result[np.isinf(result)] = 0
+        
+        return dict(zip(row_ids.tolist(), result.astype(np.int64).tolist()))
+    
+    def _write_possible_quantities(self, session, possible: dict, product_ids=None) -> int:
+        """将可制作数量写回 product 表，只更新发生变化的产品，返回更新数量"""
+        query = session.query(Product.id, Product.possible_quantity)
+        if product_ids is not None:
+            query = query.filter(Product.id.in_(list(product_ids)))
+        
+        drifted = [{'id': pid, 'quantity': possible.get(pid, 0)}
+                   for pid, stored in query if (stored or 0) != possible.get(pid, 0)]
+        if drifted:
+            # 直接执行UPDATE，避免触发 updated_at 的自动更新
+            session.execute(text('UPDATE product SET possible_quantity = :quantity WHERE id = :id'), drifted)
+        return len(drifted)
+    
+    def refresh_possible_quantities(self, session, material_ids=None, overrides: dict = None) -> int:
+        """
+        增量刷新可制作数量列，只计算受影响的产品
+        
+        Args:
+            material_ids: 库存发生变化的材料，刷新直接或间接使用它们的产品
+            overrides: 事务内修改的配方 {产品ID: (材料字典, 组件字典)}，刷新这些产品及其上级产品
+        """
+        session.flush()
+        if overrides:
+            matrix = self.preview(overrides)
+        else:
+            product_ids = self.get_users(session, material_ids)
+            if not product_ids:
+                return 0
+            matrix = self.select_rows(self.get_matrix(), product_ids)
+        
+        possible = self.possible_quantities(session, matrix=matrix)
+        return self._write_possible_quantities(session, possible, possible.keys())
+    
+    def rebuild_possible_quantities(self, session) -> dict:
+        """全量重算产品的可制作数量列，只写回与计算结果不一致的产品"""
+        checked = session.query(Product).count()
+        fixed = self._write_possible_quantities(session, self.possible_quantities(session))
+        self.logger.info(f'可制作数量重建完成: 检查{checked}个产品, 修正{fixed}个')
+        return {'checked': checked, 'fixed': fixed}
+
+
+# 进程内共享的配方矩阵缓存
+bom_engine = BOMEngine()
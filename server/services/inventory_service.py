@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: inventory_service.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert
+from dbs.db_manager import DBManager
+from dbs.models import (
+    Material, Product, MaterialHistory, ProductHistory,
+    InventorySnapshot, MaterialSnapshot, ProductSnapshot
+)
+from utils.timezone_utils import china_now, format_china_time
+
+
+class InventoryService:
+    """库存快照服务 - 定期记录全量库存，按时间点查询库存"""
+    
+    def __init__(self):
+        self.db = DBManager()
+        self.logger = logging.getLogger(__name__)
+    
+    def take_snapshot(self, skip_if_exists: bool = False) -> dict:
+        """记录一次全量库存快照，skip_if_exists为True时当天已有快照则跳过"""
+        try:
+            with self.db.session_scope() as session:
+                now = china_now().replace(tzinfo=None)
+                if skip_if_exists:
+                    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+                    existing = session.query(InventorySnapshot).filter(
+                        InventorySnapshot.snapshot_at >= day_start
+                    ).first()
+                    if existing:
+                        return {'success': True, 'skipped': True, 'snapshot_id': existing.id}
+                    
+                    # 检查与写入之间可能有其他进程写入，由 scheduled_day 唯一索引兜底：INSERT OR IGNORE 未插入即跳过
+                    result = session.execute(insert(InventorySnapshot).prefix_with('OR IGNORE').values(
+                        snapshot_at=now, scheduled_day=now.strftime('%Y-%m-%d')
+                    ))
+                    if not result.rowcount:
+                        return {'success': True, 'skipped': True}
+                    snapshot = session.get(InventorySnapshot, result.inserted_primary_key[0])
+                else:
+                    snapshot = InventorySnapshot(snapshot_at=now)
+                    session.add(snapshot)
+                    session.flush()
+                
+                materials = session.query(
+                    Material.id, Material.name, Material.stock_count, Material.in_price, Material.out_price
+                ).all()
+                products = session.query(
+                    Product.id, Product.name, Product.stock_count, Product.in_price, Product.out_price
+                ).all()
+                
+                session.bulk_insert_mappings(MaterialSnapshot, [{
+                    'snapshot_id': snapshot.id,
+                    'material_id': m.id,
+                    'material_name': m.name,
+                    'stock_count': m.stock_count or 0,
+                    'in_price': m.in_price,
+                    'out_price': m.out_price
+                } for m in materials])
+                session.bulk_insert_mappings(ProductSnapshot, [{
+                    'snapshot_id': snapshot.id,
+                    'product_id': p.id,
+                    'product_name': p.name,
+                    'stock_count': p.stock_count or 0,
+                    'in_price': p.in_price,
+                    'out_price': p.out_price
+                } for p in products])
+                
+                snapshot.material_count = len(materials)
+                snapshot.product_count = len(products)
+                
+                self.logger.info(f'库存快照完成: {snapshot.id}, 材料{len(materials)}种, 产品{len(products)}种')
+                return {'success': True, 'snapshot_id': snapshot.id, 'snapshot_at': format_china_time(now)}
+        except Exception as e:
+            self.logger.error(f'库存快照异常: {str(e)}', exc_info=True)
+            return {'success': False, 'message': '快照失败'}
+    
+    def get_snapshots(self, limit: int = 30) -> dict:
+        """获取最近的快照列表"""
+        with self.db.session_scope() as session:
+            snapshots = session.query(InventorySnapshot).order_by(
+                InventorySnapshot.snapshot_at.desc()
+            ).limit(limit).all()
+            return {'success': True, 'snapshots': [{
+                'id': s.id,
+                'snapshot_at': format_china_time(s.snapshot_at),
+                'material_count': s.material_count,
+                'product_count': s.product_count
+            } for s in snapshots]}
+    
+    def _sum_deltas(self, session, history_model, key_column, start: datetime, end: datetime) -> dict:
+        """汇总(start, end]区间内的库存变动"""
+        rows = session.query(
+            key_column, func.sum(history_model.quantity)
+        ).filter(
+            history_model.created_at > start,
+            history_model.created_at <= end
+        ).group_by(key_column).all()
+        return {key: delta or 0 for key, delta in rows}
+    
+    def _load_base(self, session, snapshot):
+        """加载基准库存：snapshot为None时使用当前库存表"""
+        if snapshot is None:
+            materials = session.query(
+                Material.id, Material.name, Material.stock_count, Material.in_price, Material.out_price
+            ).all()
+            products = session.query(
+                Product.id, Product.name, Product.stock_count, Product.in_price, Product.out_price
+            ).all()
+        else:
+            materials = session.query(
+                MaterialSnapshot.material_id, MaterialSnapshot.material_name, MaterialSnapshot.stock_count,
+                MaterialSnapshot.in_price, MaterialSnapshot.out_price
+            ).filter(MaterialSnapshot.snapshot_id == snapshot.id).all()
+            products = session.query(
+                ProductSnapshot.product_id, ProductSnapshot.product_name, ProductSnapshot.stock_count,
+                ProductSnapshot.in_price, ProductSnapshot.out_price
+            ).filter(ProductSnapshot.snapshot_id == snapshot.id).all()
+        
+        return self._to_stock_map(materials), self._to_stock_map(products)
+    
+    def _to_stock_map(self, rows) -> dict:
+        """(id, name, stock, in_price, out_price) 行转换为以ID为键的字典"""
+        return {r[0]: {'id': r[0], 'name': r[1], 'stock_count': r[2] or 0,
+                       'in_price': r[3] or 0, 'out_price': r[4] or 0} for r in rows}
+    
+    def _nearest_history(self, session, history_model, key_column, name_column, ids, start: datetime, end: datetime, sign: int) -> dict:
+        """
+        (start, end]区间内距离查询时间点最近的一条变动记录，返回 {ID: (名称, 进价, 售价)}
+        向后推演取最后一条（end 即查询时间点），向前回滚取第一条（start 即查询时间点）
+        """
+        pick = func.max(history_model.id) if sign == 1 else func.min(history_model.id)
+        nearest = session.query(pick.label('id')).filter(
+            key_column.in_(ids), history_model.created_at > start, history_model.created_at <= end
+        ).group_by(key_column).subquery()
+        rows = session.query(key_column, name_column, history_model.in_price, history_model.out_price).join(
+            nearest, history_model.id == nearest.c.id
+        )
+        return {key: (name, in_price or 0, out_price or 0) for key, name, in_price, out_price in rows}
+    
+    def _first_seen(self, session, model, history_model, history_key, snapshot_model, snapshot_key, ids) -> dict:
+        """各ID最早出现的时间：现存行取 created_at，已删除的取最早的变动记录或快照时间"""
+        ids = list(ids)
+        seen = dict(session.query(model.id, model.created_at).filter(model.id.in_(ids)))
+        missing = [item_id for item_id in ids if item_id not in seen]
+        if missing:
+            earliest = session.query(history_key, func.min(history_model.created_at)).filter(
+                history_key.in_(missing)
+            ).group_by(history_key).union_all(
+                session.query(snapshot_key, func.min(InventorySnapshot.snapshot_at)).join(
+                    InventorySnapshot, InventorySnapshot.id == snapshot_model.snapshot_id
+                ).filter(snapshot_key.in_(missing)).group_by(snapshot_key)
+            )
+            for item_id, at in earliest:
+                if at is not None and (seen.get(item_id) is None or at < seen[item_id]):
+                    seen[item_id] = at
+        return seen
+    
+    def _apply_deltas(self, items: dict, deltas: dict, defaults: dict, sign: int):
+        """将变动应用到基准库存上，sign为1向后推演，-1向前回滚；基准中没有的ID使用 defaults 中的 (名称, 进价, 售价)"""
+        for item_id, delta in deltas.items():
+            item = items.get(item_id)
+            if item is None:
+                name, in_price, out_price = defaults.get(item_id, ('', 0, 0))
+                item = items[item_id] = {'id': item_id, 'name': name,
+                                         'stock_count': 0, 'in_price': in_price, 'out_price': out_price}
+            item['stock_count'] += sign * delta
+    
+    def _drop_created_after(self, items: dict, first_seen: dict, as_of: datetime):
+        """回滚时移除查询时间点之后才创建的材料或产品"""
+        for item_id in [item_id for item_id, at in first_seen.items() if at is not None and at > as_of]:
+            items.pop(item_id, None)
+    
+    def get_inventory_as_of(self, date_str: str) -> dict:
+        """查询指定日期日终时的库存：加载最近的快照，只应用快照之后（或之前）的变动"""
+        try:
+            as_of = datetime.strptime(date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+        except (ValueError, TypeError):
+            return {'success': False, 'message': '日期格式错误，应为YYYY-MM-DD'}
+        
+        try:
+            with self.db.session_scope() as session:
+                now = china_now().replace(tzinfo=None)
+                as_of = min(as_of, now)
+                
+                before = session.query(InventorySnapshot).filter(
+                    InventorySnapshot.snapshot_at <= as_of
+                ).order_by(InventorySnapshot.snapshot_at.desc()).first()
+                after = session.query(InventorySnapshot).filter(
+                    InventorySnapshot.snapshot_at > as_of
+                ).order_by(InventorySnapshot.snapshot_at.asc()).first()
+                
+                # 当前库存表视为"现在"的快照，取距离最近的基准
+                after_at = after.snapshot_at if after else now
+                use_before = before is not None and (as_of - before.snapshot_at) <= (after_at - as_of)
+                
+                if use_before:
+                    base, start, end, sign = before, before.snapshot_at, as_of, 1
+                else:
+                    base, start, end, sign = after, as_of, after_at, -1
+                
+                materials, products = self._load_base(session, base)
+                
+                material_deltas = self._sum_deltas(session, MaterialHistory, MaterialHistory.material_id, start, end)
+                product_deltas = self._sum_deltas(session, ProductHistory, ProductHistory.product_id, start, end)
+                
+                # 基准中没有的ID（基准之后新建或已删除）：名称和价格取距离查询时间点最近的变动记录
+                unknown_materials = [mid for mid in material_deltas if mid not in materials]
+                unknown_products = [pid for pid in product_deltas if pid not in products]
+                material_defaults = self._nearest_history(
+                    session, MaterialHistory, MaterialHistory.material_id, MaterialHistory.material_name,
+                    unknown_materials, start, end, sign
+                ) if unknown_materials else {}
+                product_defaults = self._nearest_history(
+                    session, ProductHistory, ProductHistory.product_id, ProductHistory.product_name,
+                    unknown_products, start, end, sign
+                ) if unknown_products else {}
+                
+                self._apply_deltas(materials, material_deltas, material_defaults, sign)
+                self._apply_deltas(products, product_deltas, product_defaults, sign)
+                
+                # 从更晚的基准回滚时，基准中包含查询时间点之后才创建的行
+                if sign == -1:
+                    self._drop_created_after(materials, self._first_seen(
+                        session, Material, MaterialHistory, MaterialHistory.material_id,
+                        MaterialSnapshot, MaterialSnapshot.material_id, materials
+                    ), as_of)
+                    self._drop_created_after(products, self._first_seen(
+                        session, Product, ProductHistory, ProductHistory.product_id,
+                        ProductSnapshot, ProductSnapshot.product_id, products
+                    ), as_of)
+                
+                material_list = sorted(materials.values(), key=lambda m: m['id'])
+                product_list = sorted(products.values(), key=lambda p: p['id'])
+                for item in material_list + product_list:
+                    item['stock_value'] = round(item['stock_count'] * item['in_price'], 2)
+                
+                return {
+                    'success': True,
+                    'as_of': format_china_time(as_of),
+                    'base': {
+                        'snapshot_id': base.id if base else None,
+                        'snapshot_at': format_china_time(base.snapshot_at if base else now),
+                        'direction': 'forward' if sign == 1 else 'backward',
+                        'applied_changes': len(material_deltas) + len(product_deltas)
+                    },
+                    'materials': material_list,
+                    'products': product_list,
+                    'summary': {
+                        'material_stock': sum(m['stock_count'] for m in material_list),
+                        'material_value': round(sum(m['stock_value'] for m in material_list), 2),
+                        'product_stock': sum(p['stock_count'] for p in product_list),
+                        'product_value': round(sum(p['stock_value'] for p in product_list), 2)
+                    }
+                }
+        except Exception as e:
+            self.logger.error(f'按时间点查询库存异常: {date_str} - {str(e)}', exc_info=True)
+            return {'success': False, 'message': '查询失败'}
+    
+    def seconds_until_next_snapshot(self, hour: int) -> float:
+        """计算距离下一次定时快照的秒数"""
+        now = china_now().replace(tzinfo=None)
+        next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
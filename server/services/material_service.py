@@ -11,42 +11,84 @@
 """
 
 import os
-import json
 import logging
 import openpyxl
 from io import BytesIO
+from sqlalchemy import func
 from dbs.db_manager import DBManager
 from datetime import datetime
 from PIL import Image
 from flask import jsonify, send_file
 from openpyxl.drawing.image import Image as XLImage
-from dbs.models import Material, Product
-from utils.timezone_utils import format_china_time
+from dbs.models import Material, Product, MaterialHistory, ProductMaterial
+from services.bom_engine import bom_engine
+from services.price_engine import price_engine
+from utils.timezone_utils import format_china_time, format_db_time
+from utils.query_utils import apply_search, apply_range, apply_level_filter, apply_sort, project_fields, fetch_rows, compile_serializer, build_columnar, iter_batches
 from config import Config
 
 
 class MaterialService:
     """材料服务 - 负责材料的增删改查和库存管理"""
     
+    # 排序键 -> 排序列（margin 为表达式，其余均为索引列）
+    SORT_COLUMNS = {
+        'name': Material.name,
+        'price': Material.out_price,
+        'stock': Material.stock_count,
+        'updated_at': Material.updated_at,
+        'margin': Material.out_price - Material.in_price
+    }
+    
+    # 稀疏字段 -> (依赖的列, 取值函数(材料行, 引用产品列表))
+    FIELDS = {
+        'id': ((Material.id,), lambda m, used: m.id),
+        'name': ((Material.name,), lambda m, used: m.name),
+        'in_price': ((Material.in_price,), lambda m, used: m.in_price),
+        'out_price': ((Material.out_price,), lambda m, used: m.out_price),
+        'stock_count': ((Material.stock_count,), lambda m, used: m.stock_count),
+        'image_path': ((Material.image_path,), lambda m, used: m.image_path),
+        'used_by_products': ((), lambda m, used: used),
+        'is_used': ((), lambda m, used: len(used) > 0),
+        'version': ((Material.version,), lambda m, used: m.version),
+        'created_at': ((Material.created_at,), lambda m, used: format_db_time(m.created_at)),
+        'updated_at': ((Material.updated_at,), lambda m, used: format_db_time(m.updated_at))
+    }
+    USED_FIELDS = {'used_by_products', 'is_used'}
+    
     def __init__(self):
         self.db = DBManager()
         self.logger = logging.getLogger(__name__)
     
-    def _parse_used_list(self, used_by_products_str: str) -> list:
-        """解析used_by_products JSON字符串"""
-        try:
-            return json.loads(used_by_products_str or '[]')
-        except (json.JSONDecodeError, TypeError):
-            self.logger.warning(f'解析used_by_products失败: {used_by_products_str}')
-            return []
+    def _get_used_map(self, session, material_ids: list = None) -> dict:
+        """通过 product_material 反向索引获取 {材料ID: [使用该材料的产品ID]}"""
+        query = session.query(ProductMaterial.material_id, ProductMaterial.product_id)
+        if material_ids is not None:
+            query = query.filter(ProductMaterial.material_id.in_(material_ids))
+        
+        used_map = {}
+        for material_id, product_id in fetch_rows(session, query.order_by(ProductMaterial.material_id, ProductMaterial.product_id)):
+            used_map.setdefault(material_id, []).append(product_id)
+        return used_map
+    
+    def add_history(self, session, material, operation_type: str, quantity: int, stock_before: int, final_price: float = 0):
+        """记录材料库存变动历史"""
+        session.add(MaterialHistory(
+            material_id=material.id,
+            material_name=material.name,
+            operation_type=operation_type,
+            quantity=quantity,
+            in_price=material.in_price,
+            out_price=material.out_price,
+            final_price=final_price,
+            stock_before=stock_before,
+            stock_after=stock_before + quantity
+        ))
     
     def get_products_using_material(self, material_id: int) -> list:
         """获取使用该材料的产品ID列表"""
         with self.db.session_scope() as session:
-            material = session.query(Material).filter(Material.id == material_id).first()
-            if not material:
-                return []
-            return self._parse_used_list(material.used_by_products)
+            return self._get_used_map(session, [material_id]).get(material_id, [])
     
     def add_material(self, name: str, in_price: float, out_price: float = None, image_path: str = None, stock_count: int = 0) -> dict:
         """添加材料"""
@@ -64,50 +106,95 @@ class MaterialService:
                 )
                 session.add(material)
                 session.flush()
+                
+                if stock_count:
+                    self.add_history(session, material, 'import', stock_count, 0)
+                
                 self.logger.info(f'材料添加成功: {material.id} - {name}')
                 return {'success': True, 'material_id': material.id}
         except Exception as e:
             self.logger.error(f'材料添加异常: {name} - {str(e)}', exc_info=True)
             return {'success': False, 'message': '添加失败'}
     
-    def get_all_materials(self):
-        """获取所有材料"""
+    def _format_material(self, m, used_list: list, fields: list = None) -> dict:
+        """格式化单个材料（ORM对象或行元组），fields 指定时只输出这些字段"""
+        return compile_serializer(self.FIELDS, fields)(m, used_list)
+    
+    def _query_materials(self, session, filters: dict = None):
+        """
+        构建材料查询，所有筛选和排序都在SQL中执行
+        
+        Args:
+            filters: search(关键词列表), min_stock/max_stock, min_price/max_price(售价),
+                     stock_filter(zero/low/normal), reference_filter(used/zero), sort_by, order
+        """
+        filters = filters or {}
+        query = apply_search(session.query(Material), Material.name, filters.get('search'))
+        query = apply_range(query, Material.stock_count, filters.get('min_stock'), filters.get('max_stock'))
+        query = apply_range(query, Material.out_price, filters.get('min_price'), filters.get('max_price'))
+        query = apply_level_filter(query, Material.stock_count, filters.get('stock_filter'))
+        
+        # 引用状态通过 product_material 的 (material_id, product_id) 索引做 EXISTS 判断
+        used = session.query(ProductMaterial.material_id).filter(ProductMaterial.material_id == Material.id).exists()
+        if filters.get('reference_filter') == 'used':
+            query = query.filter(used)
+        elif filters.get('reference_filter') == 'zero':
+            query = query.filter(~used)
+        
+        return apply_sort(query, self.SORT_COLUMNS, filters.get('sort_by'), filters.get('order'), Material.id)
+    
+    def _is_filtered(self, filters: dict) -> bool:
+        """是否有筛选条件（排序不算）"""
+        return any(value not in (None, '', []) for key, value in (filters or {}).items() if key not in ('sort_by', 'order'))
+    
+    def _needs_used_map(self, fields: list) -> bool:
+        """是否需要加载引用关系"""
+        return fields is None or not self.USED_FIELDS.isdisjoint(fields)
+    
+    def _serialize_materials(self, materials, used_map: dict, fields: list, columnar: bool) -> dict:
+        """序列化材料列表：默认 {materials: [...]}，列式格式为 {columns, rows}"""
+        if columnar:
+            return build_columnar(materials, fields, self.FIELDS, lambda m: (used_map.get(m.id, []),))
+        serialize = compile_serializer(self.FIELDS, fields)
+        return {'materials': [serialize(m, used_map.get(m.id, [])) for m in materials]}
+    
+    def get_all_materials(self, filters: dict = None, fields: list = None, columnar: bool = False):
+        """获取所有材料，支持筛选、排序、稀疏字段（只查询和序列化请求的字段）和列式格式"""
+        if columnar and fields is None:
+            fields = list(self.FIELDS)
         with self.db.session_scope() as session:
-            materials = session.query(Material).order_by(Material.id).all()
-            return {'success': True, 'materials': [{
-                'id': m.id,
-                'name': m.name,
-                'in_price': m.in_price,
-                'out_price': m.out_price,
-                'stock_count': m.stock_count,
-                'image_path': m.image_path,
-                'used_by_products': self._parse_used_list(m.used_by_products),
-                'is_used': len(self._parse_used_list(m.used_by_products)) > 0,
-                'created_at': format_china_time(m.created_at),
-                'updated_at': format_china_time(m.updated_at)
-            } for m in materials]}
+            query = project_fields(self._query_materials(session, filters), fields, self.FIELDS, Material.id)
+            materials = fetch_rows(session, query)
+            used_map = {}
+            if self._needs_used_map(fields):
+                used_map = self._get_used_map(session, [m.id for m in materials] if self._is_filtered(filters) else None)
+            return {'success': True, **self._serialize_materials(materials, used_map, fields, columnar)}
     
-    def get_materials_paginated(self, offset: int, limit: int):
-        """分页获取材料"""
+    def get_materials_paginated(self, offset: int, limit: int, filters: dict = None, fields: list = None, columnar: bool = False):
+        """分页获取材料，总数使用 COUNT 查询，只加载当前页材料的引用关系"""
+        if columnar and fields is None:
+            fields = list(self.FIELDS)
         with self.db.session_scope() as session:
-            materials = session.query(Material).order_by(Material.id).offset(offset).limit(limit).all()
-            return {'success': True, 'materials': [{
-                'id': m.id,
-                'name': m.name,
-                'in_price': m.in_price,
-                'out_price': m.out_price,
-                'stock_count': m.stock_count,
-                'image_path': m.image_path,
-                'used_by_products': self._parse_used_list(m.used_by_products),
-                'is_used': len(self._parse_used_list(m.used_by_products)) > 0,
-                'created_at': format_china_time(m.created_at),
-                'updated_at': format_china_time(m.updated_at)
-            } for m in materials]}
+            query = self._query_materials(session, filters)
+            total = query.order_by(None).with_entities(func.count(Material.id)).scalar()
+            materials = fetch_rows(session, project_fields(query, fields, self.FIELDS, Material.id).offset(offset).limit(limit))
+            used_map = self._get_used_map(session, [m.id for m in materials]) if self._needs_used_map(fields) else {}
+            return {'success': True, 'total': total, **self._serialize_materials(materials, used_map, fields, columnar)}
+    
+    def iter_materials(self, filters: dict = None, fields: list = None):
+        """流式逐个生成材料，按批读取数据库游标，每批只加载本批材料的引用关系"""
+        with self.db.session_scope() as session:
+            query = project_fields(self._query_materials(session, filters), fields, self.FIELDS, Material.id)
+            serialize = compile_serializer(self.FIELDS, fields)
+            for batch in iter_batches(session, query):
+                used_map = self._get_used_map(session, [m.id for m in batch]) if self._needs_used_map(fields) else {}
+                for material in batch:
+                    yield serialize(material, used_map.get(material.id, []))
     
     def get_materials_count(self) -> dict:
         """获取材料总数"""
         with self.db.session_scope() as session:
-            return {'success': True, 'count': session.query(Material).count()}
+            return {'success': True, 'count': session.query(func.count(Material.id)).scalar()}
     
     def delete_material(self, material_id: int) -> dict:
         """删除材料"""
@@ -120,9 +207,9 @@ class MaterialService:
                 if material.stock_count > 0:
                     return {'success': False, 'message': f'材料 {material.name} 库存不为零（{material.stock_count}个），请先出库后再删除'}
                 
-                used_list = self._parse_used_list(material.used_by_products)
-                if len(used_list) > 0:
-                    return {'success': False, 'message': f'被{len(used_list)}个产品使用，请先删除相关产品'}
+                used_count = session.query(ProductMaterial).filter(ProductMaterial.material_id == material_id).count()
+                if used_count > 0:
+                    return {'success': False, 'message': f'被{used_count}个产品使用，请先删除相关产品'}
                 
                 session.delete(material)
                 self.logger.info(f'材料删除成功: {material_id} - {material.name}')
@@ -136,6 +223,7 @@ class MaterialService:
         try:
             with self.db.session_scope() as session:
                 materials = session.query(Material).filter(Material.id.in_(material_ids)).all()
+                used_map = self._get_used_map(session, [m.id for m in materials])
                 failed_materials = []
                 deleted_count = 0
                 
@@ -147,7 +235,7 @@ class MaterialService:
                         })
                         continue
                     
-                    used_list = self._parse_used_list(material.used_by_products)
+                    used_list = used_map.get(material.id, [])
                     if len(used_list) > 0:
                         failed_materials.append({
                             'name': material.name,
@@ -172,7 +260,7 @@ class MaterialService:
             return {'success': False, 'message': '删除失败'}
     
     def check_related_products(self, material_id: int, in_price: float = None, out_price: float = None) -> dict:
-        """检查使用该材料的产品列表"""
+        """检查直接或通过组件间接使用该材料的产品列表，预览调价后的成本和售价"""
         try:
             with self.db.session_scope() as session:
                 material = session.query(Material).filter(Material.id == material_id).first()
@@ -188,54 +276,46 @@ class MaterialService:
                 if not price_changed:
                     return {'success': True, 'price_changed': False, 'affected_products': []}
                 
-                products = session.query(Product).all()
-                material_id_str = str(material_id)
+                # 与价格传播一致：包含通过组件间接使用该材料的上级产品，用量按展开后的原材料计算
+                product_ids = bom_engine.get_users(session, [material_id])
+                products = session.query(Product).filter(Product.id.in_(product_ids)).order_by(Product.id).all()
+                boms = self._load_exploded_boms(session, product_ids)
                 affected_products = []
                 
                 for product in products:
-                    try:
-                        materials = json.loads(product.materials)
-                        if material_id_str in materials:
-                            current_cost = 0
-                            current_selling = 0
-                            new_cost = 0
-                            new_selling = 0
-                            
-                            for mat_id, required_qty in materials.items():
-                                mat = session.query(Material).filter(Material.id == int(mat_id)).first()
-                                if mat:
-                                    current_cost += (mat.in_price or 0) * required_qty
-                                    current_selling += (mat.out_price or 0) * required_qty
-                                    
-                                    if int(mat_id) == material_id:
-                                        new_cost += (in_price if in_price is not None else mat.in_price or 0) * required_qty
-                                        new_selling += (out_price if out_price is not None else mat.out_price or 0) * required_qty
-                                    else:
-                                        new_cost += (mat.in_price or 0) * required_qty
-                                        new_selling += (mat.out_price or 0) * required_qty
-                            
-                            other_price = product.other_price or 0
-                            current_selling += other_price
-                            new_selling += other_price
-                            
-                            material_list = []
-                            for mat_id, qty in materials.items():
-                                mat = session.query(Material).filter(Material.id == int(mat_id)).first()
-                                if mat:
-                                    material_list.append(f'{mat.name}×{qty}')
-                            
-                            affected_products.append({
-                                'id': product.id,
-                                'name': product.name,
-                                'image_path': product.image_path,
-                                'materials': ', '.join(material_list),
-                                'current_cost': round(current_cost, 2),
-                                'current_selling': round(current_selling, 2),
-                                'new_cost': round(new_cost, 2),
-                                'new_selling': round(new_selling, 2)
-                            })
-                    except (json.JSONDecodeError, ValueError):
-                        continue
+                    current_cost = 0
+                    current_selling = 0
+                    new_cost = 0
+                    new_selling = 0
+                    material_list = []
+                    
+                    for mat, required_qty in boms.get(product.id, []):
+                        current_cost += (mat.in_price or 0) * required_qty
+                        current_selling += (mat.out_price or 0) * required_qty
+                        
+                        if mat.id == material_id:
+                            new_cost += (in_price if in_price is not None else mat.in_price or 0) * required_qty
+                            new_selling += (out_price if out_price is not None else mat.out_price or 0) * required_qty
+                        else:
+                            new_cost += (mat.in_price or 0) * required_qty
+                            new_selling += (mat.out_price or 0) * required_qty
+                        
+                        material_list.append(f'{mat.name}×{required_qty:g}')
+                    
+                    other_price = product.other_price or 0
+                    current_selling += other_price
+                    new_selling += other_price
+                    
+                    affected_products.append({
+                        'id': product.id,
+                        'name': product.name,
+                        'image_path': product.image_path,
+                        'materials': ', '.join(material_list),
+                        'current_cost': round(current_cost, 2),
+                        'current_selling': round(current_selling, 2),
+                        'new_cost': round(new_cost, 2),
+                        'new_selling': round(new_selling, 2)
+                    })
                 
                 return {
                     'success': True,
@@ -247,13 +327,18 @@ class MaterialService:
             self.logger.error(f'检查相关产品失败: {str(e)}', exc_info=True)
             return {'success': False, 'message': '检查失败'}
     
-    def update_material(self, material_id: int, name: str, in_price: float = None, out_price: float = None, image_path: str = None, stock_count: int = None) -> dict:
-        """更新材料信息"""
+    def update_material(self, material_id: int, name: str, in_price: float = None, out_price: float = None, image_path: str = None, stock_count: int = None, expected_version: int = None) -> dict:
+        """更新材料信息，传入expected_version时版本号不匹配则返回冲突"""
         try:
             with self.db.session_scope() as session:
+                if not self.db.bump_version(session, Material, material_id, expected_version):
+                    material = session.query(Material).filter(Material.id == material_id).first()
+                    if not material:
+                        return {'success': False, 'message': '材料不存在'}
+                    self.logger.warning(f'材料更新冲突: {material_id} - 期望版本: {expected_version}, 当前版本: {material.version}')
+                    return {'success': False, 'conflict': True, 'message': '材料已被其他用户修改，请刷新后重试', 'material': self._format_material(material, self._get_used_map(session, [material_id]).get(material_id, []))}
+                
                 material = session.query(Material).filter(Material.id == material_id).first()
-                if not material:
-                    return {'success': False, 'message': '材料不存在'}
                 
                 price_changed = False
                 if in_price is not None and material.in_price != in_price:
@@ -268,51 +353,72 @@ class MaterialService:
                     material.out_price = out_price
                 if image_path is not None:
                     material.image_path = image_path
-                if stock_count is not None:
+                if stock_count is not None and stock_count != material.stock_count:
+                    stock_before = material.stock_count or 0
                     material.stock_count = stock_count
+                    self.add_history(session, material, 'import', stock_count - stock_before, stock_before)
+                    bom_engine.refresh_possible_quantities(session, material_ids=[material_id])
                 
-                if price_changed:
-                    self._update_related_products_price(session, material_id)
+                repriced_products = price_engine.reprice_products(session, material_ids=[material_id]) if price_changed else []
                 
                 self.logger.info(f'材料更新成功: {material_id} - {name}')
-                return {'success': True, 'price_changed': price_changed}
+                return {'success': True, 'price_changed': price_changed, 'repriced_products': repriced_products, 'version': material.version}
         except Exception as e:
             self.logger.error(f'材料更新异常: {material_id} - {str(e)}', exc_info=True)
             return {'success': False, 'message': '更新失败'}
     
-    def _update_related_products_price(self, session, material_id: int):
-        """更新使用该材料的产品价格"""
+    def _load_exploded_boms(self, session, product_ids: list) -> dict:
+        """加载产品展开后的原材料用量，返回 {产品ID: [(材料行, 数量)]}，已不存在的材料不计入"""
+        exploded = {pid: bom_engine.explode(pid) for pid in product_ids}
+        material_ids = {mid for usage in exploded.values() for mid in usage}
+        materials = {m.id: m for m in session.query(
+            Material.id, Material.name, Material.in_price, Material.out_price
+        ).filter(Material.id.in_(material_ids))} if material_ids else {}
+        
+        return {pid: [(materials[mid], quantity) for mid, quantity in sorted(usage.items()) if mid in materials]
+                for pid, usage in exploded.items()}
+    
+    def update_prices(self, changes: list) -> dict:
+        """
+        批量更新材料价格，所有变价在同一事务内合并为一次产品价格传导
+        
+        Args:
+            changes: [{'material_id': 材料ID, 'in_price': 进价, 'out_price': 售价}]
+        """
         try:
-            # 优化：一次性加载所有材料，避免N+1查询
-            all_materials = session.query(Material).all()
-            material_map = {str(m.id): m for m in all_materials}
-            
-            products = session.query(Product).all()
-            material_id_str = str(material_id)
-            
-            for product in products:
-                try:
-                    materials = json.loads(product.materials)
-                    
-                    if material_id_str in materials:
-                        total_in_price = 0
-                        
-                        for mat_id, required_qty in materials.items():
-                            material = material_map.get(mat_id)
-                            if material:
-                                total_in_price += (material.in_price or 0) * required_qty
-                        
-                        product.in_price = total_in_price
-                        product.out_price = total_in_price + (product.other_price or 0)
-                        
-                        self.logger.debug(f'更新产品价格: {product.name} - 成本: {total_in_price}, 售价: {product.out_price}')
-                        
-                except (json.JSONDecodeError, ValueError) as e:
-                    self.logger.warning(f'解析产品材料失败: {product.id} - {str(e)}')
-                    continue
-                    
+            with self.db.session_scope() as session:
+                changes_map = {int(c['material_id']): c for c in changes}
+                materials = session.query(Material).filter(Material.id.in_(list(changes_map))).all()
+                missing = set(changes_map) - {m.id for m in materials}
+                if missing:
+                    return {'success': False, 'message': f'材料ID {", ".join(str(mid) for mid in sorted(missing))} 不存在'}
+                
+                changed_ids = []
+                for material in materials:
+                    change = changes_map[material.id]
+                    in_price = change.get('in_price')
+                    out_price = change.get('out_price')
+                    modified = False
+                    if in_price is not None and material.in_price != float(in_price):
+                        material.in_price = float(in_price)
+                        changed_ids.append(material.id)
+                        modified = True
+                    if out_price is not None and material.out_price != float(out_price):
+                        material.out_price = float(out_price)
+                        modified = True
+                    if modified:
+                        material.version = (material.version or 1) + 1
+                
+                repriced_products = price_engine.reprice_products(session, material_ids=changed_ids)
+                
+                self.logger.info(f'批量更新材料价格: {len(materials)}个材料, 进价变化{len(changed_ids)}个, 产品价格变化{len(repriced_products)}个')
+                return {'success': True, 'updated_count': len(materials), 'repriced_products': repriced_products}
+        except (ValueError, TypeError, KeyError) as e:
+            self.logger.warning(f'批量更新材料价格参数错误: {str(e)}')
+            return {'success': False, 'message': '价格参数无效'}
         except Exception as e:
-            self.logger.error(f'更新相关产品价格失败: {str(e)}', exc_info=True)
+            self.logger.error(f'批量更新材料价格异常: {str(e)}', exc_info=True)
+            return {'success': False, 'message': '更新失败'}
     
     def inbound(self, material_id: int, quantity: int, supplier: str) -> dict:
         """入库材料"""
@@ -340,6 +446,7 @@ class MaterialService:
                     stock_after=stock_after
                 )
                 session.add(history)
+                bom_engine.refresh_possible_quantities(session, material_ids=[material_id])
                 
                 self.logger.info(f'材料入库成功: {material_id}, 数量: {quantity}')
                 return {'success': True, 'material_name': material.name}
@@ -376,6 +483,7 @@ class MaterialService:
                     stock_after=stock_after
                 )
                 session.add(history)
+                bom_engine.refresh_possible_quantities(session, material_ids=[material_id])
                 
                 self.logger.info(f'材料出库成功: {material_id}, 数量: {quantity}')
                 return {'success': True, 'material_name': material.name}
@@ -400,6 +508,7 @@ class MaterialService:
             created_count = 0
             updated_count = 0
             failed_count = 0
+            parsed_rows = []
             
             for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
                 first_col = str(row[0]) if row[0] else ''
@@ -418,9 +527,19 @@ class MaterialService:
                     in_price = float(row[price_in_idx]) if row[price_in_idx] else 0
                     out_price = float(row[price_out_idx]) if row[price_out_idx] else in_price
                     import_stock = int(row[stock_idx]) if stock_idx < len(row) and row[stock_idx] else 0
-                    
-                    with self.db.session_scope() as session:
-                        existing = session.query(Material).filter(Material.name == name).first()
+                    parsed_rows.append((row_num, name, in_price, out_price, import_stock))
+                except Exception as e:
+                    self.logger.error(f'第{row_num}行导入失败: {str(e)}', exc_info=True)
+                    failed_count += 1
+            
+            # 所有行在同一事务内处理：一次查询已有材料，最后合并刷新可制作数量
+            with self.db.session_scope() as session:
+                names = list({name for _, name, _, _, _ in parsed_rows})
+                existing_map = {m.name: m for m in session.query(Material).filter(Material.name.in_(names))} if names else {}
+                stock_changed_ids = set()
+                
+                for row_num, name, in_price, out_price, import_stock in parsed_rows:
+                    existing = existing_map.get(name)
                     
                     if existing:
                         # 检查价格是否匹配
@@ -434,26 +553,28 @@ class MaterialService:
                             continue
                         
                         # 库存自增
-                        new_stock = existing.stock_count + import_stock
-                        result = self.update_material(
-                            existing.id, name, in_price, out_price, None, new_stock
-                        )
-                        if result.get('success'):
-                            updated_count += 1
-                        else:
-                            failed_count += 1
+                        if import_stock:
+                            stock_before = existing.stock_count or 0
+                            existing.stock_count = stock_before + import_stock
+                            existing.version = (existing.version or 1) + 1
+                            self.add_history(session, existing, 'import', import_stock, stock_before)
+                            stock_changed_ids.add(existing.id)
+                        updated_count += 1
                     else:
-                        result = self.add_material(
-                            name, in_price, out_price, None, import_stock
+                        material = Material(
+                            name=name,
+                            in_price=in_price,
+                            out_price=out_price,
+                            stock_count=import_stock
                         )
-                        if result.get('success'):
-                            created_count += 1
-                        else:
-                            failed_count += 1
-                            
-                except Exception as e:
-                    self.logger.error(f'第{row_num}行导入失败: {str(e)}', exc_info=True)
-                    failed_count += 1
+                        session.add(material)
+                        session.flush()
+                        if import_stock:
+                            self.add_history(session, material, 'import', import_stock, 0)
+                        existing_map[name] = material
+                        created_count += 1
+                
+                bom_engine.refresh_possible_quantities(session, material_ids=list(stock_changed_ids))
             
             msg = f'导入完成，成功 {created_count + updated_count} 个，失败 {failed_count} 个'
             return {
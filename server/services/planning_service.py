@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: planning_service.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import logging
+import time
+import numpy as np
+from config import Config
+from dbs.db_manager import DBManager
+from dbs.models import Material, Product
+from services.bom_engine import bom_engine
+
+
+class PlanningService:
+    """生产计划服务 - 物料需求计划（MRP）与生产组合优化"""
+    
+    def __init__(self):
+        self.db = DBManager()
+        self.logger = logging.getLogger(__name__)
+    
+    def _parse_items(self, items: list) -> dict:
+        """解析生产计划，合并同一产品的数量，返回 {产品ID: 数量}"""
+        plan = {}
+        for item in items:
+            product_id = int(item['product_id'])
+            quantity = int(item['quantity'])
+            if quantity < 0:
+                raise ValueError(f'产品 {product_id} 计划数量不能为负数')
+            plan[product_id] = plan.get(product_id, 0) + quantity
+        return plan
+    
+    def _parse_mapping(self, mapping: dict, cast) -> dict:
+        """解析 {产品ID: 值} 映射（JSON中的键为字符串），值不能为负数"""
+        parsed = {}
+        for key, value in (mapping or {}).items():
+            value = cast(value)
+            if value < 0:
+                raise ValueError(f'产品 {key} 参数不能为负数')
+            parsed[int(key)] = value
+        return parsed
+    
+    def get_requirements(self, items: list) -> dict:
+        """
+        计算生产计划的材料需求：需求向量 = 配方矩阵ᵀ × 计划数量向量，与当前库存比较
+        
+        Args:
+            items: [{'product_id': 产品ID, 'quantity': 计划生产数量}]
+        Returns:
+            每种材料的需求量、库存、缺口、覆盖率及因该材料缺货而受阻的产品
+        """
+        try:
+            plan = self._parse_items(items)
+        except (ValueError, TypeError, KeyError):
+            return {'success': False, 'message': '生产计划参数无效'}
+        
+        try:
+            with self.db.session_scope() as session:
+                product_names = dict(session.query(Product.id, Product.name).filter(Product.id.in_(list(plan))))
+                missing = set(plan) - set(product_names)
+                if missing:
+                    return {'success': False, 'message': f'产品ID {", ".join(str(pid) for pid in sorted(missing))} 不存在'}
+                
+                product_ids = sorted(plan)
+                row_ids, indptr, material_ids, quantities = bom_engine.select_rows(bom_engine.get_matrix(), product_ids)
+                lengths = np.diff(indptr)
+                planned = np.array([plan[pid] for pid in row_ids.tolist()], dtype=np.float64)
+                
+                # 每条配方行的需求量 = 计划数量 × 单位需求量，再按材料聚合
+                line_products = np.repeat(row_ids, lengths)
+                line_required = np.repeat(planned, lengths) * np.maximum(quantities, 0)
+                unique_ids, inverse = np.unique(material_ids, return_inverse=True)
+                required = np.bincount(inverse, weights=line_required, minlength=len(unique_ids))
+                
+                stock_ids, stocks = bom_engine.load_material_vector(session, Material.stock_count, unique_ids.tolist())
+                stock, found = bom_engine.gather(unique_ids, stock_ids, stocks)
+                shortage = np.maximum(required - stock, 0)
+                coverage = np.where(required > 0, np.minimum(stock / np.where(required > 0, required, 1), 1), 1)
+                
+                # 受阻产品：配方行所用材料有缺口且该行有实际需求
+                blocked_lines = (shortage[inverse] > 0) & (line_required > 0)
+                blocking, blocked_by = {}, {}
+                for material_idx, product_id in zip(inverse[blocked_lines].tolist(), line_products[blocked_lines].tolist()):
+                    blocking.setdefault(material_idx, []).append(product_id)
+                    blocked_by.setdefault(product_id, []).append(int(unique_ids[material_idx]))
+                
+                material_names = dict(session.query(Material.id, Material.name).filter(Material.id.in_(unique_ids.tolist())))
+                materials = [{
+                    'material_id': int(mid),
+                    'name': material_names.get(int(mid), str(int(mid))),
+                    'exists': bool(found[i]),
+                    'required': int(required[i]),
+                    'stock_count': int(stock[i]),
+                    'shortage': int(shortage[i]),
+                    'coverage': round(float(coverage[i]), 4),
+                    'blocking_products': blocking.get(i, [])
+                } for i, mid in enumerate(unique_ids.tolist())]
+                
+                products = [{
+                    'product_id': pid,
+                    'name': product_names[pid],
+                    'quantity': plan[pid],
+                    'has_bom': bool(lengths[i] > 0),
+                    'blocked_by': blocked_by.get(pid, [])
+                } for i, pid in enumerate(row_ids.tolist())]
+                
+                shortages = sorted((m for m in materials if m['shortage'] > 0), key=lambda m: (-m['shortage'], m['material_id']))
+                total_required = float(required.sum())
+                
+                return {
+                    'success': True,
+                    'feasible': not shortages,
+                    'materials': materials,
+                    'shortages': shortages,
+                    'products': products,
+                    'summary': {
+                        'product_count': len(products),
+                        'material_count': len(materials),
+                        'shortage_count': len(shortages),
+                        'blocked_product_count': len(blocked_by),
+                        'total_required': int(total_required),
+                        'total_shortage': int(shortage.sum()),
+                        'coverage': round(float(np.minimum(stock, required).sum() / total_required), 4) if total_required else 1.0
+                    }
+                }
+        except Exception as e:
+            self.logger.error(f'物料需求计算异常: {str(e)}', exc_info=True)
+            return {'success': False, 'message': '计算失败'}
+    
+    def optimize_mix(self, product_ids: list = None, weights: dict = None,
+                     max_quantities: dict = None, time_budget_ms: int = None) -> dict:
+        """
+        在当前库存约束下计算总收益最大的生产组合（多维背包问题），使用贪心启发式：
+        每轮按 单位收益 / Σ(需求量/剩余库存) 选出最优产品，分配其可制作数量的一半，
+        库存越紧张的材料权重越高；超出时间预算后按单位收益顺序补满剩余库存
+        
+        Args:
+            product_ids: 参与优化的产品ID列表，None表示全部产品
+            weights: {产品ID: 单位权重}，指定时代替毛利（售价 - 成本价）作为目标，未指定权重的产品不参与
+            max_quantities: {产品ID: 最大生产数量}，不指定则只受库存约束
+            time_budget_ms: 时间预算（毫秒）
+        Returns:
+            生产组合、总收益、材料消耗及剩余库存
+        """
+        try:
+            requested = None if product_ids is None else sorted({int(pid) for pid in product_ids})
+            weight_map = self._parse_mapping(weights, float)
+            limit_map = self._parse_mapping(max_quantities, int)
+            budget = Config.OPTIMIZE_TIME_BUDGET_MS if time_budget_ms is None else int(time_budget_ms)
+        except (ValueError, TypeError, AttributeError):
+            return {'success': False, 'message': '优化参数无效'}
+        budget = min(max(budget, 1), Config.MAX_OPTIMIZE_TIME_BUDGET_MS)
+        
+        try:
+            with self.db.session_scope() as session:
+                started = time.perf_counter()
+                deadline = started + budget / 1000
+                
+                query = session.query(Product.id, Product.name, Product.in_price, Product.out_price)
+                if requested is not None:
+                    query = query.filter(Product.id.in_(requested))
+                products = {p.id: p for p in query}
+                missing = set(requested or ()) - set(products)
+                if missing:
+                    return {'success': False, 'message': f'产品ID {", ".join(str(pid) for pid in sorted(missing))} 不存在'}
+                
+                margins = {pid: (p.out_price or 0) - (p.in_price or 0) for pid, p in products.items()}
+                values = {pid: weight_map.get(pid, 0) for pid in products} if weight_map else margins
+                candidates = sorted(pid for pid, value in values.items() if value > 0)
+                
+                # 只保留需求量>0的配方行；无约束且无数量上限的产品收益无界，不参与优化
+                row_ids, indptr, material_ids, quantities = bom_engine.select_rows(bom_engine.get_matrix(), candidates)
+                line_rows = np.repeat(np.arange(len(row_ids)), np.diff(indptr))
+                positive = quantities > 0
+                line_rows, material_ids = line_rows[positive], material_ids[positive]
+                quantities = quantities[positive].astype(np.int64)
+                constrained = np.bincount(line_rows, minlength=len(row_ids)) > 0
+                
+                quantity_map = {}
+                unbounded = []
+                for i, pid in enumerate(row_ids.tolist()):
+                    if not constrained[i]:
+                        if pid in limit_map:
+                            quantity_map[pid] = limit_map[pid]
+                        else:
+                            unbounded.append(pid)
+                
+                # 压缩为连续下标：行 -> 约束产品，列 -> 涉及的材料
+                kept = np.flatnonzero(constrained)
+                line_rows = np.searchsorted(kept, line_rows)
+                unique_ids, line_materials = np.unique(material_ids, return_inverse=True)
+                stock_ids, stocks = bom_engine.load_material_vector(session, Material.stock_count, unique_ids.tolist())
+                stock, _ = bom_engine.gather(unique_ids, stock_ids, stocks)
+                
+                kept_ids = row_ids[kept].tolist()
+                value = np.array([values[pid] for pid in kept_ids], dtype=np.float64)
+                limit = np.array([limit_map.get(pid, np.inf) for pid in kept_ids], dtype=np.float64)
+                starts = np.searchsorted(line_rows, np.arange(len(kept_ids)))
+                ends = np.append(starts[1:], len(line_rows))
+                
+                # 整数运算：浮点数整除远慢于整数整除
+                stock = np.maximum(stock, 0).astype(np.int64)
+                remaining = stock.copy()
+                produced = np.zeros(len(kept_ids))
+                iterations, timed_out = 0, False
+                while len(kept_ids):
+                    if time.perf_counter() > deadline:
+                        timed_out = True
+                        break
+                    line_stock = remaining[line_materials]
+                    capacity = np.minimum(np.minimum.reduceat(line_stock // quantities, starts), limit - produced)
+                    active = capacity >= 1
+                    if not active.any():
+                        break
+                    pressure = np.add.reduceat(quantities / np.maximum(line_stock, 1), starts)
+                    best = int(np.argmax(np.where(active, value / pressure, -np.inf)))
+                    
+                    step = max(1, int(capacity[best]) // 2)
+                    produced[best] += step
+                    np.subtract.at(remaining, line_materials[starts[best]:ends[best]], step * quantities[starts[best]:ends[best]])
+                    iterations += 1
+                
+                if timed_out:
+                    for best in np.argsort(-value, kind='stable').tolist():
+                        lines = slice(starts[best], ends[best])
+                        step = int(min(np.min(remaining[line_materials[lines]] // quantities[lines]), limit[best] - produced[best]))
+                        if step >= 1:
+                            produced[best] += step
+                            np.subtract.at(remaining, line_materials[lines], step * quantities[lines])
+                
+                quantity_map.update((pid, int(q)) for pid, q in zip(kept_ids, produced.tolist()) if q > 0)
+                mix = sorted(({
+                    'product_id': pid,
+                    'name': products[pid].name,
+                    'quantity': qty,
+                    'unit_value': round(values[pid], 2),
+                    'unit_margin': round(margins[pid], 2),
+                    'total_value': round(values[pid] * qty, 2),
+                    'total_margin': round(margins[pid] * qty, 2)
+                } for pid, qty in quantity_map.items() if qty > 0), key=lambda m: (-m['total_value'], m['product_id']))
+                
+                used = stock - remaining
+                used_idx = np.flatnonzero(used > 0)
+                material_names = dict(session.query(Material.id, Material.name).filter(
+                    Material.id.in_(unique_ids[used_idx].tolist())
+                )) if len(used_idx) else {}
+                materials = [{
+                    'material_id': int(unique_ids[i]),
+                    'name': material_names.get(int(unique_ids[i]), str(int(unique_ids[i]))),
+                    'stock_count': int(stock[i]),
+                    'used': int(used[i]),
+                    'remaining': int(remaining[i]),
+                    'utilization': round(float(used[i] / stock[i]), 4)
+                } for i in used_idx.tolist()]
+                
+                return {
+                    'success': True,
+                    'objective': 'weight' if weight_map else 'margin',
+                    'mix': mix,
+                    'materials': materials,
+                    'unbounded_products': unbounded,
+                    'summary': {
+                        'total_value': round(sum(m['total_value'] for m in mix), 2),
+                        'total_margin': round(sum(m['total_margin'] for m in mix), 2),
+                        'total_quantity': sum(m['quantity'] for m in mix),
+                        'product_count': len(mix),
+                        'candidate_count': len(candidates),
+                        'iterations': iterations,
+                        'timed_out': timed_out,
+                        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+                    }
+                }
+        except Exception as e:
+            self.logger.error(f'生产组合优化异常: {str(e)}', exc_info=True)
+            return {'success': False, 'message': '优化失败'}
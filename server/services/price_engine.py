@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: price_engine.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import logging
+import numpy as np
+from dbs.models import Material, Product
+from services.bom_engine import bom_engine
+
+
+class PriceEngine:
+    """
+    价格传导引擎 - 材料进价或配方变化后重算受影响产品的成本价和售价
+    
+    通过反向索引只定位直接或通过半成品间接使用了变价材料的产品，
+    同一事务内多个材料的价格变化合并为一次重算，成本价 = 展开配方矩阵行 · 材料进价向量。
+    """
+    
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+    
+    def apply_overrides(self, price_ids, prices, overrides: dict):
+        """用 {材料ID: 价格} 覆盖价格向量，返回新向量；只覆盖存在的材料，不存在的材料仍按0计"""
+        result = prices.copy()
+        override_ids = np.array([int(mid) for mid in overrides], dtype=np.int64)
+        override_prices = np.array([float(price) for price in overrides.values()])
+        _, known = bom_engine.gather(override_ids, price_ids, prices)
+        result[np.searchsorted(price_ids, override_ids[known])] = override_prices[known]
+        return result
+    
+    def compute_costs(self, session, matrix, price_overrides: dict = None) -> dict:
+        """
+        计算产品成本价 Σ 需求量×材料进价
+        
+        Args:
+            matrix: 配方矩阵（bom_engine.select_rows 或 bom_engine.preview 的结果）
+            price_overrides: {材料ID: 进价}，用于覆盖数据库中的进价（价格预览）
+        Returns:
+            {产品ID: 成本价}
+        """
+        used_ids = np.unique(matrix[2])
+        price_ids, prices = bom_engine.load_material_vector(session, Material.in_price, used_ids.tolist())
+        
+        if price_overrides:
+            prices = self.apply_overrides(price_ids, prices, price_overrides)
+        
+        costs = bom_engine.row_sums(matrix, price_ids, prices)
+        return dict(zip(matrix[0].tolist(), costs.tolist()))
+    
+    def reprice_products(self, session, material_ids=None, overrides: dict = None, skip=()) -> list:
+        """
+        合并重算受影响产品的价格（成本价 = 配方成本，售价 = 成本价 + 其他费用）
+        
+        Args:
+            material_ids: 进价发生变化的材料
+            overrides: 事务内修改的配方 {产品ID: (材料字典, 组件字典)}，重算这些产品及其上级产品
+            skip: 不需要重算的产品ID（如价格已由调用方设置）
+        Returns:
+            价格发生变化的产品列表
+        """
+        session.flush()
+        if overrides:
+            matrix = bom_engine.preview(overrides)
+        else:
+            product_ids = bom_engine.get_users(session, material_ids)
+            if not product_ids:
+                return []
+            matrix = bom_engine.select_rows(bom_engine.get_matrix(), product_ids)
+        
+        costs = self.compute_costs(session, matrix)
+        product_ids = [pid for pid in costs if pid not in skip]
+        if not product_ids:
+            return []
+        
+        changed = []
+        for product in session.query(Product).filter(Product.id.in_(product_ids)).order_by(Product.id):
+            new_in_price = costs.get(product.id, 0)
+            if abs((product.in_price or 0) - new_in_price) < 1e-9:
+                continue
+            
+            old_in_price = product.in_price or 0
+            product.in_price = new_in_price
+            product.out_price = new_in_price + (product.other_price or 0)
+            product.version = (product.version or 1) + 1
+            changed.append({
+                'id': product.id,
+                'name': product.name,
+                'old_in_price': round(old_in_price, 2),
+                'in_price': round(new_in_price, 2),
+                'out_price': round(product.out_price, 2)
+            })
+        
+        self.logger.info(f'价格传导: 影响{len(product_ids)}个产品, 价格变化{len(changed)}个')
+        return changed
+
+
+# 进程内共享的价格传导引擎
+price_engine = PriceEngine()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: pricing_service.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import logging
+import numpy as np
+from dbs.db_manager import DBManager
+from dbs.models import Material, Product
+from services.bom_engine import bom_engine
+from services.price_engine import price_engine
+from config import Config
+
+
+class PricingService:
+    """定价服务 - 批量材料调价影响预览"""
+    
+    SORT_FIELDS = ('margin_delta', 'cost_delta', 'selling_delta', 'id')
+    # 售价口径：Σ 需求量×材料售价 + 其他费用
+    SELLING_BASIS = 'material_out_price'
+    
+    def __init__(self):
+        self.db = DBManager()
+        self.logger = logging.getLogger(__name__)
+    
+    def _parse_changes(self, changes: list) -> tuple:
+        """解析价格变更列表，返回 ({材料ID: 进价}, {材料ID: 售价})"""
+        in_overrides, out_overrides = {}, {}
+        for change in changes:
+            material_id = int(change['material_id'])
+            if change.get('in_price') is not None:
+                in_overrides[material_id] = float(change['in_price'])
+            if change.get('out_price') is not None:
+                out_overrides[material_id] = float(change['out_price'])
+        return in_overrides, out_overrides
+    
+    def what_if(self, changes: list, page: int = 1, page_size: int = None, sort_by: str = 'margin_delta', order: str = 'asc') -> dict:
+        """
+        预览批量材料调价对产品成本价、售价和利润的影响
+        
+        成本价 = Σ 需求量×材料进价，售价 = Σ 需求量×材料售价 + 其他费用，利润 = 售价 - 成本价；
+        当前值和调价后的值各做一次配方矩阵与价格向量的点积。
+        售价按材料清单售价口径计算（与材料调价预览一致），不是价格传导写入的售价（成本价 + 其他费用），
+        响应中的 selling_basis 标明该口径。
+        
+        Args:
+            changes: [{'material_id': 材料ID, 'in_price': 新进价, 'out_price': 新售价}]
+            page: 页码，从1开始
+            page_size: 每页数量
+            sort_by: 排序字段 (margin_delta/cost_delta/selling_delta/id)
+            order: 排序方向 (asc/desc)
+        """
+        try:
+            in_overrides, out_overrides = self._parse_changes(changes)
+            page = max(int(page or 1), 1)
+            page_size = min(max(int(page_size or Config.DEFAULT_PAGE_SIZE), 1), Config.MAX_PAGE_SIZE)
+        except (ValueError, TypeError, KeyError):
+            return {'success': False, 'message': '价格参数无效'}
+        
+        if sort_by not in self.SORT_FIELDS:
+            sort_by = 'margin_delta'
+        
+        try:
+            with self.db.session_scope() as session:
+                material_ids = set(in_overrides) | set(out_overrides)
+                existing = {mid for mid, in session.query(Material.id).filter(Material.id.in_(list(material_ids)))}
+                missing = material_ids - existing
+                if missing:
+                    return {'success': False, 'message': f'材料ID {", ".join(str(mid) for mid in sorted(missing))} 不存在'}
+                
+                product_ids = bom_engine.get_users(session, material_ids)
+                if not product_ids:
+                    return {'success': True, 'total': 0, 'page': page, 'page_size': page_size, 'selling_basis': self.SELLING_BASIS, 'products': [], 'summary': {}}
+                
+                matrix = bom_engine.select_rows(bom_engine.get_matrix(), product_ids)
+                used_ids = np.unique(matrix[2]).tolist()
+                price_ids, in_prices = bom_engine.load_material_vector(session, Material.in_price, used_ids)
+                _, out_prices = bom_engine.load_material_vector(session, Material.out_price, used_ids)
+                
+                products = {p.id: p for p in session.query(
+                    Product.id, Product.name, Product.image_path, Product.other_price
+                ).filter(Product.id.in_(product_ids))}
+                row_ids = matrix[0]
+                other = np.array([(products[pid].other_price or 0) if pid in products else 0 for pid in row_ids.tolist()])
+                
+                current_cost = bom_engine.row_sums(matrix, price_ids, in_prices)
+                new_cost = bom_engine.row_sums(matrix, price_ids, price_engine.apply_overrides(price_ids, in_prices, in_overrides)) if in_overrides else current_cost
+                current_selling = bom_engine.row_sums(matrix, price_ids, out_prices) + other
+                new_selling = (bom_engine.row_sums(matrix, price_ids, price_engine.apply_overrides(price_ids, out_prices, out_overrides)) + other) if out_overrides else current_selling
+                
+                deltas = {
+                    'cost_delta': new_cost - current_cost,
+                    'selling_delta': new_selling - current_selling,
+                    'margin_delta': (new_selling - new_cost) - (current_selling - current_cost),
+                    'id': row_ids
+                }
+                key = deltas[sort_by]
+                ordering = np.lexsort((row_ids, -key if order == 'desc' else key))
+                page_idx = ordering[(page - 1) * page_size:page * page_size]
+                
+                page_products = []
+                for i in page_idx.tolist():
+                    pid = int(row_ids[i])
+                    product = products.get(pid)
+                    page_products.append({
+                        'id': pid,
+                        'name': product.name if product else str(pid),
+                        'image_path': product.image_path if product else None,
+                        'current_cost': round(float(current_cost[i]), 2),
+                        'new_cost': round(float(new_cost[i]), 2),
+                        'current_selling': round(float(current_selling[i]), 2),
+                        'new_selling': round(float(new_selling[i]), 2),
+                        'current_margin': round(float(current_selling[i] - current_cost[i]), 2),
+                        'new_margin': round(float(new_selling[i] - new_cost[i]), 2),
+                        'cost_delta': round(float(deltas['cost_delta'][i]), 2),
+                        'selling_delta': round(float(deltas['selling_delta'][i]), 2),
+                        'margin_delta': round(float(deltas['margin_delta'][i]), 2)
+                    })
+                
+                return {
+                    'success': True,
+                    'total': len(row_ids),
+                    'page': page,
+                    'page_size': page_size,
+                    'selling_basis': self.SELLING_BASIS,
+                    'products': page_products,
+                    'summary': {
+                        'affected_count': len(row_ids),
+                        'cost_delta': round(float(deltas['cost_delta'].sum()), 2),
+                        'selling_delta': round(float(deltas['selling_delta'].sum()), 2),
+                        'margin_delta': round(float(deltas['margin_delta'].sum()), 2),
+                        'margin_decreased_count': int((deltas['margin_delta'] < -1e-9).sum())
+                    }
+                }
+        except Exception as e:
+            self.logger.error(f'调价影响预览异常: {str(e)}', exc_info=True)
+            return {'success': False, 'message': '预览失败'}
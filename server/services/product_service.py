@@ -11,7 +11,6 @@
 """
 
 import os
-import json
 import logging
 import openpyxl
 from io import BytesIO
@@ -19,110 +18,233 @@ from flask import send_file, jsonify
 from datetime import datetime
 from PIL import Image
 from openpyxl.drawing.image import Image as XLImage
+from sqlalchemy import func
 from dbs.db_manager import DBManager
-from dbs.models import Product, Material, ProductHistory
+from dbs.models import Product, Material, ProductHistory, ProductMaterial, ProductComponent
 from services.material_service import MaterialService
-from utils.timezone_utils import format_china_time
+from services.bom_engine import bom_engine
+from services.price_engine import price_engine
+from utils.timezone_utils import format_db_time
+from utils.query_utils import apply_search, apply_range, apply_level_filter, apply_sort, project_fields, fetch_rows, compile_serializer, build_columnar, iter_batches
 from config import Config
 
 
 class ProductService:
     """产品服务 - 负责产品配方管理和生产操作"""
     
+    # 排序键 -> 排序列（margin 为表达式，其余均为索引列）
+    SORT_COLUMNS = {
+        'name': Product.name,
+        'price': Product.out_price,
+        'stock': Product.stock_count,
+        'updated_at': Product.updated_at,
+        'margin': Product.out_price - Product.in_price,
+        'possible_quantity': Product.possible_quantity
+    }
+    
+    # 稀疏字段 -> (依赖的列, 取值函数(产品行, 配方材料, 配方组件))，materials/components 只在请求时加载
+    FIELDS = {
+        'id': ((Product.id,), lambda p, materials, components: p.id),
+        'name': ((Product.name,), lambda p, materials, components: p.name),
+        'materials': ((), lambda p, materials, components: materials),
+        'components': ((), lambda p, materials, components: components),
+        'in_price': ((Product.in_price,), lambda p, materials, components: p.in_price),
+        'out_price': ((Product.out_price,), lambda p, materials, components: p.out_price),
+        'other_price': ((Product.other_price,), lambda p, materials, components: p.other_price or 0),
+        'image_path': ((Product.image_path,), lambda p, materials, components: p.image_path),
+        'stock_count': ((Product.stock_count,), lambda p, materials, components: p.stock_count or 0),
+        'possible_quantity': ((Product.possible_quantity,), lambda p, materials, components: p.possible_quantity or 0),
+        'version': ((Product.version,), lambda p, materials, components: p.version),
+        'created_at': ((Product.created_at,), lambda p, materials, components: format_db_time(p.created_at)),
+        'updated_at': ((Product.updated_at,), lambda p, materials, components: format_db_time(p.updated_at))
+    }
+    
     def __init__(self):
         self.db = DBManager()
         self.material_service = MaterialService()
         self.logger = logging.getLogger(__name__)
     
-    def _parse_used_list(self, used_by_products_str: str) -> list:
-        """解析used_by_products JSON字符串"""
-        try:
-            return json.loads(used_by_products_str or '[]')
-        except (json.JSONDecodeError, TypeError):
-            return []
-    
-    def _serialize_used_list(self, used_list: list) -> str:
-        """序列化used_by_products列表"""
-        return json.dumps(used_list)
-    
     def _validate_materials(self, session, materials: dict) -> tuple:
-        """验证材料是否存在，返回(是否有效, 错误信息, 材料对象字典)"""
+        """验证材料是否存在（一次IN查询），返回(是否有效, 错误信息, 材料对象字典)"""
         if not materials:
             return True, '', {}
         
-        material_objs = {}
+        material_ids = {}
         for material_id_str in materials.keys():
             try:
-                material_id = int(material_id_str)
-                material = session.query(Material).filter(Material.id == material_id).first()
-                if not material:
-                    return False, f'材料ID {material_id} 不存在', {}
-                material_objs[material_id_str] = material
+                material_ids[material_id_str] = int(material_id_str)
             except (ValueError, TypeError):
                 return False, f'无效的材料ID: {material_id_str}', {}
         
-        return True, '', material_objs
+        found = {m.id: m for m in session.query(Material).filter(Material.id.in_(set(material_ids.values())))}
+        missing = sorted(set(material_ids.values()) - set(found))
+        if missing:
+            return False, f'材料ID {", ".join(str(mid) for mid in missing)} 不存在', {}
+        
+        return True, '', {key: found[mid] for key, mid in material_ids.items()}
     
-    def _update_material_references(self, session, product_id: int, old_materials: dict, new_materials: dict):
-        """批量更新材料引用"""
-        try:
-            old_ids = set(old_materials.keys())
-            new_ids = set(new_materials.keys())
-            
-            for material_id_str in old_ids - new_ids:
-                material = session.query(Material).filter(Material.id == int(material_id_str)).first()
-                if material:
-                    used_list = self._parse_used_list(material.used_by_products)
-                    if product_id in used_list:
-                        used_list.remove(product_id)
-                        material.used_by_products = self._serialize_used_list(used_list)
-            
-            for material_id_str in new_ids - old_ids:
-                material = session.query(Material).filter(Material.id == int(material_id_str)).first()
-                if material:
-                    used_list = self._parse_used_list(material.used_by_products)
-                    if product_id not in used_list:
-                        used_list.append(product_id)
-                        material.used_by_products = self._serialize_used_list(used_list)
-            
-            return True
-        except Exception as e:
-            self.logger.error(f'更新材料引用失败: {str(e)}', exc_info=True)
-            return False
+    def _validate_components(self, session, boms: dict) -> tuple:
+        """
+        验证组件产品是否存在且不会形成循环引用（一次IN查询），返回(是否有效, 错误信息)
+        
+        Args:
+            boms: {产品ID: (材料字典, 组件字典)}，新建产品的ID为None
+        """
+        component_ids = set()
+        for product_id, (_, components) in boms.items():
+            try:
+                ids = {int(cid) for cid in (components or {})}
+            except (ValueError, TypeError):
+                return False, '无效的组件产品ID'
+            if product_id in ids:
+                return False, '产品不能使用自身作为组件'
+            component_ids |= ids
+        if not component_ids:
+            return True, ''
+        
+        existing = {pid for pid, in session.query(Product.id).filter(Product.id.in_(list(component_ids)))}
+        missing = component_ids - existing
+        if missing:
+            return False, f'组件产品ID {", ".join(str(cid) for cid in sorted(missing))} 不存在'
+        
+        overrides = {pid: bom for pid, bom in boms.items() if pid is not None}
+        cycle_at = bom_engine.find_cycle(self._normalize_boms(overrides)) if overrides else None
+        if cycle_at is not None:
+            return False, f'配方存在循环引用（产品ID {cycle_at}）'
+        return True, ''
+    
+    def _normalize_boms(self, boms: dict) -> dict:
+        """配方字典的键统一转换为整数ID"""
+        return {pid: ({int(mid): qty for mid, qty in (materials or {}).items()},
+                      {int(cid): qty for cid, qty in (components or {}).items()})
+                for pid, (materials, components) in boms.items()}
+    
+    def _set_product_boms(self, session, boms: dict):
+        """批量替换产品在 product_material、product_component 表中的配方明细：一次IN删除 + 批量插入"""
+        if not boms:
+            return
+        product_ids = list(boms)
+        session.query(ProductMaterial).filter(ProductMaterial.product_id.in_(product_ids)).delete(synchronize_session=False)
+        session.query(ProductComponent).filter(ProductComponent.product_id.in_(product_ids)).delete(synchronize_session=False)
+        
+        normalized = self._normalize_boms(boms)
+        session.bulk_insert_mappings(ProductMaterial, [
+            {'product_id': pid, 'material_id': mid, 'quantity': qty}
+            for pid, (materials, _) in normalized.items() for mid, qty in materials.items()
+        ])
+        session.bulk_insert_mappings(ProductComponent, [
+            {'product_id': pid, 'component_id': cid, 'quantity': qty}
+            for pid, (_, components) in normalized.items() for cid, qty in components.items()
+        ])
+    
+    def _apply_boms(self, session, boms: dict) -> dict:
+        """
+        写入配方并刷新这些产品及上级产品的可制作数量、上级产品价格
+        
+        Args:
+            boms: {产品ID: (材料字典, 组件字典)}
+        Returns:
+            {产品ID: 按展开配方计算的成本价}
+        """
+        overrides = self._normalize_boms(boms)
+        self._set_product_boms(session, boms)
+        bom_engine.refresh_possible_quantities(session, overrides=overrides)
+        price_engine.reprice_products(session, overrides=overrides, skip=set(overrides))
+        costs = price_engine.compute_costs(session, bom_engine.preview(overrides))
+        return {pid: costs.get(pid, 0) for pid in overrides}
+    
+    def _get_direct_boms(self, session, product_ids: list) -> dict:
+        """读取产品当前的直接配方，返回 {产品ID: ({材料ID: 数量}, {组件产品ID: 数量})}"""
+        boms = {pid: ({}, {}) for pid in product_ids}
+        for product_id, material_id, quantity in session.query(
+            ProductMaterial.product_id, ProductMaterial.material_id, ProductMaterial.quantity
+        ).filter(ProductMaterial.product_id.in_(product_ids)):
+            boms[product_id][0][material_id] = quantity
+        for product_id, component_id, quantity in session.query(
+            ProductComponent.product_id, ProductComponent.component_id, ProductComponent.quantity
+        ).filter(ProductComponent.product_id.in_(product_ids)):
+            boms[product_id][1][component_id] = quantity
+        return boms
     
-    def add_product(self, name: str, materials: dict, in_price: float = 0, out_price: float = 0, other_price: float = 0, image_path: str = None) -> dict:
-        """添加产品"""
+    def _get_parent_names(self, session, product_ids: list) -> dict:
+        """获取使用这些产品作为组件的上级产品，返回 {产品ID: [上级产品名称]}"""
+        rows = session.query(ProductComponent.component_id, Product.name).join(
+            Product, Product.id == ProductComponent.product_id
+        ).filter(ProductComponent.component_id.in_(product_ids))
+        parents = {}
+        for component_id, name in rows:
+            parents.setdefault(component_id, []).append(name)
+        return parents
+    
+    def _load_product_materials(self, session, product_ids: list = None) -> dict:
+        """加载产品配方明细（关联材料），返回 {产品ID: [(材料ID, 数量, 材料名称或None, 材料库存或None)]}"""
+        query = session.query(
+            ProductMaterial.product_id, ProductMaterial.material_id, ProductMaterial.quantity,
+            Material.name, Material.stock_count
+        ).outerjoin(Material, Material.id == ProductMaterial.material_id)
+        if product_ids is not None:
+            query = query.filter(ProductMaterial.product_id.in_(product_ids))
+        
+        boms = {}
+        for product_id, *item in fetch_rows(session, query.order_by(ProductMaterial.product_id, ProductMaterial.material_id)):
+            boms.setdefault(product_id, []).append(item)
+        return boms
+    
+    def _load_product_components(self, session, product_ids: list = None) -> dict:
+        """加载产品组件明细（关联组件产品），返回 {产品ID: [(组件产品ID, 数量, 组件名称或None, 组件库存或None)]}"""
+        query = session.query(
+            ProductComponent.product_id, ProductComponent.component_id, ProductComponent.quantity,
+            Product.name, Product.stock_count
+        ).outerjoin(Product, Product.id == ProductComponent.component_id)
+        if product_ids is not None:
+            query = query.filter(ProductComponent.product_id.in_(product_ids))
+        
+        components = {}
+        for product_id, *item in fetch_rows(session, query.order_by(ProductComponent.product_id, ProductComponent.component_id)):
+            components.setdefault(product_id, []).append(item)
+        return components
+    
+    def _add_history(self, session, product, operation_type: str, quantity: int, stock_before: int, final_price: float = 0):
+        """记录产品库存变动历史"""
+        session.add(ProductHistory(
+            product_id=product.id,
+            product_name=product.name,
+            operation_type=operation_type,
+            quantity=quantity,
+            in_price=product.in_price,
+            out_price=product.out_price,
+            other_price=product.other_price,
+            final_price=final_price,
+            stock_before=stock_before,
+            stock_after=stock_before + quantity
+        ))
+    
+    def add_product(self, name: str, materials: dict, in_price: float = 0, out_price: float = 0, other_price: float = 0, image_path: str = None, components: dict = None) -> dict:
+        """添加产品，components为使用的组件产品（半成品）"""
         try:
             with self.db.session_scope() as session:
-                valid, error_msg, material_objs = self._validate_materials(session, materials)
+                valid, error_msg, _ = self._validate_materials(session, materials)
+                if not valid:
+                    return {'success': False, 'message': error_msg}
+                valid, error_msg = self._validate_components(session, {None: (materials, components)})
                 if not valid:
                     return {'success': False, 'message': error_msg}
-                
-                if materials:
-                    calculated_in_price = sum((material_objs.get(mid).in_price or 0) * qty for mid, qty in materials.items())
-                    final_in_price = calculated_in_price
-                    final_out_price = final_in_price + (other_price or 0)
-                else:
-                    final_in_price = in_price
-                    final_out_price = out_price or final_in_price + (other_price or 0)
                 
                 product = Product(
                     name=name,
-                    materials=json.dumps(materials),
-                    in_price=final_in_price,
-                    out_price=final_out_price,
+                    in_price=in_price,
+                    out_price=out_price or in_price + (other_price or 0),
                     other_price=other_price or 0,
                     image_path=image_path
                 )
                 
                 session.add(product)
                 session.flush()
+                cost = self._apply_boms(session, {product.id: (materials, components)})[product.id]
                 
-                for material_id_str, material in material_objs.items():
-                    used_list = self._parse_used_list(material.used_by_products)
-                    if product.id not in used_list:
-                        used_list.append(product.id)
-                        material.used_by_products = self._serialize_used_list(used_list)
+                if materials or components:
+                    product.in_price = cost
+                    product.out_price = cost + (other_price or 0)
                 
                 self.logger.info(f'产品添加成功: {product.id} - {name}')
                 return {'success': True, 'product_id': product.id}
@@ -130,85 +252,124 @@ class ProductService:
             self.logger.error(f'产品添加异常: {name} - {str(e)}', exc_info=True)
             return {'success': False, 'message': '添加失败'}
     
-    def _process_products(self, products):
-        """处理配方数据，计算可制作数量"""
-        materials_result = self.material_service.get_all_materials()
-        materials = {str(m['id']): m for m in materials_result.get('materials', [])}
+    def _format_bom_items(self, items: list) -> list:
+        """格式化配方明细 [(ID, 需求量, 材料或组件名称, 库存)]，名称为None表示材料或组件已不存在"""
+        return [{
+            'product_id': str(item_id),
+            'name': str(item_id) if name is None else name,
+            'required': required_qty,
+            'stock_count': stock_count or 0
+        } for item_id, required_qty, name, stock_count in items]
+    
+    def _process_products(self, session, products, all_products: bool = False, fields: list = None, columnar: bool = False):
+        """
+        处理配方数据，可制作数量读取增量维护的 possible_quantity 列
+        fields 指定时只加载和输出这些字段；columnar 为 True 时返回 {columns, rows}
+        """
+        product_ids = None if all_products else [p.id for p in products]
+        boms = self._load_product_materials(session, product_ids) if fields is None or 'materials' in fields else {}
+        components = self._load_product_components(session, product_ids) if fields is None or 'components' in fields else {}
         
-        result = []
-        for product in products:
-            try:
-                product_materials = json.loads(product.materials)
-            except:
-                product_materials = {}
-            
-            possible_quantity = float('inf')
-            materials_with_stock = []
-            
-            for material_id, required_qty in product_materials.items():
-                material = materials.get(material_id)
-                if material:
-                    stock_count = material['stock_count']
-                    materials_with_stock.append({
-                        'product_id': material_id,
-                        'name': material['name'],
-                        'required': required_qty,
-                        'stock_count': stock_count
-                    })
-                    if required_qty > 0:
-                        possible_quantity = min(possible_quantity, stock_count // required_qty)
-                else:
-                    materials_with_stock.append({
-                        'product_id': material_id,
-                        'name': material_id,
-                        'required': required_qty,
-                        'stock_count': 0
-                    })
-                    possible_quantity = 0
-            
-            result.append({
-                'id': product.id,
-                'name': product.name,
-                'materials': materials_with_stock,
-                'in_price': product.in_price,
-                'out_price': product.out_price,
-                'other_price': product.other_price or 0,
-                'image_path': product.image_path,
-                'stock_count': product.stock_count or 0,
-                'possible_quantity': int(possible_quantity) if possible_quantity != float('inf') else 0,
-                'created_at': format_china_time(product.created_at),
-                'updated_at': format_china_time(product.updated_at)
-            })
+        if columnar:
+            return build_columnar(products, fields, self.FIELDS, lambda p: (
+                self._format_bom_items(boms.get(p.id, [])), self._format_bom_items(components.get(p.id, []))
+            ))
+        
+        serialize = compile_serializer(self.FIELDS, fields)
+        return [serialize(
+            product, self._format_bom_items(boms.get(product.id, [])), self._format_bom_items(components.get(product.id, []))
+        ) for product in products]
+    
+    def serialize_products(self, session, products, all_products: bool = False) -> list:
+        """将产品行序列化为完整字典（含配方材料和组件明细），all_products 为 True 时一次加载全部配方"""
+        return self._process_products(session, products, all_products=all_products)
+    
+    def _query_products(self, session, filters: dict = None):
+        """
+        构建产品查询，所有筛选和排序都在SQL中执行
+        
+        Args:
+            filters: search(关键词列表), min_stock/max_stock, min_price/max_price(售价),
+                     min_possible/max_possible, stock_filter(zero/low/normal),
+                     possible_filter(zero/low/high), sort_by, order
+        """
+        filters = filters or {}
+        query = apply_search(session.query(Product), Product.name, filters.get('search'))
+        query = apply_range(query, Product.stock_count, filters.get('min_stock'), filters.get('max_stock'))
+        query = apply_range(query, Product.out_price, filters.get('min_price'), filters.get('max_price'))
+        query = apply_range(query, Product.possible_quantity, filters.get('min_possible'), filters.get('max_possible'))
+        query = apply_level_filter(query, Product.stock_count, filters.get('stock_filter'))
+        
+        possible_filter = filters.get('possible_filter')
+        if possible_filter == 'zero':
+            query = query.filter(Product.possible_quantity <= 0)
+        elif possible_filter == 'low':
+            query = query.filter(Product.possible_quantity < Config.LOW_STOCK_THRESHOLD)
+        elif possible_filter == 'high':
+            query = query.filter(Product.possible_quantity >= Config.LOW_STOCK_THRESHOLD)
         
-        return result
+        return apply_sort(query, self.SORT_COLUMNS, filters.get('sort_by'), filters.get('order'), Product.id)
     
-    def get_all_products(self):
-        """获取所有配方并计算可制作数量"""
+    def _is_filtered(self, filters: dict) -> bool:
+        """是否有筛选条件（排序不算）"""
+        return any(value not in (None, '', []) for key, value in (filters or {}).items() if key not in ('sort_by', 'order'))
+    
+    def get_all_products(self, filters: dict = None, fields: list = None, columnar: bool = False):
+        """获取所有配方，支持筛选、排序、稀疏字段（只查询和序列化请求的字段）和列式格式"""
+        if columnar and fields is None:
+            fields = list(self.FIELDS)
         try:
             with self.db.session_scope() as session:
-                products = session.query(Product).order_by(Product.id).all()
-                return {'success': True, 'products': self._process_products(products)}
+                products = fetch_rows(session, project_fields(self._query_products(session, filters), fields, self.FIELDS, Product.id))
+                processed = self._process_products(
+                    session, products, all_products=not self._is_filtered(filters), fields=fields, columnar=columnar
+                )
+                return {'success': True, **(processed if columnar else {'products': processed})}
         except Exception as e:
             self.logger.error(f'获取所有产品失败: {str(e)}', exc_info=True)
             return {'success': False, 'message': '获取产品列表失败', 'products': []}
     
-    def get_products_paginated(self, offset: int, limit: int):
-        """分页获取产品"""
+    def iter_products(self, filters: dict = None, fields: list = None):
+        """流式逐个生成产品，按批读取数据库游标，每批只加载本批产品的配方和组件"""
         with self.db.session_scope() as session:
-            products = session.query(Product).order_by(Product.id).offset(offset).limit(limit).all()
-            return {'success': True, 'products': self._process_products(products)}
+            query = project_fields(self._query_products(session, filters), fields, self.FIELDS, Product.id)
+            for batch in iter_batches(session, query):
+                yield from self._process_products(session, batch, fields=fields)
+    
+    def rebuild_possible_quantities(self) -> dict:
+        """全量重建可制作数量（用于数据修复）"""
+        try:
+            with self.db.session_scope() as session:
+                return {'success': True, **bom_engine.rebuild_possible_quantities(session)}
+        except Exception as e:
+            self.logger.error(f'重建可制作数量异常: {str(e)}', exc_info=True)
+            return {'success': False, 'message': '重建失败'}
+    
+    def get_products_paginated(self, offset: int, limit: int, filters: dict = None, fields: list = None, columnar: bool = False):
+        """分页获取产品，总数使用 COUNT 查询，只加载当前页产品引用的材料和组件"""
+        if columnar and fields is None:
+            fields = list(self.FIELDS)
+        try:
+            with self.db.session_scope() as session:
+                query = self._query_products(session, filters)
+                total = query.order_by(None).with_entities(func.count(Product.id)).scalar()
+                products = fetch_rows(session, project_fields(query, fields, self.FIELDS, Product.id).offset(offset).limit(limit))
+                processed = self._process_products(session, products, fields=fields, columnar=columnar)
+                return {'success': True, 'total': total, **(processed if columnar else {'products': processed})}
+        except Exception as e:
+            self.logger.error(f'分页获取产品失败: {str(e)}', exc_info=True)
+            return {'success': False, 'message': '获取产品列表失败', 'products': []}
     
     def get_product_category(self) -> dict:
         """获取产品种类"""
         with self.db.session_scope() as session:
-            return {'success': True, 'count': session.query(Product).count()}
+            return {'success': True, 'count': session.query(func.count(Product.id)).scalar()}
 
     def get_products_count(self) -> dict:
         """获取产品总数"""
         with self.db.session_scope() as session:
-            products = session.query(Product).all()
-            total_count = sum(product.stock_count or 0 for product in products)
-            return {'success': True, 'count': total_count}
+            total_count = session.query(func.coalesce(func.sum(Product.stock_count), 0)).scalar()
+            return {'success': True, 'count': int(total_count)}
     
     def delete_product(self, product_id: int) -> dict:
         """删除产品"""
@@ -221,10 +382,11 @@ class ProductService:
                 if product.stock_count > 0:
                     return {'success': False, 'message': f'产品 {product.name} 已制作数量不为零（{product.stock_count}个），请先出库或还原后再删除'}
                 
-                materials = json.loads(product.materials or '{}')
-                if not self._update_material_references(session, product_id, materials, {}):
-                    return {'success': False, 'message': '更新材料引用失败'}
+                parent_names = self._get_parent_names(session, [product_id]).get(product_id)
+                if parent_names:
+                    return {'success': False, 'message': f'产品 {product.name} 被 {", ".join(parent_names)} 用作组件，请先修改配方后再删除'}
                 
+                self._set_product_boms(session, {product_id: ({}, {})})
                 session.delete(product)
                 self.logger.info(f'产品删除成功: {product_id} - {product.name}')
                 return {'success': True}
@@ -237,8 +399,9 @@ class ProductService:
         try:
             with self.db.session_scope() as session:
                 products = session.query(Product).filter(Product.id.in_(product_ids)).all()
+                parent_names = self._get_parent_names(session, [p.id for p in products])
                 failed_products = []
-                deleted_count = 0
+                deletable = []
                 
                 for product in products:
                     if product.stock_count and product.stock_count > 0:
@@ -247,14 +410,20 @@ class ProductService:
                             'reason': f'已制作数量不为零（{product.stock_count}个），请先出库或还原后再删除'
                         })
                         continue
-                    
-                    materials = json.loads(product.materials or '{}')
-                    if not self._update_material_references(session, product.id, materials, {}):
-                        failed_products.append({'name': product.name, 'reason': '更新材料引用失败'})
+                    if product.id in parent_names:
+                        failed_products.append({
+                            'name': product.name,
+                            'reason': f'被 {", ".join(parent_names[product.id])} 用作组件，请先修改配方后再删除'
+                        })
                         continue
                     
-                    session.delete(product)
-                    deleted_count += 1
+                    deletable.append(product.id)
+                
+                # 配方明细和产品各一次IN删除
+                if deletable:
+                    self._set_product_boms(session, {pid: ({}, {}) for pid in deletable})
+                    session.query(Product).filter(Product.id.in_(deletable)).delete(synchronize_session=False)
+                deleted_count = len(deletable)
                 
                 self.logger.info(f'批量删除产品: 成功{deleted_count}个')
                 if failed_products:
@@ -269,27 +438,132 @@ class ProductService:
             self.logger.error(f'批量删除产品异常: {str(e)}', exc_info=True)
             return {'success': False, 'message': '删除失败'}
 
-    def update_product(self, product_id: int, name: str, materials: dict = None, in_price: float = None, out_price: float = None, other_price: float = None, image_path: str = None) -> dict:
-        """更新产品"""
+    def batch_update_products(self, items: list) -> dict:
+        """
+        批量更新产品配方和其他费用，所有修改在同一事务内完成
+        
+        配方校验、写入和派生数据刷新均为集合操作：材料、组件各一次IN查询校验，
+        配方明细一次IN删除后批量插入，可制作数量和上级产品价格合并为一次重算。
+        
+        Args:
+            items: [{'id': 产品ID, 'materials': 材料字典, 'components': 组件字典, 'other_price': 其他费用, 'version': 版本号}]
+                   materials/components/other_price 省略时保持不变，version 省略时不检查版本
+        """
+        try:
+            updates = {}
+            for item in items:
+                updates[int(item['id'])] = item
+        except (ValueError, TypeError, KeyError):
+            return {'success': False, 'message': '无效的产品ID'}
+        
+        try:
+            with self.db.session_scope() as session:
+                products = {p.id: p for p in session.query(Product).filter(Product.id.in_(list(updates)))}
+                missing = set(updates) - set(products)
+                if missing:
+                    return {'success': False, 'message': f'产品ID {", ".join(str(pid) for pid in sorted(missing))} 不存在'}
+                
+                conflicts = [{'id': pid, 'name': products[pid].name, 'version': products[pid].version}
+                             for pid, item in updates.items()
+                             if item.get('version') is not None and str(item['version']) != str(products[pid].version)]
+                if conflicts:
+                    return {'success': False, 'conflict': True, 'message': '部分产品已被其他用户修改，请刷新后重试', 'conflicts': conflicts}
+                
+                bom_ids = [pid for pid, item in updates.items() if item.get('materials') is not None or item.get('components') is not None]
+                current = self._get_direct_boms(session, bom_ids) if bom_ids else {}
+                boms = {}
+                all_materials = {}
+                for pid in bom_ids:
+                    item = updates[pid]
+                    materials = item['materials'] if item.get('materials') is not None else current[pid][0]
+                    components = item['components'] if item.get('components') is not None else current[pid][1]
+                    boms[pid] = (materials, components)
+                    all_materials.update(materials)
+                
+                valid, error_msg, _ = self._validate_materials(session, all_materials)
+                if not valid:
+                    return {'success': False, 'message': error_msg}
+                valid, error_msg = self._validate_components(session, boms)
+                if not valid:
+                    return {'success': False, 'message': error_msg}
+                
+                # 校验通过后逐行条件递增版本：检查之后被并发修改的行不会更新，整批回滚并返回冲突
+                stale = [pid for pid in sorted(updates)
+                         if not self.db.bump_version(session, Product, pid, updates[pid].get('version'))]
+                if stale:
+                    session.rollback()
+                    conflicts = [{'id': pid, 'name': name, 'version': version} for pid, name, version in session.query(
+                        Product.id, Product.name, Product.version
+                    ).filter(Product.id.in_(stale)).order_by(Product.id)]
+                    self.logger.warning(f'批量更新产品冲突: {[c["id"] for c in conflicts]}')
+                    return {'success': False, 'conflict': True, 'message': '部分产品已被其他用户修改，请刷新后重试', 'conflicts': conflicts}
+                for product in products.values():
+                    session.expire(product, ['version'])
+                
+                costs = self._apply_boms(session, boms) if boms else {}
+                
+                for pid, item in updates.items():
+                    product = products[pid]
+                    if item.get('other_price') is not None:
+                        product.other_price = float(item['other_price'])
+                    if pid in boms and (boms[pid][0] or boms[pid][1]):
+                        product.in_price = costs[pid]
+                    if pid in boms or item.get('other_price') is not None:
+                        product.out_price = (product.in_price or 0) + (product.other_price or 0)
+                
+                self.logger.info(f'批量更新产品: {len(updates)}个, 配方变更{len(boms)}个')
+                return {
+                    'success': True,
+                    'updated_count': len(updates),
+                    'products': [{'id': pid, 'version': products[pid].version} for pid in sorted(updates)]
+                }
+        except (ValueError, TypeError) as e:
+            self.logger.warning(f'批量更新产品参数错误: {str(e)}')
+            return {'success': False, 'message': '参数无效'}
+        except Exception as e:
+            self.logger.error(f'批量更新产品异常: {str(e)}', exc_info=True)
+            return {'success': False, 'message': '更新失败'}
+    
+    def _update_conflict(self, session, product, expected_version) -> dict:
+        """版本冲突的返回结果，附带产品当前数据"""
+        self.logger.warning(f'产品更新冲突: {product.id} - 期望版本: {expected_version}, 当前版本: {product.version}')
+        return {'success': False, 'conflict': True, 'message': '产品已被其他用户修改，请刷新后重试', 'product': self._process_products(session, [product])[0]}
+    
+    def update_product(self, product_id: int, name: str, materials: dict = None, in_price: float = None, out_price: float = None, other_price: float = None, image_path: str = None, expected_version: int = None, components: dict = None) -> dict:
+        """更新产品，传入expected_version时版本号不匹配则返回冲突；materials/components为None时保持原配方"""
         try:
             with self.db.session_scope() as session:
                 product = session.query(Product).filter(Product.id == product_id).first()
                 if not product:
                     return {'success': False, 'message': '产品不存在'}
                 
-                if materials is not None:
-                    valid, error_msg, material_objs = self._validate_materials(session, materials)
+                # 先只读检查版本，配方校验通过后再递增版本，校验失败不消耗客户端持有的版本号
+                if expected_version is not None and str(expected_version) != str(product.version):
+                    return self._update_conflict(session, product, expected_version)
+                
+                bom_changed = materials is not None or components is not None
+                if bom_changed:
+                    current_materials, current_components = self._get_direct_boms(session, [product_id])[product_id]
+                    materials = current_materials if materials is None else materials
+                    components = current_components if components is None else components
+                    
+                    valid, error_msg, _ = self._validate_materials(session, materials)
                     if not valid:
                         return {'success': False, 'message': error_msg}
-                    
-                    old_materials = json.loads(product.materials or '{}')
-                    if not self._update_material_references(session, product_id, old_materials, materials):
-                        return {'success': False, 'message': '更新材料引用失败'}
-                    
-                    product.materials = json.dumps(materials)
-                    
-                    if materials:
-                        product.in_price = sum((material_objs.get(mid).in_price or 0) * qty for mid, qty in materials.items())
+                    valid, error_msg = self._validate_components(session, {product_id: (materials, components)})
+                    if not valid:
+                        return {'success': False, 'message': error_msg}
+                
+                # 条件递增仍以 version 做比较，防止检查之后被并发修改
+                bumped = self.db.bump_version(session, Product, product_id, expected_version)
+                session.refresh(product)
+                if not bumped:
+                    return self._update_conflict(session, product, expected_version)
+                
+                if bom_changed:
+                    cost = self._apply_boms(session, {product_id: (materials, components)})[product_id]
+                    if materials or components:
+                        product.in_price = cost
                 
                 product.name = name
                 if other_price is not None:
@@ -298,13 +572,13 @@ class ProductService:
                     product.in_price = in_price
                 if out_price is not None:
                     product.out_price = out_price
-                elif materials and out_price is None:
+                elif bom_changed and (materials or components):
                     product.out_price = (product.in_price or 0) + (product.other_price or 0)
                 if image_path is not None:
                     product.image_path = image_path
                 
                 self.logger.info(f'产品更新成功: {product_id} - {name}')
-                return {'success': True}
+                return {'success': True, 'version': product.version}
         except Exception as e:
             self.logger.error(f'产品更新异常: {product_id} - {str(e)}', exc_info=True)
             return {'success': False, 'message': '更新失败'}
@@ -317,18 +591,21 @@ class ProductService:
                 if not product:
                     return {'success': False, 'message': '产品不存在'}
                 
-                materials = json.loads(product.materials)
-                material_ids = [int(mid) for mid in materials.keys()]
-                materials_objs = session.query(Material).filter(Material.id.in_(material_ids)).all()
-                materials_map = {m.id: m for m in materials_objs}
+                # 多级配方按展开后的原材料用量扣减
+                bom = bom_engine.explode(product_id)
+                materials = {m.id: m for m in session.query(Material).filter(Material.id.in_(list(bom)))}
                 
-                for material_id_str, required_qty in materials.items():
-                    material = materials_map.get(int(material_id_str))
+                for material_id, required_qty in bom.items():
+                    material = materials.get(material_id)
                     if not material or material.stock_count < required_qty * quantity:
-                        return {'success': False, 'message': f'材料库存不足: {material.name if material else material_id_str}'}
+                        return {'success': False, 'message': f'材料库存不足: {material.name if material else material_id}'}
                 
-                for material_id_str, required_qty in materials.items():
-                    materials_map[int(material_id_str)].stock_count -= required_qty * quantity
+                for material_id, required_qty in bom.items():
+                    material = materials[material_id]
+                    consumed = int(required_qty * quantity)
+                    stock_before = material.stock_count
+                    material.stock_count -= consumed
+                    self.material_service.add_history(session, material, 'produce', -consumed, stock_before)
                 
                 stock_before = product.stock_count or 0
                 product.stock_count = stock_before + quantity
@@ -348,6 +625,7 @@ class ProductService:
                     stock_after=stock_after
                 )
                 session.add(history)
+                bom_engine.refresh_possible_quantities(session, material_ids=list(bom))
                 
                 self.logger.info(f'产品入库成功: {product_id}, 数量: {quantity}')
                 return {'success': True, 'product_name': product.name}
@@ -400,15 +678,16 @@ class ProductService:
                 if not product or (product.stock_count or 0) < quantity:
                     return {'success': False, 'message': '产品不存在或库存不足'}
                 
-                materials = json.loads(product.materials)
-                material_ids = [int(mid) for mid in materials.keys()]
-                materials_objs = session.query(Material).filter(Material.id.in_(material_ids)).all()
-                materials_map = {m.id: m for m in materials_objs}
+                bom = bom_engine.explode(product_id)
+                materials = {m.id: m for m in session.query(Material).filter(Material.id.in_(list(bom)))}
                 
-                for material_id_str, required_qty in materials.items():
-                    material = materials_map.get(int(material_id_str))
+                for material_id, required_qty in bom.items():
+                    material = materials.get(material_id)
                     if material:
-                        material.stock_count += required_qty * quantity
+                        restored = int(required_qty * quantity)
+                        stock_before = material.stock_count
+                        material.stock_count += restored
+                        self.material_service.add_history(session, material, 'restore', restored, stock_before)
                 
                 stock_before = product.stock_count or 0
                 product.stock_count = stock_before - quantity
@@ -428,6 +707,7 @@ class ProductService:
                     stock_after=stock_after
                 )
                 session.add(history)
+                bom_engine.refresh_possible_quantities(session, material_ids=list(bom))
                 
                 self.logger.info(f'产品还原成功: {product_id}, 数量: {quantity}')
                 return {'success': True, 'product_name': product.name}
@@ -483,18 +763,22 @@ class ProductService:
                             existing.out_price = out_price
                             existing.other_price = other_price
                             if import_stock > 0:
-                                existing.stock_count = (existing.stock_count or 0) + import_stock
+                                stock_before = existing.stock_count or 0
+                                existing.stock_count = stock_before + import_stock
+                                self._add_history(session, existing, 'import', import_stock, stock_before)
                             updated_count += 1
                         else:
                             product = Product(
                                 name=name,
-                                materials='{}',
                                 in_price=in_price,
                                 out_price=out_price,
                                 other_price=other_price,
                                 stock_count=import_stock
                             )
                             session.add(product)
+                            if import_stock > 0:
+                                session.flush()
+                                self._add_history(session, product, 'import', import_stock, 0)
                             created_count += 1
                 except Exception as e:
                     self.logger.error(f'第{row_num}行导入失败: {str(e)}')
@@ -539,7 +823,7 @@ class ProductService:
                     query = query.filter(Product.id.in_(product_ids))
                 
                 products = query.all()
-                processed_products = self._process_products(products)
+                processed_products = self._process_products(session, products, all_products=not product_ids)
                 
                 row_idx = 2
                 for product in processed_products:
@@ -11,38 +11,78 @@
 """
 
 import os
+import base64
 import logging
+import threading
 import pandas as pd
 from datetime import datetime
+from sqlalchemy import func, tuple_, or_, select, literal_column, text
 from dbs.db_manager import DBManager
-from dbs.models import OperationRecord
-from utils.timezone_utils import format_china_time, china_now
+from dbs.models import OperationRecord, operation_record_fts
+from utils.query_utils import project_fields, fetch_rows, compile_serializer, build_columnar, iter_batches
+from utils.timezone_utils import format_db_time, china_now
 from config import Config
 
 
 class RecordService:
     """操作记录服务 - 负责操作记录的查询和管理"""
     
+    # 聚合查询结果缓存：{(查询类型, 筛选条件, 表版本): 结果}，表版本变化后旧条目自然失效
+    _query_cache = {}
+    _query_cache_size = 128
+    _lock = threading.Lock()
+    # 全文索引是否可用（由迁移创建，首次查询时检测）
+    _fts_available = None
+    # trigram 分词至少需要3个字符才能走索引
+    FTS_MIN_LENGTH = 3
+    
+    # 稀疏字段 -> (依赖的列, 取值函数(记录行))
+    FIELDS = {
+        'id': ((OperationRecord.id,), lambda r: r.id),
+        'operation_type': ((OperationRecord.operation_type,), lambda r: r.operation_type),
+        'name': ((OperationRecord.name,), lambda r: r.name),
+        'quantity': ((OperationRecord.quantity,), lambda r: r.quantity),
+        'detail': ((OperationRecord.detail,), lambda r: r.detail),
+        'username': ((OperationRecord.username,), lambda r: r.username),
+        'created_at': ((OperationRecord.created_at,), lambda r: format_db_time(r.created_at))
+    }
+    
     def __init__(self):
         self.db = DBManager()
         self.logger = logging.getLogger(__name__)
     
-    def _format_record(self, r):
-        """格式化单条记录"""
-        return {
-            'id': r.id,
-            'operation_type': r.operation_type,
-            'name': r.name,
-            'quantity': r.quantity,
-            'detail': r.detail,
-            'username': r.username,
-            'created_at': format_china_time(r.created_at)
-        }
-    
-    def _apply_filters(self, query, filters: dict):
+    def _use_fts(self, session, term: str) -> bool:
+        """搜索词是否可以走全文索引"""
+        if RecordService._fts_available is None:
+            RecordService._fts_available = session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'operation_record_fts'"
+            )).first() is not None
+        return RecordService._fts_available and len(term) >= self.FTS_MIN_LENGTH
+    
+    def _apply_search(self, query, term: str, ranked: bool = False):
+        """
+        搜索操作详情、对象名称和操作用户：
+        搜索词不少于3个字符时走 FTS5 trigram 全文索引，ranked 为 True 时按 bm25 相关度排序；
+        更短的搜索词（trigram 无法索引）回退为 LIKE 子串匹配
+        """
+        if not self._use_fts(query.session, term):
+            pattern = f'%{term}%'
+            return query.filter(or_(OperationRecord.detail.like(pattern), OperationRecord.name.like(pattern),
+                                    OperationRecord.username.like(pattern)))
+        
+        # 整个搜索词作为短语匹配，双引号转义
+        match = literal_column('operation_record_fts').op('MATCH')('"' + term.replace('"', '""') + '"')
+        if ranked:
+            return query.join(operation_record_fts, operation_record_fts.c.rowid == OperationRecord.id).filter(
+                match
+            ).order_by(operation_record_fts.c.rank)
+        return query.filter(OperationRecord.id.in_(select(operation_record_fts.c.rowid).where(match)))
+    
+    def _apply_filters(self, query, filters: dict, ranked: bool = False):
         """应用筛选条件"""
-        if filters.get('search'):
-            query = query.filter(OperationRecord.detail.like(f"%{filters['search']}%"))
+        search = (filters.get('search') or '').strip()
+        if search:
+            query = self._apply_search(query, search, ranked)
         
         if filters.get('start_date'):
             try:
@@ -66,21 +106,171 @@ class RecordService:
         
         return query
     
-    def get_records_filtered(self, filters: dict):
-        """根据筛选条件获取操作记录"""
+    def _serialize_records(self, records, fields: list, columnar: bool) -> dict:
+        """序列化记录列表：默认 {records: [...]}，列式格式为 {columns, rows}"""
+        if columnar:
+            return build_columnar(records, fields, self.FIELDS)
+        serialize = compile_serializer(self.FIELDS, fields)
+        return {'records': [serialize(r) for r in records]}
+    
+    def _query_records(self, session, filters: dict, fields: list = None):
+        """构建按筛选条件排序的记录查询，fields 指定时只查询这些字段"""
+        # sort_order=relevance 时按搜索相关度排序，相关度相同按时间倒序
+        ranked = filters.get('sort_order') == 'relevance'
+        query = self._apply_filters(session.query(OperationRecord), filters, ranked)
+        query = query.order_by(
+            OperationRecord.created_at.asc() if filters.get('sort_order') == 'asc'
+            else OperationRecord.created_at.desc()
+        )
+        return project_fields(query, fields, self.FIELDS, OperationRecord.id)
+    
+    def get_records_filtered(self, filters: dict, fields: list = None, columnar: bool = False):
+        """根据筛选条件获取操作记录，fields 指定时只查询和输出这些字段，columnar 为 True 时返回列式格式"""
+        if columnar and fields is None:
+            fields = list(self.FIELDS)
         try:
             with self.db.session_scope() as session:
-                query = self._apply_filters(session.query(OperationRecord), filters)
-                query = query.order_by(
-                    OperationRecord.created_at.asc() if filters.get('sort_order') == 'asc' 
-                    else OperationRecord.created_at.desc()
-                )
-                records = query.all()
-                return {'success': True, 'records': [self._format_record(r) for r in records], 'total': len(records)}
+                records = fetch_rows(session, self._query_records(session, filters, fields))
+                return {'success': True, **self._serialize_records(records, fields, columnar), 'total': len(records)}
         except Exception as e:
             self.logger.error(f'筛选操作记录异常: {str(e)}', exc_info=True)
             return {'success': False, 'message': '查询失败'}
     
+    def iter_records(self, filters: dict, fields: list = None):
+        """流式逐条生成筛选后的记录，按批读取数据库游标，不物化完整结果"""
+        with self.db.session_scope() as session:
+            serialize = compile_serializer(self.FIELDS, fields)
+            for batch in iter_batches(session, self._query_records(session, filters, fields)):
+                for record in batch:
+                    yield serialize(record)
+    
+    def _encode_cursor(self, record) -> str:
+        """将最后一条记录的 (created_at, id) 编码为不透明游标"""
+        raw = f'{record.created_at.isoformat()}|{record.id}'
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+    
+    def _decode_cursor(self, cursor: str) -> tuple:
+        """解析游标，返回 (created_at, id)，格式错误时抛出 ValueError"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+            created_at, record_id = raw.rsplit('|', 1)
+            return datetime.fromisoformat(created_at), int(record_id)
+        except Exception:
+            raise ValueError('无效的游标')
+    
+    def _table_version(self, session) -> int:
+        """操作记录表版本：由触发器在每次增删改时递增，多进程部署时同样有效"""
+        return self.db.get_table_versions(session, ('operation_record',))[0]
+    
+    def _filters_key(self, filters: dict) -> tuple:
+        """将筛选条件转换为可哈希的缓存键"""
+        return tuple((key, tuple(sorted(value)) if isinstance(value, list) else value)
+                     for key, value in sorted(filters.items()) if key != 'sort_order')
+    
+    def _cached(self, session, kind: str, filters: dict, compute):
+        """按 (查询类型, 筛选条件, 表版本) 缓存聚合结果，未命中时调用 compute() 计算"""
+        key = (kind, self._filters_key(filters), self._table_version(session))
+        with RecordService._lock:
+            if key in RecordService._query_cache:
+                return RecordService._query_cache[key]
+        
+        result = compute()
+        with RecordService._lock:
+            if len(RecordService._query_cache) >= RecordService._query_cache_size:
+                RecordService._query_cache.clear()
+            RecordService._query_cache[key] = result
+        return result
+    
+    def count_records(self, session, filters: dict) -> int:
+        """统计筛选后的记录总数，结果按表版本缓存"""
+        return self._cached(session, 'count', filters, lambda: self._apply_filters(
+            session.query(func.count(OperationRecord.id)), filters
+        ).scalar())
+    
+    def _facet_counts(self, session, filters: dict, column) -> list:
+        """按列分组计数，按数量降序"""
+        rows = self._apply_filters(session.query(column, func.count()), filters).group_by(column).all()
+        return sorted(({'value': value, 'count': count} for value, count in rows),
+                      key=lambda item: (-item['count'], str(item['value'])))
+    
+    def get_facets(self, filters: dict) -> dict:
+        """
+        获取筛选面板的分组计数：操作类型、操作用户、日期
+        每个维度的计数排除该维度自身的筛选条件（选中某类型后仍可看到其他类型的数量），
+        分组查询走 (维度列, created_at) 覆盖索引，结果按表版本缓存
+        """
+        try:
+            with self.db.session_scope() as session:
+                def compute():
+                    day = func.date(OperationRecord.created_at)
+                    return {
+                        'operation_type': self._facet_counts(session, {**filters, 'operation_type': []}, OperationRecord.operation_type),
+                        'username': self._facet_counts(session, {**filters, 'username': []}, OperationRecord.username),
+                        'day': sorted(self._facet_counts(session, filters, day), key=lambda item: item['value'] or '')
+                    }
+                
+                facets = self._cached(session, 'facets', filters, compute)
+                return {'success': True, 'facets': facets, 'total': sum(item['count'] for item in facets['day'])}
+        except Exception as e:
+            self.logger.error(f'获取操作记录分组计数异常: {str(e)}', exc_info=True)
+            return {'success': False, 'message': '查询失败'}
+    
+    def get_records_page(self, filters: dict, cursor: str = None, limit: int = None, with_total: bool = False,
+                         fields: list = None, columnar: bool = False) -> dict:
+        """
+        游标分页获取操作记录，按 (created_at, id) 排序
+        游标条件走 (created_at, id) 复合索引的范围扫描，翻页代价与页码无关，
+        响应大小受 MAX_RECORDS_PAGE_SIZE 限制
+        
+        Args:
+            filters: 筛选条件，sort_order 为 asc 或 desc（游标分页不支持相关度排序，按 desc 处理）
+            cursor: 上一页返回的 next_cursor，为空表示第一页
+            limit: 每页数量
+            with_total: 是否返回筛选后的总数（COUNT 查询，按表版本缓存）
+            fields: 只查询和输出这些字段
+            columnar: 返回列式格式 {columns, rows}
+        """
+        if columnar and fields is None:
+            fields = list(self.FIELDS)
+        limit = min(max(int(limit or Config.DEFAULT_PAGE_SIZE), 1), Config.MAX_RECORDS_PAGE_SIZE)
+        try:
+            position = self._decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return {'success': False, 'message': str(e)}
+        
+        try:
+            with self.db.session_scope() as session:
+                key = tuple_(OperationRecord.created_at, OperationRecord.id)
+                query = self._apply_filters(session.query(OperationRecord), filters)
+                if filters.get('sort_order') == 'asc':
+                    if position:
+                        query = query.filter(key > tuple_(*position))
+                    query = query.order_by(OperationRecord.created_at.asc(), OperationRecord.id.asc())
+                else:
+                    if position:
+                        query = query.filter(key < tuple_(*position))
+                    query = query.order_by(OperationRecord.created_at.desc(), OperationRecord.id.desc())
+                
+                # 游标由 (created_at, id) 生成，稀疏字段时也需要查询 created_at
+                columns = None if fields is None else fields + ['created_at']
+                records = fetch_rows(session, project_fields(query, columns, self.FIELDS, OperationRecord.id).limit(limit + 1))
+                has_more = len(records) > limit
+                records = records[:limit]
+                
+                result = {
+                    'success': True,
+                    **self._serialize_records(records, fields, columnar),
+                    'limit': limit,
+                    'has_more': has_more,
+                    'next_cursor': self._encode_cursor(records[-1]) if has_more else None
+                }
+                if with_total:
+                    result['total'] = self.count_records(session, filters)
+                return result
+        except Exception as e:
+            self.logger.error(f'分页查询操作记录异常: {str(e)}', exc_info=True)
+            return {'success': False, 'message': '查询失败'}
+    
     def delete_records_filtered(self, filters: dict, username: str = '') -> dict:
         """根据筛选条件删除操作记录"""
         try:
@@ -95,8 +285,8 @@ class RecordService:
                     detail=f'删除{count}条操作记录',
                     username=username
                 ))
-                self.logger.info(f'删除操作记录成功: {count}条, 操作者: {username}')
-                return {'success': True, 'count': count}
+            self.logger.info(f'删除操作记录成功: {count}条, 操作者: {username}')
+            return {'success': True, 'count': count}
         except Exception as e:
             self.logger.error(f'删除操作记录异常: {str(e)}', exc_info=True)
             return {'success': False, 'message': '删除失败'}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: sync_service.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import logging
+from datetime import timedelta
+from config import Config
+from dbs.db_manager import DBManager
+from dbs.models import Material, Product, User, ProductMaterial, ProductComponent
+from services.material_service import MaterialService
+from services.product_service import ProductService
+from services.user_service import UserService
+from utils.query_utils import project_fields, fetch_rows, compile_serializer
+from utils.timezone_utils import china_now
+
+
+class SyncService:
+    """增量同步服务 - 按 change_log 游标返回新增、修改和删除的材料、产品、用户"""
+    
+    # 材料不含引用关系（客户端可由产品配方得出），用户不含密码和会话
+    MATERIAL_FIELDS = [field for field in MaterialService.FIELDS if field not in MaterialService.USED_FIELDS]
+    USER_FIELDS = ['id', 'username', 'role', 'avatar_path']
+    # 按保留期清理的 change_log 表（配方表的变更日志还用于配方缓存同步，不清理）
+    PRUNED_TABLES = ('material', 'product', 'user')
+    
+    def __init__(self):
+        self.db = DBManager()
+        self.product_service = ProductService()
+        self.logger = logging.getLogger(__name__)
+    
+    def _changed_ids(self, session, since: int) -> dict:
+        """
+        获取游标之后变更的行ID，返回 {'material': 集合, 'product': 集合, 'user': 集合}
+        产品的配方明细内嵌了材料和组件的名称、库存，因此引用了变更材料或变更组件的产品也视为变更
+        """
+        material_ids = self.db.get_changed_row_ids(session, 'material', since)
+        changed_products = self.db.get_changed_row_ids(session, 'product', since)
+        product_ids = (changed_products
+                       | self.db.get_changed_row_ids(session, 'product_material', since)
+                       | self.db.get_changed_row_ids(session, 'product_component', since))
+        if material_ids:
+            product_ids.update(product_id for product_id, in session.query(ProductMaterial.product_id).filter(
+                ProductMaterial.material_id.in_(material_ids)
+            ))
+        if changed_products:
+            product_ids.update(product_id for product_id, in session.query(ProductComponent.product_id).filter(
+                ProductComponent.component_id.in_(changed_products)
+            ))
+        return {
+            'material': material_ids,
+            'product': product_ids,
+            'user': self.db.get_changed_row_ids(session, 'user', since)
+        }
+    
+    def _split(self, items: list, ids) -> dict:
+        """拆分为 {upserted: 当前存在的行, deleted: 已删除的行ID}，ids 为 None（全量）时没有删除项"""
+        present = {item['id'] for item in items}
+        return {'upserted': items, 'deleted': sorted(ids - present) if ids is not None else []}
+    
+    def _query(self, session, model, ids):
+        """按ID筛选（ids 为 None 时全部），按ID排序"""
+        query = session.query(model).order_by(model.id)
+        return query if ids is None else query.filter(model.id.in_(ids))
+    
+    def _sync_materials(self, session, ids) -> dict:
+        """材料：不含 used_by_products、is_used"""
+        query = project_fields(self._query(session, Material, ids), self.MATERIAL_FIELDS, MaterialService.FIELDS, Material.id)
+        serialize = compile_serializer(MaterialService.FIELDS, self.MATERIAL_FIELDS)
+        return self._split([serialize(m, []) for m in fetch_rows(session, query)], ids)
+    
+    def _sync_products(self, session, ids) -> dict:
+        """产品：包含配方材料和组件明细"""
+        query = project_fields(self._query(session, Product, ids), None, ProductService.FIELDS, Product.id)
+        products = fetch_rows(session, query)
+        return self._split(self.product_service.serialize_products(session, products, all_products=ids is None), ids)
+    
+    def _sync_users(self, session, ids) -> dict:
+        """用户：只含 id、username、role、avatar_path"""
+        query = project_fields(self._query(session, User, ids), self.USER_FIELDS, UserService.FIELDS, User.id)
+        serialize = compile_serializer(UserService.FIELDS, self.USER_FIELDS)
+        return self._split([serialize(u, {}) for u in fetch_rows(session, query)], ids)
+    
+    def get_changes(self, since: int = 0) -> dict:
+        """
+        获取游标之后的变更
+        
+        Args:
+            since: 上次同步返回的 cursor；为0、早于 change_log 清理位置、超出当前游标（数据库已重建）
+                   或变更行数超过 SYNC_MAX_CHANGES 时返回全量数据，此时 full 为 True，客户端应替换本地副本
+        Returns:
+            {cursor, full, materials, products, users}，每类为 {upserted: [...], deleted: [ID]}
+        """
+        try:
+            with self.db.session_scope() as session:
+                # 先读游标再读数据：期间提交的变更最多在下次同步时重复下发，不会遗漏
+                cursor = self.db.get_change_cursor(session)
+                floor = self.db.get_change_log_floor(session)
+                ids = self._changed_ids(session, since) if 0 < since <= cursor and since >= floor else None
+                full = ids is None or sum(len(changed) for changed in ids.values()) > Config.SYNC_MAX_CHANGES
+                if full:
+                    ids = {'material': None, 'product': None, 'user': None}
+                
+                return {
+                    'success': True,
+                    'cursor': cursor,
+                    'full': full,
+                    'materials': self._sync_materials(session, ids['material']),
+                    'products': self._sync_products(session, ids['product']),
+                    'users': self._sync_users(session, ids['user'])
+                }
+        except Exception as e:
+            self.logger.error(f'获取增量同步数据异常: since={since} - {str(e)}', exc_info=True)
+            return {'success': False, 'message': '同步失败'}
+    
+    def prune_change_log(self) -> dict:
+        """清理超过保留期的材料、产品、用户变更日志"""
+        try:
+            with self.db.session_scope() as session:
+                before = china_now().replace(tzinfo=None) - timedelta(days=Config.CHANGE_LOG_RETENTION_DAYS)
+                count = self.db.prune_change_log(session, self.PRUNED_TABLES, before)
+                self.logger.info(f'清理变更日志: {count}条, 保留{Config.CHANGE_LOG_RETENTION_DAYS}天')
+                return {'success': True, 'count': count}
+        except Exception as e:
+            self.logger.error(f'清理变更日志异常: {str(e)}', exc_info=True)
+            return {'success': False, 'message': '清理失败'}
@@ -23,12 +23,29 @@ from PIL import Image, UnidentifiedImageError
 from flask import send_file, jsonify
 from dbs.db_manager import DBManager
 from dbs.models import User, OperationRecord
+from utils.query_utils import project_fields, fetch_rows, compile_serializer
 from config import Config
 
 
 class UserService:
     """用户服务 - 负责用户认证和用户管理"""
     
+    # 稀疏字段 -> (依赖的列, 取值函数(用户行, 活跃会话))，会话只在请求 online_devices/sessions 时解析
+    FIELDS = {
+        'id': ((User.id,), lambda u, active: u.id),
+        'username': ((User.username,), lambda u, active: u.username),
+        'password': ((User.password,), lambda u, active: u.password),
+        'role': ((User.role,), lambda u, active: u.role),
+        'avatar_path': ((User.avatar_path,), lambda u, active: u.avatar_path),
+        'online_devices': ((User.sessions,), lambda u, active: len(active)),
+        'sessions': ((User.sessions,), lambda u, active: [{
+            'session_id': sid,
+            'login_time': ts,
+            'device_info': f'设备{i+1}'
+        } for i, (sid, ts) in enumerate(active.items())])
+    }
+    SESSION_FIELDS = {'online_devices', 'sessions'}
+    
     def __init__(self):
         self.db = DBManager()
         self.logger = logging.getLogger(__name__)
@@ -239,30 +256,16 @@ class UserService:
             self.logger.error(f'用户删除异常: {username} - {str(e)}', exc_info=True)
             return {'success': False, 'message': '删除失败'}
     
-    def get_all_users(self) -> dict:
-        """获取所有用户"""
+    def get_all_users(self, fields: list = None) -> dict:
+        """获取所有用户，fields 指定时只查询和输出这些字段"""
         try:
             with self.db.session_scope() as session:
-                users = session.query(User).order_by(User.id).all()
-                result = []
-                
-                for u in users:
-                    active_sessions = self._get_active_sessions(u.sessions)
-                    
-                    result.append({
-                        'id': u.id,
-                        'username': u.username,
-                        'password': u.password,
-                        'role': u.role,
-                        'avatar_path': u.avatar_path,
-                        'online_devices': len(active_sessions),
-                        'sessions': [{
-                            'session_id': sid,
-                            'login_time': ts,
-                            'device_info': f'设备{i+1}'
-                        } for i, (sid, ts) in enumerate(active_sessions.items())]
-                    })
-                return {'success': True, 'users': result}
+                users = fetch_rows(session, project_fields(session.query(User).order_by(User.id), fields, self.FIELDS, User.id))
+                parse_sessions = fields is None or not self.SESSION_FIELDS.isdisjoint(fields)
+                serialize = compile_serializer(self.FIELDS, fields)
+                return {'success': True, 'users': [
+                    serialize(u, self._get_active_sessions(u.sessions) if parse_sessions else {}) for u in users
+                ]}
         except Exception as e:
             self.logger.error(f'获取用户列表异常: {str(e)}', exc_info=True)
             return {'success': False, 'message': '获取失败', 'users': []}
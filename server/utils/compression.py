@@ -0,0 +1,117 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: compression.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import request
+from config import Config
+
+try:
+    import brotli
+except ImportError:
+    # 未安装 brotli 时只使用 gzip
+    brotli = None
+
+
+# 支持的压缩编码
+ENCODINGS = ('br', 'gzip')
+
+# 可压缩的响应类型（图片、Excel 等已压缩格式不再压缩）
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/msgpack', 'application/x-ndjson',
+    'application/javascript', 'text/html', 'text/plain', 'text/css', 'text/csv'
+}
+
+
+class CompressedCache:
+    """压缩结果缓存：{(编码, 响应体摘要): 压缩后字节}，按总字节数 LRU 淘汰；同一版本的数据只压缩一次"""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+    
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+compressed_cache = CompressedCache(Config.COMPRESSION_CACHE_MAX_BYTES)
+
+
+def choose_encoding():
+    """按 Accept-Encoding 协商压缩编码：br（已安装 brotli 时）优先，其次 gzip，均不接受时返回 None"""
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    encoding = request.accept_encodings.best_match(offered)
+    return encoding if encoding in offered else None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """按指定编码压缩，gzip 固定 mtime 以保证相同内容输出相同字节"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=Config.BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=Config.GZIP_LEVEL, mtime=0)
+
+
+def _is_cacheable(response) -> bool:
+    """GET 的成功响应且未禁止缓存时，压缩结果可复用"""
+    return request.method == 'GET' and response.status_code == 200 and not response.cache_control.no_store
+
+
+def compress_response(response):
+    """压缩响应体：超过阈值的可压缩类型按 Accept-Encoding 压缩，可缓存的响应复用同一内容的压缩结果"""
+    if (not Config.ENABLE_COMPRESSION or response.direct_passthrough or response.is_streamed
+            or not 200 <= response.status_code < 300 or response.status_code == 204
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    
+    # 无论本次是否压缩，表示形式都随 Accept-Encoding 变化
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    data = response.get_data()
+    if encoding is None or len(data) < Config.COMPRESSION_MIN_SIZE:
+        return response
+    
+    if _is_cacheable(response):
+        key = (encoding, hashlib.blake2b(data, digest_size=16).digest())
+        compressed = compressed_cache.get(key)
+        if compressed is None:
+            compressed = compress(data, encoding)
+            compressed_cache.put(key, compressed)
+    else:
+        compressed = compress(data, encoding)
+    
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # 压缩后的字节与原表示不同，强 ETag 追加编码后缀以区分
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak=weak)
+    return response
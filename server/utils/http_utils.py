@@ -0,0 +1,138 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: http_utils.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import hashlib
+from functools import wraps
+from flask import request, abort, current_app, make_response
+from config import Config
+from utils.serialization import is_msgpack_request, wants_msgpack
+from utils.compression import ENCODINGS
+
+
+def get_expected_version(data: dict = None):
+    """获取客户端期望的版本号：优先 If-Match 请求头（"3" 或 W/"3"），其次请求体 version 字段"""
+    if_match = request.headers.get('If-Match', '').strip()
+    if if_match and if_match != '*':
+        value = if_match[2:] if if_match.startswith('W/') else if_match
+        value = value.strip('"')
+    else:
+        value = (data or {}).get('version')
+    
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        abort(400, description='无效的版本号')
+
+
+def get_request_data() -> dict:
+    """获取请求体：Content-Type 为 application/msgpack 时按 msgpack 解码，否则按 JSON 解析"""
+    if not is_msgpack_request():
+        return request.json
+    try:
+        data = current_app.json.unpackb(request.get_data())
+    except Exception:
+        abort(400, description='无效的msgpack请求体')
+    if not isinstance(data, dict):
+        abort(400, description='请求体必须为对象')
+    return data
+
+
+def get_pagination():
+    """获取分页参数 (page, page_size)，未传 page 时返回 None 表示不分页；page_size 限制在 MAX_PAGE_SIZE 以内"""
+    if 'page' not in request.args:
+        return None
+    page = request.args.get('page', 1, type=int)
+    page_size = request.args.get('page_size', Config.DEFAULT_PAGE_SIZE, type=int)
+    return max(page or 1, 1), min(max(page_size or Config.DEFAULT_PAGE_SIZE, 1), Config.MAX_PAGE_SIZE)
+
+
+def get_list_filters() -> dict:
+    """获取材料/产品列表通用的筛选和排序参数"""
+    return {
+        'search': request.args.getlist('search'),
+        'min_stock': request.args.get('min_stock', type=int),
+        'max_stock': request.args.get('max_stock', type=int),
+        'min_price': request.args.get('min_price', type=float),
+        'max_price': request.args.get('max_price', type=float),
+        'stock_filter': request.args.get('stock_filter', ''),
+        'sort_by': request.args.get('sort_by'),
+        'order': request.args.get('order', 'asc')
+    }
+
+
+def get_fields(available) -> list:
+    """获取 ?fields=a,b 稀疏字段参数，未传时返回 None 表示全部字段；包含未知字段时返回400"""
+    value = request.args.get('fields', '').strip()
+    if not value:
+        return None
+    fields = list(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in available]
+    if unknown:
+        abort(400, description=f'未知字段: {", ".join(unknown)}')
+    return fields
+
+
+def is_columnar() -> bool:
+    """是否请求列式响应格式（?format=columnar）"""
+    return request.args.get('format', '').lower() == 'columnar'
+
+
+def get_stream_format() -> str:
+    """获取 ?stream= 流式输出格式：ndjson 或 json（分块写出的JSON数组），未传时返回 None"""
+    value = request.args.get('stream', '').strip().lower()
+    if not value:
+        return None
+    if value not in ('ndjson', 'json'):
+        abort(400, description='stream 参数仅支持 ndjson 或 json')
+    if is_columnar():
+        abort(400, description='流式输出不支持列式格式')
+    return value
+
+
+def conditional_get(db, *tables, window=None):
+    """
+    条件请求装饰器：由相关表的版本号生成强 ETag，If-None-Match 命中时直接返回 304，不执行查询和序列化
+    
+    Args:
+        db: 读取表版本号使用的 DBManager
+        tables: 响应内容依赖的表，任一表增删改后 ETag 随之变化
+        window: 可选，返回时间窗口标识的函数（按时间范围统计的接口，窗口推移后 ETag 变化）
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with db.session_scope() as session:
+                versions = db.get_table_versions(session, tables)
+            key = repr((
+                request.path, sorted(request.args.items(multi=True)),
+                'msgpack' if wants_msgpack() else 'json', versions, window() if window else None
+            ))
+            etag = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+            
+            # 压缩后的表示使用 "<etag>-<编码>"，同样视为命中，304 返回客户端持有的那个 ETag
+            matched = next((tag for tag in [etag] + [f'{etag}-{e}' for e in ENCODINGS]
+                            if request.if_none_match.contains_weak(tag)), None)
+            if matched:
+                response = current_app.response_class(status=304)
+                response.set_etag(matched)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+            response.cache_control.no_cache = True
+            response.vary.update(('Accept', 'Accept-Encoding'))
+            return response
+        return wrapper
+    return decorator
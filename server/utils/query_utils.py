@@ -0,0 +1,98 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: query_utils.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+from sqlalchemy import or_
+from config import Config
+
+
+def apply_search(query, column, keywords):
+    """名称搜索：任一关键词包含匹配（转义 % 和 _）"""
+    keywords = [k.strip() for k in (keywords or []) if k and k.strip()]
+    if keywords:
+        query = query.filter(or_(*(column.contains(k, autoescape=True) for k in keywords)))
+    return query
+
+
+def apply_range(query, column, low=None, high=None):
+    """区间筛选 low <= column <= high，未指定的边界不限制"""
+    if low is not None:
+        query = query.filter(column >= low)
+    if high is not None:
+        query = query.filter(column <= high)
+    return query
+
+
+def apply_level_filter(query, column, level: str, threshold: int = None):
+    """库存等级筛选：zero 为0，low 不超过阈值，normal 超过阈值"""
+    threshold = Config.LOW_STOCK_THRESHOLD if threshold is None else threshold
+    if level == 'zero':
+        query = query.filter(column <= 0)
+    elif level == 'low':
+        query = query.filter(column <= threshold)
+    elif level == 'normal':
+        query = query.filter(column > threshold)
+    return query
+
+
+def apply_sort(query, sort_columns: dict, sort_by: str, order: str, id_column):
+    """按白名单中的排序键排序，以ID作为次序键保证分页稳定；未知排序键按ID排序"""
+    column = sort_columns.get(sort_by)
+    if column is None:
+        return query.order_by(id_column.desc() if order == 'desc' else id_column.asc())
+    if order == 'desc':
+        return query.order_by(column.desc(), id_column.desc())
+    return query.order_by(column.asc(), id_column.asc())
+
+
+def project_fields(query, fields, field_specs: dict, id_column):
+    """按请求字段裁剪查询列，field_specs 为 {字段: (依赖的列, 取值函数)}，始终包含ID列；fields为None时查询全部字段的列"""
+    columns = {id_column.key: id_column}
+    for field in (field_specs if fields is None else fields):
+        for column in field_specs[field][0]:
+            columns.setdefault(column.key, column)
+    return query.with_entities(*columns.values())
+
+
+def fetch_rows(session, query) -> list:
+    """以 Core select 执行列查询，返回普通行元组，不构建ORM对象、不进入身份映射"""
+    return session.connection().execute(query.statement).all()
+
+
+def compile_serializer(field_specs: dict, fields=None):
+    """
+    预编译行序列化函数：按字段顺序生成 serialize(row, *context) -> dict，
+    (字段, 取值函数) 列表在编译时确定，逐行序列化时不再查找字段定义
+    """
+    getters = tuple((field, field_specs[field][1]) for field in (field_specs if fields is None else fields))
+    
+    def serialize(row, *context):
+        return {field: getter(row, *context) for field, getter in getters}
+    
+    return serialize
+
+
+def build_columnar(rows, fields: list, field_specs: dict, context=None) -> dict:
+    """按字段顺序构建列式结果 {columns, rows}，不为每行创建字典；context(row) 返回取值函数的附加参数"""
+    getters = [field_specs[field][1] for field in fields]
+    result = []
+    for row in rows:
+        args = context(row) if context else ()
+        result.append([getter(row, *args) for getter in getters])
+    return {'columns': list(fields), 'rows': result}
+
+
+def iter_batches(session, query, size: int = None):
+    """以 Core select + yield_per 逐批读取数据库游标，每次返回一批行元组，内存占用与结果集大小无关"""
+    size = size or Config.STREAM_BATCH_SIZE
+    result = session.connection().execute(query.statement.execution_options(yield_per=size))
+    for batch in result.partitions(size):
+        yield batch
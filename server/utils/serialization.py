@@ -0,0 +1,155 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Author  : nickdecodes
+@Email   : 
+@Usage   : 
+@Filename: serialization.py
+@DateTime: 2026/10/19 10:00
+@Software: vscode
+"""
+
+import logging
+import msgpack
+from decimal import Decimal
+from datetime import date, datetime, time
+from flask import request, current_app, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from utils.timezone_utils import format_db_time
+from config import Config
+
+try:
+    import orjson
+except ImportError:
+    # 未安装 orjson 时回退到标准库 json
+    orjson = None
+
+
+logger = logging.getLogger(__name__)
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+NEGOTIABLE_MIMETYPES = ['application/json', MSGPACK_MIMETYPE]
+
+
+def wants_msgpack() -> bool:
+    """Accept 头优先 application/msgpack 时返回True；未声明或 */* 时仍为JSON"""
+    if not request:
+        return False
+    return request.accept_mimetypes.best_match(NEGOTIABLE_MIMETYPES, default='application/json') == MSGPACK_MIMETYPE
+
+
+def is_msgpack_request() -> bool:
+    """请求体是否为 msgpack 编码"""
+    return request.mimetype in (MSGPACK_MIMETYPE, 'application/x-msgpack')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON 编解码：安装了 orjson 时使用 orjson（UTF-8 直接输出中文），否则回退到标准库 json；
+    两种方式的 datetime 均为 'YYYY-MM-DD HH:MM:SS'，Decimal 均为数值，服务层可直接返回这些类型
+    """
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, datetime):
+            return format_db_time(o)
+        if isinstance(o, (date, time)):
+            return o.isoformat()
+        if isinstance(o, Decimal):
+            return float(o)
+        return DefaultJSONProvider.default(o)
+    
+    def _orjson_option(self, indent: bool = False) -> int:
+        """orjson 选项：日期交给 default 处理以保持格式一致，允许非字符串键"""
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+    
+    def dumps(self, obj, **kwargs) -> str:
+        # orjson 只支持缩进和紧凑两种格式，其他参数回退到标准库
+        if orjson is None or not set(kwargs) <= {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_option(bool(kwargs.get('indent')))).decode()
+    
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        # 直接写出 orjson 编码的字节，不经过 str 往返
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        option = self._orjson_option(indent) | orjson.OPT_APPEND_NEWLINE
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=option), mimetype=self.mimetype)
+
+
+class NegotiatingJSONProvider(FastJSONProvider):
+    """jsonify 的响应层：按 Accept 头协商输出 JSON（默认）或 msgpack"""
+    
+    def packb(self, obj) -> bytes:
+        """msgpack 编码，日期、Decimal 等类型与 JSON 输出保持一致"""
+        return msgpack.packb(obj, default=self.default, use_bin_type=True)
+    
+    def unpackb(self, data: bytes):
+        """msgpack 解码"""
+        return msgpack.unpackb(data, raw=False)
+    
+    def response(self, *args, **kwargs):
+        if not wants_msgpack():
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.packb(obj), mimetype=MSGPACK_MIMETYPE)
+
+
+def stream_response(items, key: str, stream_format: str, with_total: bool = False):
+    """
+    流式输出列表，边生成边写出，不拼接完整响应；每 STREAM_BATCH_SIZE 条合并为一个分块写出
+    
+    Args:
+        items: 逐条生成字典的迭代器
+        key: JSON 数组格式下列表所在的字段名
+        stream_format: ndjson 每行一个对象；json 为分块写出的 {key: [...], success: true}
+        with_total: json 格式是否在末尾附带 total
+    """
+    dumps = current_app.json.dumps
+    ndjson = stream_format == 'ndjson'
+    separator = '\n' if ndjson else ','
+    
+    def generate():
+        # success 放在数组之后写出，中途出错时仍能以 success: false 结束文档
+        if not ndjson:
+            yield f'{{"{key}": ['
+        count = 0
+        chunk = []
+        try:
+            for item in items:
+                chunk.append(dumps(item))
+                if len(chunk) >= Config.STREAM_BATCH_SIZE:
+                    yield (separator if count else '') + separator.join(chunk)
+                    count += len(chunk)
+                    chunk = []
+            if chunk:
+                yield (separator if count else '') + separator.join(chunk)
+                count += len(chunk)
+        except Exception as e:
+            logger.error(f'流式输出中断: {key} - {str(e)}', exc_info=True)
+            if ndjson:
+                yield ('\n' if count else '') + dumps({'success': False, 'message': '查询中断'}) + '\n'
+            else:
+                yield '], "success": false, "message": ' + dumps('查询中断') + '}'
+            return
+        if ndjson:
+            yield '\n' if count else ''
+        else:
+            yield '], "success": true' + (f', "total": {count}' if with_total else '') + '}'
+    
+    mimetype = NDJSON_MIMETYPE if ndjson else 'application/json'
+    return current_app.response_class(stream_with_context(generate()), mimetype=mimetype)
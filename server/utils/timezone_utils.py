@@ -10,6 +10,7 @@
 @Software: vscode
 """
 
+from functools import lru_cache
 from datetime import datetime, timezone, timedelta
 
 # 中国时区
@@ -26,4 +27,13 @@ def format_china_time(dt):
     if dt.tzinfo is None:
         # 如果没有时区信息，假设是中国时间
         dt = dt.replace(tzinfo=CHINA_TZ)
-    return dt.strftime('%Y-%m-%d %H:%M:%S')
\ No newline at end of file
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+@lru_cache(maxsize=4096)
+def format_db_time(dt):
+    """格式化数据库读取的时间（无时区，视为中国时间），与 format_china_time 输出一致；批量写入的相同时间戳只格式化一次"""
+    if dt is None:
+        return None
+    if dt.tzinfo is not None:
+        return format_china_time(dt)
+    return dt.isoformat(' ', 'seconds')
\ No newline at end of file
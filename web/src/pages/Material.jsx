@@ -103,7 +103,7 @@ const Material = ({ user }) => {
     try {
       const image_path = editFileList[0]?.response?.image_path || (editFileList[0]?.url ? editingRecord.image_path : null);
       const startTime = Date.now();
-      const response = await api.updateMaterial(editingRecord.id, { ...values, username: user.username, image_path });
+      const response = await api.updateMaterial(editingRecord.id, { ...values, username: user.username, image_path, version: editingRecord.version });
       const elapsed = Date.now() - startTime;
       const minDelay = Math.max(0, 500 - elapsed);
       
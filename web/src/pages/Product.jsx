@@ -245,7 +245,8 @@ const Product = ({ user }) => {
         materials: materials,
         in_price: values.in_price || 0,
         out_price: values.out_price || 0,
-        other_price: values.other_price || 0
+        other_price: values.other_price || 0,
+        version: editingProduct.version
       };
       
       const response = await api.updateProduct(editingProduct.id, updateData);
@@ -266,7 +267,8 @@ const Product = ({ user }) => {
           
           if (imageResult.success) {
             await api.updateProduct(editingProduct.id, {
-              image_path: imageResult.image_path
+              image_path: imageResult.image_path,
+              version: response.data.version
             });
           }
         }
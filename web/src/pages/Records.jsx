@@ -1,16 +1,24 @@
 import { ExportOutlined, SearchOutlined } from '@ant-design/icons';
 import { Button, Card, Col, DatePicker, Input, Modal, Row, Select, Space, Spin, Table, Tag, Tooltip } from 'antd';
 import dayjs from 'dayjs';
-import { useCallback, useEffect, useMemo, useState } from 'react';
+import { useCallback, useEffect, useMemo, useRef, useState } from 'react';
 import { api } from '../utils/api';
 import { useResponsive } from '../utils/device';
 
 const { RangePicker } = DatePicker;
+// 游标分页每页条数（服务端上限 MAX_RECORDS_PAGE_SIZE）
+const RECORDS_PAGE_SIZE = 100;
 
 const Records = () => {
   const [records, setRecords] = useState([]);
   const [filteredRecords, setFilteredRecords] = useState([]);
   const [loading, setLoading] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [totalRecords, setTotalRecords] = useState(0);
+  // 加载更多时沿用第一页的筛选条件，避免弹窗中未提交的修改混入
+  const queryRef = useRef({});
+  const [facets, setFacets] = useState({ operation_type: [], username: [] });
   const [searchText, setSearchText] = useState(() => localStorage.getItem('records_searchText') || '');
   const [dateRange, setDateRange] = useState(() => {
     const saved = localStorage.getItem('records_dateRange');
@@ -45,12 +53,15 @@ const Records = () => {
         sortOrder: params.sortOrder !== undefined ? params.sortOrder : sortOrder
       };
       
-      const response = await api.getRecords(requestParams);
-      const { data } = response.data;
+      queryRef.current = requestParams;
+      const response = await api.getRecords({ ...requestParams, limit: RECORDS_PAGE_SIZE, withTotal: true });
+      const { data, next_cursor, total } = response.data;
       
       const recordsData = data || [];
       setRecords(recordsData);
       setFilteredRecords(recordsData);
+      setNextCursor(next_cursor || null);
+      setTotalRecords(total || 0);
     } catch (error) {
       console.error('加载记录失败:', error);
     } finally {
@@ -58,6 +69,24 @@ const Records = () => {
     }
   };
 
+  const loadMoreRecords = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const response = await api.getRecords({ ...queryRef.current, cursor: nextCursor, limit: RECORDS_PAGE_SIZE });
+      const { data, next_cursor } = response.data;
+      
+      const recordsData = [...records, ...(data || [])];
+      setRecords(recordsData);
+      setFilteredRecords(recordsData);
+      setNextCursor(next_cursor || null);
+    } catch (error) {
+      console.error('加载更多记录失败:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // 防抖搜索
   useEffect(() => {
     const timer = setTimeout(() => {
@@ -172,11 +201,18 @@ const Records = () => {
     loadRecords({ search: '', dateRange: [], operationType: [], username: [], sortOrder: 'desc' });
   };
 
-  // 动态生成筛选选项
-  const uniqueUsers = useMemo(() => {
-    const users = [...new Set(records.map(r => r.username))].filter(Boolean);
-    return users.map(user => ({ value: user, label: user }));
-  }, [records]);
+  // 筛选选项来自当前日期范围内的分组计数，不依赖已加载的记录页
+  useEffect(() => {
+    api.getRecordFacets({ dateRange: dateRange || [] })
+      .then(response => setFacets(response.data.facets || { operation_type: [], username: [] }))
+      .catch(error => console.error('加载筛选选项失败:', error));
+  }, [dateRange]);
+
+  const toFacetOptions = (items = []) => items
+    .filter(item => item.value)
+    .map(item => ({ value: item.value, label: `${item.value} (${item.count})` }));
+  const operationTypeOptions = useMemo(() => toFacetOptions(facets.operation_type), [facets]);
+  const usernameOptions = useMemo(() => toFacetOptions(facets.username), [facets]);
 
   const renderSearchBar = () => isMobile ? (
     <Row gutter={[16, 16]}>
@@ -350,7 +386,12 @@ const Records = () => {
         {renderSearchBar()}
         {isMobile ? renderMobileCards() : renderDesktopTable()}
         <div style={{ textAlign: 'center', padding: '8px 0', fontSize: '12px' }}>
-          共 {filteredRecords.length} 条记录
+          已加载 {filteredRecords.length} / 共 {totalRecords} 条记录
+          {nextCursor && (
+            <Button type="link" size="small" onClick={loadMoreRecords} loading={loadingMore}>
+              加载更多
+            </Button>
+          )}
         </div>
       </Card>
       
@@ -402,28 +443,7 @@ const Records = () => {
               localStorage.setItem('records_operationTypeFilter', JSON.stringify(value));
             }}
             style={{ width: '100%' }}
-            options={[
-              { label: '用户登录', value: '用户登录' },
-              { label: '用户登出', value: '用户登出' },
-              { label: '材料入库', value: '材料入库' },
-              { label: '材料出库', value: '材料出库' },
-              { label: '添加材料', value: '添加材料' },
-              { label: '更新材料', value: '更新材料' },
-              { label: '删除材料', value: '删除材料' },
-              { label: '导出材料', value: '导出材料' },
-              { label: '产品入库', value: '产品入库' },
-              { label: '产品出库', value: '产品出库' },
-              { label: '产品还原', value: '产品还原' },
-              { label: '添加产品', value: '添加产品' },
-              { label: '更新产品', value: '更新产品' },
-              { label: '删除产品', value: '删除产品' },
-              { label: '导出产品', value: '导出产品' },
-              { label: '添加用户', value: '添加用户' },
-              { label: '编辑用户', value: '编辑用户' },
-              { label: '删除用户', value: '删除用户' },
-              { label: '导出用户', value: '导出用户' },
-              { label: '移除设备', value: '移除设备' }
-            ]}
+            options={operationTypeOptions}
           />
           <Select
             placeholder="输入或选择操作用户"
@@ -435,7 +455,7 @@ const Records = () => {
               localStorage.setItem('records_usernameFilter', JSON.stringify(value));
             }}
             style={{ width: '100%' }}
-            options={uniqueUsers}
+            options={usernameOptions}
             showSearch
             filterOption={false}
           />
@@ -56,6 +56,20 @@ axiosInstance.interceptors.response.use(
   }
 );
 
+// 查询参数序列化：数组展开为重复键（search=a&search=b），忽略空值
+const serializeParams = (params) => {
+  const searchParams = new URLSearchParams();
+  Object.entries(params).forEach(([key, value]) => {
+    if (value === undefined || value === null || value === '') return;
+    if (Array.isArray(value)) {
+      value.forEach(item => searchParams.append(key, item));
+    } else {
+      searchParams.append(key, value);
+    }
+  });
+  return searchParams.toString();
+};
+
 const request = {
   get: (url, params) => axiosInstance.get(url, { params }),
   post: (url, data) => axiosInstance.post(url, data),
@@ -98,10 +112,9 @@ export const api = {
   downloadUserImportTemplate: () => downloadTemplate('/users/import-template'),
 
   // 材料相关
-  getMaterials: (page = 1, pageSize = 20, filters = {}) => {
-    const hasFilters = filters.search || filters.stock_filter || filters.reference_filter;
-    return hasFilters ? request.get('/materials') : request.get('/materials', { page, page_size: pageSize });
-  },
+  // filters: search, stock_filter, reference_filter, min_stock, max_stock, min_price, max_price, sort_by, order
+  getMaterials: (page = 1, pageSize = 20, filters = {}) =>
+    axiosInstance.get('/materials', { params: { ...filters, page, page_size: pageSize }, paramsSerializer: serializeParams }),
   getAllMaterials: () => request.get('/materials'),
   addMaterial: (data) => request.post('/materials', data),
   checkRelatedProducts: (materialId, data) => request.post(`/materials/${materialId}/check-products`, data),
@@ -116,10 +129,9 @@ export const api = {
 
   
   // 产品相关
-  getProducts: (page = 1, pageSize = 20, filters = {}) => {
-    const hasFilters = filters.search || filters.stock_filter || filters.possible_filter;
-    return hasFilters ? request.get('/products') : request.get('/products', { page, page_size: pageSize });
-  },
+  // filters: search, stock_filter, possible_filter, min_stock, max_stock, min_price, max_price, min_possible, max_possible, sort_by, order
+  getProducts: (page = 1, pageSize = 20, filters = {}) =>
+    axiosInstance.get('/products', { params: { ...filters, page, page_size: pageSize }, paramsSerializer: serializeParams }),
   getAllProducts: () => request.get('/products'),
   addProduct: (data) => request.post('/products', data),
   updateProduct: (productId, data) => request.put(`/products/${productId}`, data),
@@ -136,7 +148,7 @@ export const api = {
 
   // 操作记录
   getRecords: (params = {}) => {
-    const { search = '', dateRange = [], operationType = [], username = [], sortOrder = 'desc' } = params;
+    const { search = '', dateRange = [], operationType = [], username = [], sortOrder = 'desc', cursor = '', limit, withTotal = false } = params;
     const queryParams = { sort_order: sortOrder };
     
     if (search) queryParams.search = search;
@@ -146,23 +158,29 @@ export const api = {
     }
     if (operationType?.length) queryParams.operation_type = operationType;
     if (username?.length) queryParams.username = username;
+    // 游标分页：传入 limit 或上一页返回的 next_cursor
+    if (cursor) queryParams.cursor = cursor;
+    if (limit) queryParams.limit = limit;
+    if (withTotal) queryParams.with_total = true;
     
-    return axiosInstance.get('/records', { 
-      params: queryParams,
-      paramsSerializer: params => {
-        const searchParams = new URLSearchParams();
-        Object.entries(params).forEach(([key, value]) => {
-          if (Array.isArray(value)) {
-            value.forEach(item => searchParams.append(key, item));
-          } else {
-            searchParams.append(key, value);
-          }
-        });
-        return searchParams.toString();
-      }
-    });
+    return axiosInstance.get('/records', { params: queryParams, paramsSerializer: serializeParams });
   },
   getAllRecords: () => request.get('/records'),
+  // 筛选面板分组计数：{ facets: { operation_type, username, day }, total }
+  getRecordFacets: (params = {}) => {
+    const { search = '', dateRange = [], operationType = [], username = [] } = params;
+    const queryParams = {};
+    
+    if (search) queryParams.search = search;
+    if (dateRange?.length === 2) {
+      queryParams.start_date = dateRange[0].format('YYYY-MM-DD');
+      queryParams.end_date = dateRange[1].format('YYYY-MM-DD');
+    }
+    if (operationType?.length) queryParams.operation_type = operationType;
+    if (username?.length) queryParams.username = username;
+    
+    return axiosInstance.get('/records/facets', { params: queryParams, paramsSerializer: serializeParams });
+  },
 
   exportRecords: (params = {}) => {
     const { search = '', dateRange = [], operationType = [], username = [], sortOrder = 'desc', deleteAfterExport = false } = params;